@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+WatermarkApp 性能基准脚本
+
+用法:
+    python benchmark.py encode [图片 ...]    各输出格式/编码预设的编码耗时与输出字节数
+    python benchmark.py startup              冷启动导入界面模块的耗时（及首次导出时才导入的模块），
+                                             到首帧绘制、到启动完成的时间（后两项需要图形界面）
+    python benchmark.py export [图片 ...]    多进程导出：共享内存与pickle传输的耗时、传输字节数和峰值内存
+    python benchmark.py mapped [图片 ...]    未压缩BMP/TIFF：内存映射区域合成与整幅解码的耗时、读写字节数和峰值内存
+不指定图片时使用合成的测试图片。
+"""
+
+import argparse
+import io
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+sys.path.insert(0, SRC_DIR)
+
+from PIL import Image
+
+import encoders
+
+
+def make_sample_image(width=4000, height=3000):
+    """生成带噪声和渐变的合成测试图片（接近照片的压缩难度）"""
+    noise = Image.effect_noise((width, height), 40)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    return Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5)))
+
+
+def load_images(paths, width, height):
+    if not paths:
+        return [("合成图片", make_sample_image(width, height))]
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            images.append((os.path.basename(path), img.convert("RGB")))
+    return images
+
+
+def bench_encode(args):
+    """测量每种格式和预设的编码时间与输出大小"""
+    images = load_images(args.images, args.width, args.height)
+    print(f"{'图片':<16}{'格式':<6}{'预设':<10}{'耗时(ms)':>10}{'字节数':>12}")
+    for name, image in images:
+        for image_format in ("JPEG", "PNG", "WEBP"):
+            for preset in encoders.ENCODER_PRESETS[image_format]:
+                best = None
+                size = 0
+                for _ in range(args.repeat):
+                    buffer = io.BytesIO()
+                    start = time.perf_counter()
+                    encoders.save_image(image, buffer, image_format, preset, args.quality)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                    size = buffer.tell()
+                print(f"{name[:15]:<16}{image_format:<6}{preset:<10}{best * 1000:>10.1f}{size:>12}")
+
+
+# 启动后第一次导出/试运行/分发时才导入的模块
+DEFERRED_MODULES = ("parallel_export", "autotune", "preflight", "spool")
+
+
+def measure_import(modules, preload=()):
+    """在新的解释器中导入 modules，返回耗时（秒）；preload 先导入，不计入耗时"""
+    code = ("import sys, time; sys.path.insert(0, %r)\n" % SRC_DIR
+            + "".join(f"import {name}\n" for name in preload)
+            + "start = time.perf_counter()\n"
+            + "".join(f"import {name}\n" for name in modules)
+            + "print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(result.stdout)
+
+
+def bench_startup(args):
+    """测量冷启动导入界面模块的耗时，再启动应用子进程，测量从进程创建到首帧绘制、到启动完成的时间"""
+    gui_import = [measure_import(["watermark_app"]) for _ in range(args.repeat)]
+    deferred_import = [measure_import(DEFERRED_MODULES, preload=["watermark_app"]) for _ in range(args.repeat)]
+    print(f"导入界面模块: 中位数 {statistics.median(gui_import) * 1000:.0f} ms，最小 {min(gui_import) * 1000:.0f} ms")
+    print(f"首次导出时导入 {'/'.join(DEFERRED_MODULES)}: 中位数 {statistics.median(deferred_import) * 1000:.0f} ms，"
+          f"最小 {min(deferred_import) * 1000:.0f} ms")
+
+    env = dict(os.environ, WATERMARK_STARTUP_BENCH="1")
+    first_paint, complete = [], []
+    for _ in range(args.repeat):
+        start = time.time()
+        result = subprocess.run([sys.executable, os.path.join(SRC_DIR, "main.py")],
+                                env=env, capture_output=True, text=True, timeout=60)
+        timings = {}
+        for line in result.stdout.splitlines():
+            if line.startswith("STARTUP "):
+                _, name, value = line.split()
+                timings[name] = float(value)
+        if "first_paint" not in timings:
+            print("启动失败：")
+            print(result.stderr)
+            return
+        first_paint.append(timings["first_paint"] - start)
+        complete.append(timings["complete"] - start)
+    print(f"首帧绘制: 中位数 {statistics.median(first_paint) * 1000:.0f} ms，最小 {min(first_paint) * 1000:.0f} ms")
+    print(f"启动完成: 中位数 {statistics.median(complete) * 1000:.0f} ms，最小 {min(complete) * 1000:.0f} ms")
+
+
+def bench_export(args):
+    """比较共享内存与pickle两种传输方式；每种方式在独立子进程中运行，分别统计峰值内存"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = list(args.images)
+        if not paths:
+            # 测试图片在父进程中生成，不计入各传输方式子进程的峰值内存
+            sample = make_sample_image(args.width, args.height)
+            for i in range(args.count):
+                path = os.path.join(tmp_dir, f"sample_{i}.png")
+                sample.save(path, compress_level=1)
+                paths.append(path)
+            del sample
+        transports = ("shm", "pickle") if args.transport == "both" else (args.transport,)
+        for transport in transports:
+            command = [sys.executable, os.path.abspath(__file__), "export-run", transport,
+                       str(args.workers)] + paths
+            subprocess.run(command, check=True)
+
+
+def run_export(transport, workers, paths):
+    import parallel_export
+    from watermark_engine import WatermarkLayer, WatermarkRenderer
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = os.path.join(tmp_dir, "out")
+        os.makedirs(output_dir)
+
+        renderer = WatermarkRenderer()
+        layers = (WatermarkLayer(kind="text", text="Benchmark", font_size=200, opacity=0.6),)
+        jobs = [parallel_export.ExportJob(path, os.path.join(output_dir, f"{i}.jpg"), "JPEG")
+                for i, path in enumerate(paths)]
+        exporter = parallel_export.ParallelExporter(lambda size, job, image=None: renderer.build_plan(layers, size),
+                                                    max_workers=workers or None, transport=transport)
+
+        start = time.perf_counter()
+        with exporter:
+            failures = sum(1 for result in exporter.export(jobs) if not result.ok)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss 在Linux上以KB为单位；子进程的值是已结束子进程中的最大值
+    parent_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"{transport:<8}{len(jobs)}张 耗时 {elapsed:.2f} s，传输像素 {exporter.payload_bytes / 2**20:.0f} MB，"
+          f"主进程峰值 {parent_rss:.0f} MB，工作进程峰值 {child_rss:.0f} MB，失败 {failures}")
+
+
+def bench_mapped(args):
+    """比较未压缩图片的内存映射处理与常规整幅解码；每种方式在独立子进程中运行"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = list(args.images)
+        if not paths:
+            # RGB TIFF 与 BGR BMP（Pillow 保存的RGB BMP 为24位BGR逐行存储）
+            sample = make_sample_image(args.width, args.height)
+            for ext in (".tif", ".bmp"):
+                path = os.path.join(tmp_dir, f"sample{ext}")
+                sample.save(path)
+                paths.append(path)
+            del sample
+        for mode in ("mapped", "decode"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "mapped-run", mode] + paths, check=True)
+
+
+def _io_counters():
+    """本进程的读写字节数（Linux /proc/self/io，包括页面缓存命中的读取）"""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def run_mapped(mode, paths):
+    import animation
+    import mapped_io
+    import parallel_export
+    from watermark_engine import WatermarkLayer, WatermarkRenderer
+
+    renderer = WatermarkRenderer()
+    layers = (WatermarkLayer(kind="text", text="Benchmark", font_size=200, opacity=0.6),)
+
+    def plan_for_size(size):
+        return renderer.plan(layers, size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        read_before, write_before = _io_counters()
+        start = time.perf_counter()
+        for path in paths:
+            output_path = os.path.join(tmp_dir, os.path.basename(path))
+            if mode == "mapped":
+                if not mapped_io.watermark_mapped(path, output_path, plan_for_size):
+                    print(f"{os.path.basename(path)}: 不是可映射的未压缩格式")
+                continue
+            image = parallel_export.open_for_export(path, animation.format_for_path(path))
+            encoders.save_image(plan_for_size(image.size).apply(image), output_path, None)
+        elapsed = time.perf_counter() - start
+        read_after, write_after = _io_counters()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:<8}{len(paths)}个文件 耗时 {elapsed * 1000:.0f} ms，读取 {(read_after - read_before) / 2**20:.0f} MB，"
+          f"写入 {(write_after - write_before) / 2**20:.0f} MB，峰值内存 {rss:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WatermarkApp 性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    encode_parser = subparsers.add_parser("encode", help="编码预设的耗时与输出大小")
+    encode_parser.add_argument("images", nargs="*", help="测试图片（默认使用合成图片）")
+    encode_parser.add_argument("--width", type=int, default=4000)
+    encode_parser.add_argument("--height", type=int, default=3000)
+    encode_parser.add_argument("--quality", type=int, default=90)
+    encode_parser.add_argument("--repeat", type=int, default=3)
+    encode_parser.set_defaults(func=bench_encode)
+
+    startup_parser = subparsers.add_parser("startup", help="冷启动到首帧绘制的时间")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.set_defaults(func=bench_startup)
+
+    export_parser = subparsers.add_parser("export", help="多进程导出的传输开销与峰值内存")
+    export_parser.add_argument("images", nargs="*", help="测试图片（默认使用合成图片）")
+    export_parser.add_argument("--transport", choices=("shm", "pickle", "both"), default="both")
+    export_parser.add_argument("--count", type=int, default=12)
+    export_parser.add_argument("--width", type=int, default=6000)
+    export_parser.add_argument("--height", type=int, default=4000)
+    export_parser.add_argument("--workers", type=int, default=0)
+    export_parser.set_defaults(func=bench_export)
+
+    if sys.argv[1:2] == ["export-run"]:
+        # bench_export 启动的子进程：export-run <传输方式> <进程数> <图片 ...>
+        run_export(sys.argv[2], int(sys.argv[3]), sys.argv[4:])
+        return
+
+    mapped_parser = subparsers.add_parser("mapped", help="未压缩BMP/TIFF的内存映射处理")
+    mapped_parser.add_argument("images", nargs="*", help="未压缩的BMP/TIFF图片（默认使用合成图片）")
+    mapped_parser.add_argument("--width", type=int, default=8000)
+    mapped_parser.add_argument("--height", type=int, default=6000)
+    mapped_parser.set_defaults(func=bench_mapped)
+
+    if sys.argv[1:2] == ["mapped-run"]:
+        # bench_mapped 启动的子进程：mapped-run <mapped|decode> <图片 ...>
+        run_mapped(sys.argv[2], sys.argv[3:])
+        return
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
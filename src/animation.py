@@ -0,0 +1,190 @@
+"""
+多帧图片（GIF动画、多页TIFF）的水印处理
+每一帧都添加水印，并保留帧时长、处置方式(disposal)和调色板。
+同尺寸的帧共用一个渲染计划（精灵图只渲染一次），帧在线程池中并行合成；
+处理中的帧数受窗口大小限制，结果按顺序交给编码器：GIF和TIFF逐帧写出，PNG/WebP的编码器需要一次取得全部帧。
+"""
+
+import os
+from collections import deque
+from contextlib import ExitStack
+
+from PIL import GifImagePlugin, Image, TiffImagePlugin
+
+from archive_input import open_input
+from watermark_engine import is_opaque_image
+
+# 按多帧方式处理的输入格式
+MULTIFRAME_FORMATS = {"GIF", "TIFF"}
+# 可以保存多帧的输出格式
+ANIMATED_OUTPUT_FORMATS = {"GIF", "TIFF", "WEBP", "PNG"}
+
+
+def is_multiframe(info):
+    """根据探测到的头信息判断是否需要逐帧处理"""
+    return info.ok and info.n_frames > 1 and info.format in MULTIFRAME_FORMATS
+
+
+def format_for_path(path):
+    """按扩展名推断Pillow格式名"""
+    return Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+
+
+def _watermark_bbox(plan):
+    """渲染计划中所有精灵图覆盖区域的外接矩形（裁剪到图片范围内）"""
+    width, height = plan.image_size
+    boxes = [(x, y, x + sprite.width, y + sprite.height) for sprite, (x, y) in plan.groups]
+    if not boxes:
+        return None
+    left = max(0, min(box[0] for box in boxes))
+    top = max(0, min(box[1] for box in boxes))
+    right = min(width, max(box[2] for box in boxes))
+    bottom = min(height, max(box[3] for box in boxes))
+    return (left, top, right, bottom) if left < right and top < bottom else None
+
+
+def _merge_palette(palette, composited, bbox):
+    """在原调色板的空闲位置补充水印区域的颜色，原有颜色和索引保持不变"""
+    used = len(palette) // 3
+    if used < 256:
+        extra = composited.crop(bbox).quantize(colors=256 - used).getpalette()
+        palette = palette + extra[:3 * (256 - used)]
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette)
+    return palette_image
+
+
+def _read_frames(image, durations, disposals):
+    """逐帧解码，同时记录每帧的时长和处置方式"""
+    for index in range(image.n_frames):
+        image.seek(index)
+        durations.append(image.info.get("duration", 0))
+        disposals.append(getattr(image, "disposal_method", 0))
+        opaque = is_opaque_image(image)
+        # 不透明的帧保持RGB（快速路径），调色板模式的帧同时保留原索引以便还原；
+        # Pillow 把GIF第一帧之后的帧解码为RGB，这些帧的索引在合成时由帧内的颜色得到
+        indexed = image.copy() if image.mode == "P" and opaque else None
+        frame = image.convert("RGB" if opaque else "RGBA")
+        yield frame, indexed
+
+
+def _coverage_mask(plan, bbox):
+    """水印覆盖的像素（bbox内的坐标）：只有这些像素需要重新量化"""
+    coverage = Image.new("L", (bbox[2] - bbox[0], bbox[3] - bbox[1]), 0)
+    for sprite, (x, y) in plan.groups:
+        coverage.paste(sprite.getchannel("A"), (x - bbox[0], y - bbox[1]))
+    return coverage.point(lambda value: 255 if value else 0)
+
+
+def _to_transparent_palette(image):
+    """透明帧转为自适应调色板，alpha低于一半的像素使用最后一个索引作为透明色"""
+    indexed = image.convert("RGB").quantize(colors=255)
+    palette = indexed.getpalette()
+    indexed.putpalette(palette + [0] * (3 * 256 - len(palette)))
+    indexed.paste(255, (0, 0), image.getchannel("A").point(lambda value: 255 if value < 128 else 0))
+    indexed.info["transparency"] = 255
+    return indexed
+
+
+def _composite_frame(plan, frame, indexed, keep_palette):
+    """在工作线程中合成一帧；GIF输出时还原为该帧自己的调色板（透明帧和颜色过多的帧使用自适应调色板）
+
+    水印区域之外保留原索引，只有水印区域按补充后的调色板量化
+    （按调色板量化时相近的颜色可能落到同一个查找单元，整帧量化会改变原有的颜色）。
+    """
+    if keep_palette and indexed is None and frame.mode == "RGB" and frame.getcolors(256) is not None:
+        # 合成会就地修改RGB帧，先取原有颜色；不超过256种颜色时量化是精确的
+        indexed = frame.quantize(256)
+    result = plan.apply(frame)
+    if not keep_palette:
+        return result
+    if indexed is None:
+        if result.mode == "RGBA":
+            return _to_transparent_palette(result)
+        return result.quantize(colors=256)
+    bbox = _watermark_bbox(plan)
+    if bbox is None:
+        return indexed
+    palette_image = _merge_palette(indexed.getpalette(), result, bbox)
+    indexed.putpalette(palette_image.getpalette())
+    indexed.paste(result.crop(bbox).quantize(palette=palette_image, dither=Image.Dither.NONE), bbox[:2],
+                  _coverage_mask(plan, bbox))
+    return indexed
+
+
+def iter_watermarked_frames(frames, plan, executor, window, keep_palette=False):
+    """并行合成各帧，最多同时处理window帧，按原顺序产出结果"""
+    pending = deque()
+    for frame, palette in frames:
+        pending.append(executor.submit(_composite_frame, plan, frame, palette, keep_palette))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _save_tiff_pages(frames, output, options):
+    """逐页追加写入TIFF（output 为路径或可读写的文件对象），已写入的页不再占用内存
+
+    TIFF 的 save_all 会先把 append_images 全部取出放进列表，这里逐页保存到 AppendingTiffWriter 中。
+    """
+    with ExitStack() as stack:
+        fp = output if hasattr(output, "write") else stack.enter_context(open(output, "w+b"))
+        tiff_file = stack.enter_context(TiffImagePlugin.AppendingTiffWriter(fp))
+        for frame in frames:
+            frame.save(tiff_file, "TIFF", **options)
+            tiff_file.newFrame()
+
+
+def _save_gif_frames(frames, output, durations, disposals, loop):
+    """逐帧写入GIF（output 为路径或文件对象），每帧带自己的局部调色板，已写入的帧不再占用内存
+
+    GIF 的 save_all 会先收集全部帧（用于计算帧间差异），这里用 getheader/getdata 逐帧编码。
+    frames 为调色板模式的帧；durations、disposals 在读取帧时同步填充。
+    """
+    with ExitStack() as stack:
+        fp = output if hasattr(output, "write") else stack.enter_context(open(output, "wb"))
+        for index, frame in enumerate(frames):
+            if index == 0:
+                header, _ = GifImagePlugin.getheader(frame, None, {"loop": loop, "duration": durations[0]})
+                fp.write(b"".join(header))
+            params = {"duration": durations[index], "disposal": disposals[index], "include_color_table": True}
+            if "transparency" in frame.info:
+                params["transparency"] = frame.info["transparency"]
+            fp.write(b"".join(GifImagePlugin.getdata(frame, (0, 0), **params)))
+        fp.write(b";")  # 文件结束标记
+
+
+def save_multiframe(path, output_path, image_format, plan_for_size, executor, workers, save_options=None):
+    """为多帧图片的每一帧添加水印并保存
+
+    plan_for_size(size) 返回该尺寸的渲染计划；image_format 为输出格式（GIF/TIFF/WEBP/PNG）。
+    executor 为合成帧的线程池，workers 为它的线程数，同时处理的帧数不超过其2倍。
+    output_path 也可以是文件对象（如 BytesIO）。
+    """
+    save_options = dict(save_options or {})
+    window = 2 * workers
+
+    with open_input(path) as source, Image.open(source) as image:
+        plan = plan_for_size(image.size)
+        durations, disposals = [], []
+        frames = iter_watermarked_frames(_read_frames(image, durations, disposals), plan, executor, window,
+                                         keep_palette=image_format == "GIF")
+
+        if image_format == "TIFF":
+            compression = image.info.get("compression")
+            if compression and compression != "raw":
+                save_options.setdefault("compression", compression)
+            _save_tiff_pages(frames, output_path, save_options)
+            return
+
+        if image_format == "GIF":
+            _save_gif_frames(frames, output_path, durations, disposals, image.info.get("loop", 0))
+            return
+
+        # PNG/WEBP编码器会多次遍历append_images（本身也会先收集全部帧），只能传入列表，内存随帧数增长
+        first, *rest = frames
+        if image_format == "WEBP":
+            save_options.setdefault("loop", image.info.get("loop", 0))
+        save_options["duration"] = durations
+        first.save(output_path, image_format, save_all=True, append_images=rest, **save_options)
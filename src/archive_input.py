@@ -0,0 +1,199 @@
+"""
+直接读取ZIP/TAR归档中的图片，不解压到磁盘
+归档中的图片用虚拟路径表示：<归档路径>/<成员路径>（如 uploads.zip/2024/a.jpg），
+文件名、扩展名与普通文件一致，输出命名规则、动态文本字段照常适用。
+- 列出图片只读取ZIP的中央目录或TAR的各成员头（跳过数据），逐个产出，大归档可以边列边显示
+- 打开一张图片时只读取该成员的数据：ZIP按中央目录随机访问，TAR按首次扫描记下的数据偏移直接定位
+只支持未压缩的TAR：.tar.gz 等压缩TAR无法随机访问，每读一个成员都要从头解压。
+tarfile/zipfile 在第一次读取归档时才导入，普通文件的读取路径（以及程序启动）不加载它们。
+"""
+
+import io
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".tif", ".gif")
+
+
+@dataclass(frozen=True)
+class MemberStat:
+    """归档成员的大小和修改时间（修改时间取归档文件的，归档被替换后缓存随之失效）"""
+    st_size: int
+    st_mtime: float
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def split_member(path):
+    """虚拟路径 -> (归档路径, 成员名)；普通文件（或不在归档中的路径）返回None"""
+    if os.path.exists(path):
+        return None
+    index = 0
+    while True:
+        index = path.find(os.sep, index + 1)
+        if index < 0:
+            return None
+        prefix = path[:index]
+        if is_archive(prefix):
+            return prefix, path[index + 1:].replace(os.sep, "/")
+
+
+def member_path(archive, name):
+    """归档中成员的虚拟路径"""
+    return os.path.join(archive, *name.split("/"))
+
+
+def iter_images(archive):
+    """逐个产出归档中图片成员的虚拟路径（按归档中的顺序，不读取成员数据）"""
+    import tarfile
+    import zipfile
+    if archive.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
+        for name in names:
+            if is_image_name(name):
+                yield member_path(archive, name)
+        return
+    with tarfile.open(archive, "r:") as tar:
+        # TarFile的迭代是惰性的：逐个读取成员头，跳过数据部分
+        for member in tar:
+            if member.isfile() and is_image_name(member.name):
+                yield member_path(archive, member.name)
+
+
+def expand_inputs(paths):
+    """展开输入中的归档（惰性），其他路径原样产出"""
+    for path in paths:
+        if isinstance(path, str) and is_archive(path):
+            yield from iter_images(path)
+        else:
+            yield path
+
+
+class _MemberReader(io.RawIOBase):
+    """TAR成员数据的只读视图：只在 [offset, offset + size) 范围内读取和定位，每次打开使用独立的文件句柄"""
+
+    def __init__(self, path, offset, size):
+        super().__init__()
+        self._file = open(path, "rb")
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._size
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self._size - self._pos))
+        if count == 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        count = self._file.readinto(memoryview(buffer)[:count])
+        self._pos += count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class _ArchiveIndex:
+    """一个归档的成员索引：成员名 -> 大小和读取方式；ZIP保持打开（读取是线程安全的）"""
+
+    def __init__(self, path, key):
+        import tarfile
+        import zipfile
+        self.path = path
+        self.key = key
+        self.members = {}
+        self._zip = None
+        if path.lower().endswith(".zip"):
+            self._zip = zipfile.ZipFile(path)
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    self.members[info.filename] = (info.file_size, info)
+        else:
+            try:
+                with tarfile.open(path, "r:") as tar:
+                    for member in tar:
+                        if member.isfile():
+                            self.members[member.name] = (member.size, member.offset_data)
+            except tarfile.ReadError as e:
+                raise ValueError(f"Only uncompressed TAR archives can be read in place: {path}") from e
+
+    def size(self, name):
+        return self.members[name][0]
+
+    def open(self, name):
+        size, location = self.members[name]
+        if self._zip is not None:
+            return self._zip.open(location)
+        return io.BufferedReader(_MemberReader(self.path, location, size))
+
+
+_indexes = {}  # 归档路径 -> _ArchiveIndex
+_indexes_lock = threading.Lock()
+
+
+def _index(archive):
+    """归档的成员索引（按归档的修改时间和大小缓存，首次使用时扫描）"""
+    stat = os.stat(archive)
+    key = (stat.st_mtime, stat.st_size)
+    with _indexes_lock:
+        index = _indexes.get(archive)
+        if index is None or index.key != key:
+            index = _ArchiveIndex(archive, key)
+            _indexes[archive] = index
+        return index
+
+
+def input_stat(path):
+    """os.stat 的替代：归档成员返回 MemberStat；不存在时抛出 OSError"""
+    member = split_member(path)
+    if member is None:
+        return os.stat(path)
+    archive, name = member
+    index = _index(archive)
+    try:
+        return MemberStat(index.size(name), index.key[0])
+    except KeyError:
+        raise FileNotFoundError(f"No such member in {archive}: {name}") from None
+
+
+@contextmanager
+def open_input(path):
+    """以 Image.open 能接受的形式打开输入：普通文件直接给出路径，归档成员给出只读取该成员数据的文件对象"""
+    member = split_member(path)
+    if member is None:
+        yield path
+        return
+    archive, name = member
+    try:
+        source = _index(archive).open(name)
+    except KeyError:
+        raise FileNotFoundError(f"No such member in {archive}: {name}") from None
+    with source:
+        yield source
@@ -0,0 +1,103 @@
+"""
+把导出结果直接写入ZIP/TAR归档
+工作进程把编码后的图片作为字节返回，主进程按完成顺序逐个追加到归档中，不在磁盘上生成中间文件。
+可以按大小分卷：每一卷都是独立完整的归档（batch.part001.zip、batch.part002.zip ...），单个文件不会跨卷。
+tarfile/zipfile 在创建第一卷时才导入，界面启动时只需要这里的格式名称。
+"""
+
+import io
+import os
+import threading
+import time
+
+from encoders import unique_filename
+
+ARCHIVE_FORMATS = ("zip", "tar")
+
+# 界面显示名称（"none" 表示导出为文件夹中的单独文件）
+ARCHIVE_LABELS = {
+    "none": "文件夹",
+    "zip": "ZIP",
+    "tar": "TAR",
+}
+
+# 已经压缩过的图片格式在ZIP中直接存储，再压缩只会浪费CPU
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+def volume_path(path, number):
+    """第 number 卷（从1开始）的文件路径"""
+    base, ext = os.path.splitext(path)
+    if base.endswith(".tar"):  # batch.tar.gz 之类的双扩展名
+        base, ext = base[:-4], ".tar" + ext
+    return f"{base}.part{number:03d}{ext}"
+
+
+class ArchiveWriter:
+    """顺序写入的ZIP/TAR归档（线程安全）；volume_size（字节）为每卷的大小上限，None 表示不分卷"""
+
+    def __init__(self, path, archive_format="zip", volume_size=None):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {archive_format}")
+        self.path = path
+        self.archive_format = archive_format
+        self.volume_size = volume_size
+        self.paths = []  # 已创建的归档文件
+        self.entries = 0
+        self._archive = None
+        self._volume_bytes = 0
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def _open_volume(self):
+        import tarfile
+        import zipfile
+        path = volume_path(self.path, len(self.paths) + 1) if self.volume_size else self.path
+        if self.archive_format == "zip":
+            self._archive = zipfile.ZipFile(path, "w", allowZip64=True)
+        else:
+            self._archive = tarfile.open(path, "w")
+        self.paths.append(path)
+        self._volume_bytes = 0
+
+    def _unique_name(self, name):
+        """同名条目（来自不同文件夹的同名图片）追加序号，避免归档中出现重复的条目"""
+        return unique_filename(name, self._names)
+
+    def write(self, name, data):
+        """追加一个条目，返回实际使用的条目名"""
+        import tarfile
+        import zipfile
+        with self._lock:
+            if self._archive is not None and self.volume_size and self._volume_bytes \
+                    and self._volume_bytes + len(data) > self.volume_size:
+                self._archive.close()
+                self._archive = None
+            if self._archive is None:
+                self._open_volume()
+            name = self._unique_name(name)
+            if self.archive_format == "zip":
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = (zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+                                      else zipfile.ZIP_DEFLATED)
+                self._archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                self._archive.addfile(info, io.BytesIO(data))
+            self._volume_bytes += len(data)
+            self.entries += 1
+            return name
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,95 @@
+"""
+自动选择水印位置
+把图片缩小到约 ANALYSIS_SIZE 像素后统计亮度：边缘能量（FIND_EDGES 的均值）和亮度标准差越大，区域越"忙"。
+在九个预设位置中选择最空旷的一个，避免水印压在人脸、文字等细节上；
+同时惩罚与水印亮度过于接近的区域（如白色文字放在亮的天空上），也可以按所在区域的亮度选择对比色。
+统计全部由 ImageFilter/ImageStat 在C层完成，每张图片只需几毫秒。
+"""
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+from archive_input import open_input
+
+AUTO_POSITION = "auto"
+FALLBACK_POSITION = "br"  # 没有图片内容可供分析时使用的位置
+ANALYSIS_SIZE = 96  # 分析用缩略图的长边
+OVERSAMPLE = 4  # 先按最近邻取样到 ANALYSIS_SIZE 的这个倍数，再平均缩小，兼顾速度和统计的稳定性
+MIN_CONTRAST = 96  # 区域平均亮度与水印亮度的差距小于此值时加罚分
+# 分数相同时的优先顺序：先四角，再边，最后中央
+CANDIDATE_ORDER = ("br", "bl", "tr", "tl", "bc", "tc", "mr", "ml", "mc")
+DARK_COLOR = (0, 0, 0)
+LIGHT_COLOR = (255, 255, 255)
+
+
+def contrasting_color(mean_luma):
+    """与区域平均亮度对比明显的文字颜色"""
+    return DARK_COLOR if mean_luma >= 128 else LIGHT_COLOR
+
+
+def sprite_luma(sprite):
+    """水印图像可见部分的平均亮度"""
+    if sprite.mode != "RGBA":
+        return ImageStat.Stat(sprite.convert("L")).mean[0]
+    alpha = sprite.getchannel("A")
+    if alpha.getbbox() is None:
+        return None
+    return ImageStat.Stat(sprite.convert("L"), alpha).mean[0]
+
+
+class BusyMap:
+    """一张图片的缩略亮度图和边缘图，坐标按比例换算，与原图尺寸无关"""
+
+    def __init__(self, image):
+        width, height = image.size
+        scale = ANALYSIS_SIZE / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        sample = image.resize((size[0] * OVERSAMPLE, size[1] * OVERSAMPLE), Image.Resampling.NEAREST)
+        self.luma = sample.convert("L").reduce(OVERSAMPLE)
+        # FIND_EDGES 不处理最外一圈像素（原样保留亮度），置为0，否则靠边的预设位置会显得很"忙"
+        self.edges = ImageOps.expand(ImageOps.crop(self.luma.filter(ImageFilter.FIND_EDGES), 1), 1, fill=0)
+
+    @classmethod
+    def from_path(cls, path):
+        """从文件构建；JPEG按缩小比例解码（draft），不需要完整解码"""
+        with open_input(path) as source, Image.open(source) as image:
+            image.draft("RGB", (ANALYSIS_SIZE * OVERSAMPLE, ANALYSIS_SIZE * OVERSAMPLE))
+            return cls(image)
+
+    def _box(self, rect, image_size):
+        """原图上的矩形 (x, y, 宽, 高) -> 缩略图上的裁剪框（至少1像素）"""
+        x, y, w, h = rect
+        main_w, main_h = image_size
+        small_w, small_h = self.luma.size
+        left = min(small_w - 1, max(0, int(x * small_w / main_w)))
+        top = min(small_h - 1, max(0, int(y * small_h / main_h)))
+        right = max(left + 1, min(small_w, -(-(x + w) * small_w // main_w)))
+        bottom = max(top + 1, min(small_h, -(-(y + h) * small_h // main_h)))
+        return left, top, right, bottom
+
+    def region_luma(self, rect, image_size):
+        """区域的平均亮度"""
+        return ImageStat.Stat(self.luma.crop(self._box(rect, image_size))).mean[0]
+
+    def score(self, rect, image_size, watermark_luma=None):
+        """区域的繁忙程度（越小越适合放水印）和平均亮度"""
+        box = self._box(rect, image_size)
+        luma = ImageStat.Stat(self.luma.crop(box))
+        edges = ImageStat.Stat(self.edges.crop(box))
+        mean = luma.mean[0]
+        busy = edges.mean[0] + luma.stddev[0]
+        if watermark_luma is not None:
+            busy += max(0.0, MIN_CONTRAST - abs(mean - watermark_luma))
+        return busy, mean
+
+    def choose(self, candidates, sprite_size, image_size, watermark_luma=None):
+        """candidates 为 位置代码 -> 左上角坐标；返回 (最空旷的位置代码, 该区域平均亮度)"""
+        wm_w, wm_h = sprite_size
+        best = None
+        for code in CANDIDATE_ORDER:
+            if code not in candidates:
+                continue
+            x, y = candidates[code]
+            busy, mean = self.score((x, y, wm_w, wm_h), image_size, watermark_luma)
+            if best is None or busy < best[0]:
+                best = (busy, code, mean)
+        return best[1], best[2]
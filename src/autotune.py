@@ -0,0 +1,116 @@
+"""
+导出并发数自动调节
+启动时按CPU核数、可用内存和图片解码后的大小（宽×高×4字节的RGBA缓冲区）选择工作进程数和同时处理的图片数；
+初始同时处理的图片数为工作进程数的2倍（内存不足时更少），导出过程中根据每个完成的任务继续调整：
+- 可用内存低于安全线时减半，已在处理中的图片完成后才提交新的
+- 工作进程总是一拿到图片就开始处理（排队时间接近0），且解码线程的时间主要花在等待I/O上时逐个增加，
+  最多到工作进程数的 MAX_LIMIT_FACTOR 倍，多出的并发用于解码线程，掩盖慢速存储的读取延迟
+- 无法读取可用内存时不按CPU核数全开，工作进程数和同时处理的图片数都不超过 UNKNOWN_MEMORY_IMAGES
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+# 每张处理中的图片占用的缓冲区数：共享内存中的帧 + 工作进程中的合成结果 + 编码缓冲
+BUFFERS_PER_IMAGE = 3
+MEMORY_HEADROOM = 0.8  # 初始并发只使用可用内存的这一比例
+MIN_FREE_BYTES = 256 * 1024 * 1024  # 可用内存低于 max(此值, 2张图片) 时减少并发
+MEMORY_CHECK_INTERVAL = 0.25  # 秒，两次读取可用内存的最短间隔
+STARVED_QUEUE_FRACTION = 0.1  # 排队时间小于处理时间的这一比例时，认为工作进程在等待图片
+IO_WAIT_FRACTION = 0.25  # 解码阻塞在I/O上的时间超过处理时间的这一比例时，增加并发才有帮助（CPU已满时没有）
+SIGNAL_WINDOW = 8  # 按最近多少个任务判断是否在等待图片
+MAX_LIMIT_FACTOR = 4
+UNKNOWN_MEMORY_IMAGES = 4  # 无法读取可用内存时，同时处理的图片数（也是工作进程数）的保守上限
+
+
+def available_memory():
+    """本机当前可用内存（字节）；安装了psutil时使用它，否则读取/proc/meminfo或sysconf；无法获取时返回None"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        # macOS没有可用页数，按物理内存的一半保守估计
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class WorkerTuner:
+    """导出过程中的并发控制：workers 为工作进程数，limit 为当前允许同时处理的图片数（线程安全）"""
+
+    def __init__(self, infos=(), max_workers=None, memory=available_memory):
+        self.memory = memory
+        self.image_bytes = max([info.decoded_bytes for info in infos if info.ok], default=0)
+        available = memory() or None  # 读数为0时同样视为未知
+        cpu_count = os.cpu_count() or 1
+        fits = self._fits(available, MEMORY_HEADROOM)
+        self.workers = max(1, min(max_workers or cpu_count, fits))
+        self.limit = max(1, min(2 * self.workers, fits))
+        self.max_limit = MAX_LIMIT_FACTOR * self.workers
+        self.backoffs = 0  # 因内存压力减少并发的次数
+        self._starved = deque(maxlen=SIGNAL_WINDOW)
+        self._checked = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _per_image(self):
+        return BUFFERS_PER_IMAGE * self.image_bytes
+
+    def _fits(self, available, fraction=1.0):
+        """可用内存能容纳的处理中图片数；可用内存未知时为 UNKNOWN_MEMORY_IMAGES，图片大小未知时不限制"""
+        if available is None:
+            return UNKNOWN_MEMORY_IMAGES
+        if not self.image_bytes:
+            return 1 << 30
+        return int(available * fraction // self._per_image())
+
+    def add_image(self, info):
+        """登记一张即将处理的图片（输入为惰性序列、启动时不知道全部图片时使用）"""
+        if info.ok and info.decoded_bytes > self.image_bytes:
+            with self._lock:
+                self.image_bytes = max(self.image_bytes, info.decoded_bytes)
+
+    def observe(self, result):
+        """每个任务结束后调用，按内存压力和排队情况调整 limit"""
+        with self._lock:
+            if result.queued is not None and result.seconds:
+                self._starved.append(result.queued < STARVED_QUEUE_FRACTION * result.seconds
+                                     and result.io_wait > IO_WAIT_FRACTION * result.seconds)
+            now = time.perf_counter()
+            if now - self._checked < MEMORY_CHECK_INTERVAL:
+                return
+            self._checked = now
+            available = self.memory() or None
+            reserve = max(MIN_FREE_BYTES, 2 * self._per_image())
+            if available is not None and available < reserve:
+                if self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    self.backoffs += 1
+                    self._starved.clear()
+                return
+            starved = len(self._starved) == SIGNAL_WINDOW and sum(self._starved) >= SIGNAL_WINDOW * 3 // 4
+            if available is None:
+                room = self.limit < self._fits(None)
+            else:
+                room = self._fits(available - reserve) > 0
+            if starved and self.limit < self.max_limit and room:
+                self.limit += 1
+                self._starved.clear()
+
+    def describe(self):
+        return f"{self.workers} 个工作进程，同时处理 {self.limit} 张（上限 {self.max_limit}）"
@@ -0,0 +1,126 @@
+"""
+输出格式与编码预设
+支持 JPEG / PNG / WebP 输出，并提供速度与体积之间的编码预设。
+"""
+
+import os
+
+# 输出格式代码 -> 文件扩展名（"original" 表示沿用输入文件的格式）
+OUTPUT_FORMATS = {
+    "original": None,
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+}
+
+# 界面显示名称
+OUTPUT_FORMAT_LABELS = {
+    "original": "原格式",
+    "JPEG": "JPEG",
+    "PNG": "PNG",
+    "WEBP": "WebP",
+}
+
+ENCODER_PRESET_LABELS = {
+    "fast": "速度优先",
+    "balanced": "均衡",
+    "small": "体积优先",
+}
+
+# 各格式在不同预设下的编码参数（质量由界面上的质量滑块单独提供）
+ENCODER_PRESETS = {
+    "JPEG": {
+        "fast": {"optimize": False, "progressive": False},
+        "balanced": {"optimize": True, "progressive": False},
+        "small": {"optimize": True, "progressive": True},
+    },
+    "PNG": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"compress_level": 9, "optimize": True},
+    },
+    "WEBP": {
+        "fast": {"method": 0},
+        "balanced": {"method": 4},
+        "small": {"method": 6},
+    },
+}
+
+DEFAULT_PRESET = "balanced"
+
+# 扩展名 -> Pillow格式名（只列出有编码预设的格式）
+_EXTENSION_FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".webp": "WEBP",
+}
+
+
+def resolve_output_format(output_format, input_path):
+    """确定实际的输出格式；沿用原格式且不是JPEG/PNG/WebP时返回None，由Pillow按扩展名推断"""
+    if output_format and output_format != "original":
+        return output_format
+    ext = os.path.splitext(input_path)[1].lower()
+    return _EXTENSION_FORMATS.get(ext)
+
+
+def output_extension(output_format, input_path):
+    """输出文件的扩展名"""
+    ext = OUTPUT_FORMATS.get(output_format)
+    if ext is None:
+        return os.path.splitext(input_path)[1]
+    return ext
+
+
+def output_filename(input_path, output_format="original", rule="suffix", prefix="", suffix=""):
+    """按命名规则（prefix/suffix/original）生成输出文件名；指定了输出格式时替换扩展名"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    ext = output_extension(output_format, input_path)
+    if rule == "prefix":
+        return f"{prefix}{name}{ext}"
+    elif rule == "suffix":
+        return f"{name}{suffix}{ext}"
+    return f"{name}{ext}"
+
+
+def unique_filename(name, taken):
+    """同名输出（来自不同文件夹或归档的同名图片）追加序号，避免互相覆盖
+
+    taken 为这一批已使用的名字（小写，按不区分大小写的文件系统比较），返回的名字会加入其中。
+    """
+    candidate, counter = name, 1
+    base, ext = os.path.splitext(name)
+    while candidate.lower() in taken:
+        counter += 1
+        candidate = f"{base}_{counter}{ext}"
+    taken.add(candidate.lower())
+    return candidate
+
+
+def get_save_options(image_format, preset=DEFAULT_PRESET, quality=95):
+    """返回传给 Image.save 的编码参数"""
+    if image_format not in ENCODER_PRESETS:
+        return {}
+    presets = ENCODER_PRESETS[image_format]
+    options = dict(presets.get(preset, presets[DEFAULT_PRESET]))
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = int(quality)
+    return options
+
+
+def prepare_for_format(image, image_format):
+    """转换为目标格式能保存的模式（JPEG不支持alpha通道）"""
+    if image_format == "JPEG" and image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def save_image(image, fp, image_format, preset=DEFAULT_PRESET, quality=95):
+    """按格式和预设编码保存图片；fp可以是路径或文件对象"""
+    if image_format is None:
+        # 其他格式（BMP、TIFF等）沿用Pillow默认行为
+        image.save(fp)
+        return
+    image = prepare_for_format(image, image_format)
+    image.save(fp, image_format, **get_save_options(image_format, preset, quality))
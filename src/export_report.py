@@ -0,0 +1,133 @@
+"""
+批量导出的进度统计与结果报告
+导出过程中统计吞吐量（张/秒、MB/秒，按最近完成的若干张滑动平均）、预计剩余时间以及失败和跳过的数量；
+导出结束后把每个文件的状态和耗时写成JSON摘要，便于安排夜间批处理和找出耗时异常的文件。
+"""
+
+import json
+import os
+import time
+from collections import deque
+
+RATE_WINDOW = 20  # 计算滑动平均速度时使用的最近完成数
+SUMMARY_PREFIX = "export_summary"
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+
+def format_duration(seconds):
+    """秒数 -> "m:ss" 或 "h:mm:ss" """
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ExportReport:
+    """记录一次批量导出中每个文件的结果"""
+
+    def __init__(self, total, window=RATE_WINDOW):
+        self.total = total  # 需要导出的文件数（不含跳过的）
+        self.started_at = time.time()
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.input_bytes = 0
+        self.files = []
+        self.archives = []  # 导出到归档时生成的归档文件（分卷时有多个）
+        self.concurrency = None  # 自动调节的并发设置和因内存压力减少并发的次数
+        self._start = time.perf_counter()
+        self._finished = None
+        self._recent = deque([(self._start, 0)], maxlen=window + 1)  # (完成时刻, 累计输入字节)
+
+    @property
+    def done(self):
+        return self.succeeded + self.failed
+
+    def skip(self, path, reason):
+        """记录预检时跳过的文件"""
+        self.skipped += 1
+        self.files.append({"path": path, "status": STATUS_SKIPPED, "error": reason})
+
+    def record(self, result, input_bytes=0):
+        """记录一个 ExportResult；input_bytes 为输入文件大小"""
+        entry = {"path": result.job.path, "output_path": result.job.output_path,
+                 "seconds": None if result.seconds is None else round(result.seconds, 4),
+                 "input_bytes": input_bytes}
+        if result.ok:
+            self.succeeded += 1
+            entry["status"] = STATUS_OK
+            if result.data is not None:
+                entry["output_bytes"] = len(result.data)
+            else:
+                try:
+                    entry["output_bytes"] = os.path.getsize(result.job.output_path)
+                except OSError:
+                    entry["output_bytes"] = None
+        else:
+            self.failed += 1
+            entry["status"] = STATUS_FAILED
+            entry["error"] = str(result.error)
+        self.input_bytes += input_bytes
+        self.files.append(entry)
+        self._recent.append((time.perf_counter(), self.input_bytes))
+
+    def elapsed(self):
+        end = self._finished if self._finished is not None else time.perf_counter()
+        return end - self._start
+
+    def rates(self):
+        """最近窗口内的 (张/秒, MB/秒)；还没有完成的文件时为 (0, 0)"""
+        (first_time, first_bytes), (last_time, last_bytes) = self._recent[0], self._recent[-1]
+        span = last_time - first_time
+        if span <= 0:
+            return 0.0, 0.0
+        return (len(self._recent) - 1) / span, (last_bytes - first_bytes) / span / 2**20
+
+    def eta(self):
+        """按滑动平均速度估算的剩余秒数；无法估算时为None"""
+        images_per_second = self.rates()[0]
+        if images_per_second <= 0:
+            return None
+        return (self.total - self.done) / images_per_second
+
+    def progress_text(self):
+        images_per_second, mb_per_second = self.rates()
+        eta = self.eta()
+        lines = [f"正在处理: {self.done}/{self.total}",
+                 f"{images_per_second:.1f} 张/秒  {mb_per_second:.1f} MB/秒  "
+                 f"剩余约 {format_duration(eta) if eta is not None else '--:--'}",
+                 f"失败 {self.failed}  跳过 {self.skipped}"]
+        return "\n".join(lines)
+
+    def finish(self):
+        self._finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = self.elapsed()
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "elapsed_seconds": round(elapsed, 3),
+            "total": self.total + self.skipped,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "input_bytes": self.input_bytes,
+            "images_per_second": round(self.done / elapsed, 3) if elapsed > 0 else None,
+            "mb_per_second": round(self.input_bytes / elapsed / 2**20, 3) if elapsed > 0 else None,
+            "archives": self.archives,
+            "concurrency": self.concurrency,
+            "files": self.files,
+        }
+
+    def write(self, directory):
+        """把摘要写入 directory 下带时间戳的JSON文件，返回文件路径"""
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        path = os.path.join(directory, f"{SUMMARY_PREFIX}_{stamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return path
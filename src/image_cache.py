@@ -0,0 +1,119 @@
+"""
+已解码图片的缓存与后台预取
+切换图片时在线程池中解码，主线程不做解码；最近查看的图片按LRU保留，总内存按字节数限制。
+相邻的图片提前在后台解码，切换到它们时可以立即显示。
+"""
+
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from archive_input import input_stat, open_input
+from sprite_cache import image_bytes
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def _file_key(path):
+    """文件被修改后缓存失效"""
+    stat = input_stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+class DecodedImageCache:
+    """按字节数限制大小的线程安全LRU缓存：路径 -> 已解码的RGBA图片"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # 路径 -> (文件键, 图片, 字节数)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            file_key = _file_key(path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if entry[0] != file_key:
+                self._remove(path)
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, file_key, image):
+        size = image_bytes(image)
+        with self._lock:
+            self._remove(path)
+            if size > self.max_bytes:
+                return  # 单张图片超过上限时不缓存
+            self._entries[path] = (file_key, image, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+
+class ImageLoader:
+    """在后台线程解码图片并写入缓存；同一文件同时只解码一次"""
+
+    def __init__(self, cache=None, max_workers=2):
+        self.cache = cache if cache is not None else DecodedImageCache()
+        self._max_workers = max_workers
+        self._executor = None  # 首次使用时才创建线程池
+        self._pending = {}  # 路径 -> Future
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="decode")
+            return self._executor
+
+    def _decode(self, path):
+        try:
+            file_key = _file_key(path)
+            with open_input(path) as source, Image.open(source) as img:
+                image = img.convert("RGBA")
+            self.cache.put(path, file_key, image)
+            return image
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def load(self, path, callback=None):
+        """返回缓存中的图片；未缓存时在后台解码，完成后在工作线程中调用callback(image, error)"""
+        image = self.cache.get(path)
+        if image is not None:
+            return image
+        executor = self._get_executor()
+        with self._lock:
+            future = self._pending.get(path)
+            if future is None:
+                future = executor.submit(self._decode, path)
+                self._pending[path] = future
+        if callback is not None:
+            def done(f):
+                error = f.exception()
+                callback(None if error else f.result(), error)
+            future.add_done_callback(done)
+        return None
+
+    def prefetch(self, paths):
+        """提前解码（已缓存或正在解码的跳过）"""
+        for path in paths:
+            self.load(path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
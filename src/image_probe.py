@@ -0,0 +1,149 @@
+"""
+图片头信息探测
+只读取文件头获取格式、尺寸、模式、EXIF方向和文件大小，不解码像素数据。
+探测在线程池中进行，结果按 (路径, 修改时间, 文件大小) 缓存。
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+
+from PIL import Image
+
+from archive_input import input_stat, open_input
+
+# EXIF Orientation 标签
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """图片头信息（不含像素数据）"""
+    path: str
+    file_size: int = 0
+    mtime: float = 0.0
+    format: str = None
+    width: int = 0
+    height: int = 0
+    mode: str = None
+    orientation: int = 1
+    n_frames: int = 1
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def oriented_size(self):
+        """按EXIF方向校正后的显示尺寸（方向5-8需要交换宽高）"""
+        if self.orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def decoded_bytes(self):
+        """解码为RGBA后单帧占用的内存字节数"""
+        return self.width * self.height * 4
+
+    def describe(self):
+        """用于图片列表显示的简短描述"""
+        if not self.ok:
+            return "无法识别"
+        w, h = self.oriented_size
+        text = f"{w}×{h} {self.format or ''}".strip()
+        if self.n_frames > 1:
+            text += f" ({self.n_frames}帧)"
+        return text
+
+
+def probe_image(path):
+    """只读取文件头探测图片信息，出错时返回带error的ImageInfo而不是抛出异常"""
+    try:
+        stat = input_stat(path)
+    except (OSError, ValueError) as e:
+        return ImageInfo(path=path, error=str(e))
+
+    try:
+        # Image.open是惰性的，只解析文件头，不调用load()就不会解码像素
+        with open_input(path) as source, Image.open(source) as img:
+            try:
+                orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            except Exception:
+                orientation = 1
+            return ImageInfo(
+                path=path,
+                file_size=stat.st_size,
+                mtime=stat.st_mtime,
+                format=img.format,
+                width=img.width,
+                height=img.height,
+                mode=img.mode,
+                orientation=orientation if orientation in range(1, 9) else 1,
+                n_frames=getattr(img, "n_frames", 1),
+            )
+    except Exception as e:
+        return ImageInfo(path=path, file_size=stat.st_size, mtime=stat.st_mtime, error=str(e))
+
+
+class ImageProber:
+    """带缓存的后台图片探测器"""
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = min(8, (os.cpu_count() or 1) + 2)
+        self._max_workers = max_workers
+        self._executor = None  # 首次使用时才创建线程池，减少启动开销
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get_cached(self, path):
+        """返回仍然有效的缓存结果；文件被修改或不存在时返回None"""
+        with self._lock:
+            info = self._cache.get(path)
+        if info is None:
+            return None
+        try:
+            stat = input_stat(path)
+        except (OSError, ValueError):
+            return None
+        if stat.st_size != info.file_size or stat.st_mtime != info.mtime:
+            return None
+        return info
+
+    def probe(self, path):
+        """同步探测（优先使用缓存）"""
+        info = self.get_cached(path)
+        if info is None:
+            info = probe_image(path)
+            with self._lock:
+                self._cache[path] = info
+        return info
+
+    def submit(self, path, callback=None):
+        """在线程池中探测，完成后在工作线程中调用callback(info)"""
+        def worker():
+            info = self.probe(path)
+            if callback is not None:
+                try:
+                    callback(info)
+                except Exception as e:
+                    print(f"Probe callback error: {e}")
+            return info
+        return self._get_executor().submit(worker)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="probe")
+            return self._executor
+
+    def probe_many(self, paths):
+        """并行探测多个文件，按输入顺序返回结果"""
+        futures = [self.submit(path) for path in paths]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,135 @@
+"""
+未压缩BMP/TIFF的内存映射处理
+扫描仪输出的大尺寸未压缩图片不必整幅解码：文件以写时复制(ACCESS_COPY)方式映射到内存，
+只把水印覆盖的区域读出、合成后写回映射，再直接从映射的页面写出输出文件。
+未修改的页面不会复制到进程内存，文件中的其他数据（TIFF标签、BMP头等）原样保留。
+只在输出格式与输入相同且像素布局为简单的逐行存储时使用，其他情况返回False由调用方按常规流程处理。
+输出沿用输入的像素格式：常规流程（parallel_export.open_for_export）写出BMP/TIFF时同样保持不透明输入的RGB/灰度模式，
+两种方式的输出模式和水印颜色相同（灰度图片上的水印也是灰度的）。
+"""
+
+import mmap
+import os
+
+from PIL import Image
+
+from archive_input import split_member
+from watermark_engine import RenderPlan, is_opaque_image
+
+MAPPED_FORMATS = {"BMP", "TIFF"}
+# 原始数据格式 -> (合成时使用的图像模式, 每像素字节数)
+RAW_LAYOUTS = {
+    "L": ("L", 1),
+    "RGB": ("RGB", 3),
+    "BGR": ("RGB", 3),
+    "RGBX": ("RGB", 4),
+    "BGRX": ("RGB", 4),
+    "RGBA": ("RGBA", 4),
+    "BGRA": ("RGBA", 4),
+}
+
+
+class MappedLayout:
+    """单个原始数据块的行布局"""
+
+    def __init__(self, width, height, offset, rawmode, stride, orientation):
+        self.width = width
+        self.height = height
+        self.offset = offset
+        self.rawmode = rawmode
+        self.mode, self.pixel_bytes = RAW_LAYOUTS[rawmode]
+        self.stride = stride or width * self.pixel_bytes
+        self.orientation = orientation  # 1: 自上而下；-1: 自下而上（BMP）
+
+    @property
+    def end(self):
+        return self.offset + self.stride * self.height
+
+    def row_offset(self, y):
+        row = y if self.orientation > 0 else self.height - 1 - y
+        return self.offset + row * self.stride
+
+
+def get_layout(image):
+    """返回可以直接映射的布局；压缩、分块存储或不支持的像素格式返回None"""
+    if image.format not in MAPPED_FORMATS or getattr(image, "n_frames", 1) > 1:
+        return None
+    if len(image.tile) != 1:
+        return None
+    tile = image.tile[0]
+    codec, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+    if codec != "raw" or tuple(extents) != (0, 0) + image.size:
+        return None
+    if not isinstance(args, tuple) or len(args) < 3 or args[0] not in RAW_LAYOUTS:
+        return None
+    rawmode, stride, orientation = args[:3]
+    if RAW_LAYOUTS[rawmode][0] != image.mode:
+        return None
+    if image.mode != "RGBA" and not is_opaque_image(image):
+        return None  # 带透明色的图片在常规流程中转换为RGBA
+
+    return MappedLayout(image.width, image.height, offset, rawmode, stride, orientation)
+
+
+def _read_region(mapping, layout, box, mode=None, rawmode=None):
+    left, top, right, bottom = box
+    start = left * layout.pixel_bytes
+    length = (right - left) * layout.pixel_bytes
+    data = b"".join(mapping[layout.row_offset(y) + start:layout.row_offset(y) + start + length]
+                    for y in range(top, bottom))
+    return Image.frombytes(mode or layout.mode, (right - left, bottom - top), data, "raw",
+                           rawmode or layout.rawmode)
+
+
+def _write_region(mapping, layout, box, region):
+    left, top, right, bottom = box
+    start = left * layout.pixel_bytes
+    length = (right - left) * layout.pixel_bytes
+    if layout.rawmode in ("RGBX", "BGRX"):
+        # 第四个字节（填充或未使用的alpha）保持原样
+        rawmode = layout.rawmode[:3] + "A"
+        padding = _read_region(mapping, layout, box, "RGBA", rawmode).getchannel("A")
+        region = Image.merge("RGBA", region.split() + (padding,))
+    else:
+        rawmode = layout.rawmode
+    data = region.tobytes("raw", rawmode)
+    for index, y in enumerate(range(top, bottom)):
+        offset = layout.row_offset(y) + start
+        mapping[offset:offset + length] = data[index * length:(index + 1) * length]
+
+
+def _apply_region(sprite, position, region):
+    """复用渲染计划的合成逻辑，只处理单个精灵图覆盖的区域"""
+    return RenderPlan(region.size, [(sprite, position)]).apply(region)
+
+
+def watermark_mapped(path, output_path, plan_for_size):
+    """对可映射的文件就地合成水印区域并写出；不适用时返回False"""
+    if split_member(path) is not None:
+        return False  # 归档中的成员无法内存映射
+    with Image.open(path) as image:
+        layout = get_layout(image)
+        size = image.size
+    if layout is None:
+        return False
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < layout.end:
+            return False
+        # 写时复制映射：修改只影响本进程中被写入的页面，不会改动输入文件
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    try:
+        plan = plan_for_size(size)
+        width, height = size
+        for sprite, (x, y) in plan.groups:
+            box = (max(0, x), max(0, y), min(width, x + sprite.width), min(height, y + sprite.height))
+            if box[0] >= box[2] or box[1] >= box[3]:
+                continue
+            region = _read_region(mapping, layout, box)
+            region = _apply_region(sprite, (x - box[0], y - box[1]), region)
+            _write_region(mapping, layout, box, region)
+        with open(output_path, "wb") as out:
+            out.write(mapping)
+    finally:
+        mapping.close()
+    return True
@@ -0,0 +1,462 @@
+"""
+多进程并行导出
+主进程在线程池中解码图片，工作进程负责合成水印和编码保存。
+解码后的图片和渲染计划中的精灵图放在 multiprocessing.shared_memory 共享内存块中，
+工作进程用 Image.frombuffer 直接引用，不经过pickle复制像素数据：
+- 每张图片的共享块在该任务完成后由主进程释放(unlink)
+- 精灵图共享块在整个导出过程中复用，导出结束(close)时释放
+transport="pickle" 时改为随任务传递像素字节，仅用于基准对比。
+"""
+
+import atexit
+import io
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+import animation
+import encoders
+import mapped_io
+from archive_input import open_input
+from image_probe import probe_image
+from watermark_engine import RenderPlan, is_opaque_image
+
+# 分块写入共享内存时每块的大约字节数，避免 tobytes() 产生整幅图片的临时副本
+COPY_CHUNK_BYTES = 4 * 1024 * 1024
+
+TRANSPORTS = ("shm", "pickle")
+
+# 保留在共享内存中的渲染计划数上限；文本含动态字段时每张图片都有自己的计划，用完的旧计划按此上限释放
+MAX_SHARED_PLANS = 32
+
+# 不透明输入不需要转换为RGBA的输出格式；其中BMP/TIFF保持输入原有的RGB/灰度模式
+OPAQUE_OUTPUT_FORMATS = {"JPEG", "BMP", "TIFF"}
+NATIVE_MODE_FORMATS = {"BMP", "TIFF"}
+
+
+@dataclass(frozen=True)
+class ExportJob:
+    """一张图片的导出任务"""
+    path: str
+    output_path: str
+    image_format: str = None  # None 表示按输出文件扩展名保存
+    preset: str = encoders.DEFAULT_PRESET
+    quality: int = 95
+    index: int = 0  # 在本批图片中的序号（从1开始），用于水印文本中的 {index}
+    in_memory: bool = False  # 编码到内存并随结果返回字节（写入归档等），不写 output_path（此时只用于确定格式和名称）
+
+
+@dataclass(frozen=True)
+class ExportResult:
+    """一个导出任务的结果；seconds 为解码、合成和编码实际耗费的时间（失败时为None）"""
+    job: ExportJob
+    error: Exception = None
+    seconds: float = None
+    queued: float = None  # 提交给工作进程后等待空闲进程的时间（多进程任务才有）
+    io_wait: float = None  # 主进程读取解码时阻塞在I/O上的时间（墙钟时间减去线程CPU时间）
+    data: bytes = None  # job.in_memory 时编码后的图片
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def open_for_export(path, output_format):
+    """打开待导出的图片（也可以是归档中的成员）
+
+    不透明输入且输出为JPEG时保持RGB；输出为BMP/TIFF时保持原有的RGB/灰度模式（与内存映射路径的输出相同）；
+    其他情况转换为RGBA。
+    """
+    with open_input(path) as source, Image.open(source) as image:
+        if output_format in OPAQUE_OUTPUT_FORMATS and is_opaque_image(image):
+            if output_format in NATIVE_MODE_FORMATS and image.mode in ("RGB", "L"):
+                return image.convert(image.mode)
+            return image.convert("RGB")
+        return image.convert("RGBA")
+
+
+def keeps_input_format(job):
+    """输出沿用输入的格式和扩展名（可以直接复制原文件的存储布局）"""
+    return (job.image_format is None and not job.in_memory
+            and os.path.splitext(job.path)[1].lower() == os.path.splitext(job.output_path)[1].lower())
+
+
+# ---------- 共享内存 ----------
+
+def image_to_shared(image):
+    """把图片像素复制到新建的共享内存块，返回 (共享块, 描述信息)"""
+    width, height = image.size
+    row_bytes = width * len(image.getbands())
+    shm = shared_memory.SharedMemory(create=True, size=max(1, row_bytes * height))
+    rows = max(1, COPY_CHUNK_BYTES // max(1, row_bytes))
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        shm.buf[top * row_bytes:bottom * row_bytes] = image.crop((0, top, width, bottom)).tobytes()
+    return shm, (shm.name, image.mode, image.size)
+
+
+def image_from_shared(descriptor):
+    """附加到共享块并用 Image.frombuffer 直接引用其内存（不复制），返回 (图片, 共享块)"""
+    name, mode, size = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    image = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+    return image, shm
+
+
+def release_shared(shm):
+    """关闭并删除共享块"""
+    try:
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# ---------- 工作进程 ----------
+
+def _watch_parent(parent_pid):
+    """工作进程初始化：主进程意外退出（如被强制结束）时随之退出，而不是一直阻塞在任务队列上"""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(1)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+# 工作进程内已附加的渲染计划：计划编号 -> (RenderPlan, 共享块列表)，最多保留 MAX_SHARED_PLANS 个
+_worker_plans = OrderedDict()
+
+
+def _close_handles(handles):
+    for shm in handles:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # 仍有图片引用该内存时由进程退出释放
+
+
+def _detach_plans():
+    """工作进程退出前释放精灵图引用并关闭共享块"""
+    handles = [shm for _, plan_handles in _worker_plans.values() for shm in plan_handles]
+    _worker_plans.clear()
+    _close_handles(handles)
+
+
+def _attach_plan(plan_descriptor):
+    plan_id, image_size, sprites = plan_descriptor
+    cached = _worker_plans.get(plan_id)
+    if cached is None:
+        if not _worker_plans:
+            atexit.register(_detach_plans)
+        groups, handles = [], []
+        for sprite_descriptor, position in sprites:
+            sprite, shm = image_from_shared(sprite_descriptor)
+            groups.append((sprite, position))
+            handles.append(shm)
+        cached = (RenderPlan(image_size, groups), handles)
+        _worker_plans[plan_id] = cached
+        while len(_worker_plans) > MAX_SHARED_PLANS:
+            _, (_, old_handles) = _worker_plans.popitem(last=False)
+            _close_handles(old_handles)
+    else:
+        _worker_plans.move_to_end(plan_id)
+    return cached[0]
+
+
+def _peak_rss():
+    """本进程的峰值常驻内存（字节）；平台不支持时返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss 在macOS上以字节为单位，在Linux上以KB为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _output_format(job):
+    return job.image_format or animation.format_for_path(job.output_path)
+
+
+def _save(job, image):
+    """保存到 job.output_path；job.in_memory 时编码到内存并返回字节"""
+    if job.in_memory:
+        buffer = io.BytesIO()
+        encoders.save_image(image, buffer, _output_format(job), job.preset, job.quality)
+        return buffer.getvalue()
+    encoders.save_image(image, job.output_path, job.image_format, job.preset, job.quality)
+    return None
+
+
+def _export_shared(job, frame_descriptor, plan_descriptor):
+    """共享内存方式：像素和精灵图都直接引用共享块。返回 (工作进程中的耗时（秒）, 编码后的字节或None)"""
+    start = time.perf_counter()
+    plan = _attach_plan(plan_descriptor)
+    frame, shm = image_from_shared(frame_descriptor)
+    try:
+        # frombuffer得到的是只读图片，RGB快速路径粘贴时会在本进程内复制一次
+        data = _save(job, plan.apply(frame))
+    finally:
+        # 先释放对共享内存的引用再关闭；出错时异常的回溯仍引用着图片，close失败不能掩盖原来的错误
+        frame = None
+        _close_handles([shm])
+    return time.perf_counter() - start, data
+
+
+def _export_pickled(job, frame_data, plan_data):
+    """pickle方式：像素和精灵图随任务一起序列化传输。返回 (工作进程中的耗时（秒）, 编码后的字节或None)"""
+    start = time.perf_counter()
+    mode, size, data = frame_data
+    image_size, sprites = plan_data
+    groups = [(Image.frombytes(s_mode, s_size, s_data), position)
+              for (s_mode, s_size, s_data), position in sprites]
+    frame = Image.frombytes(mode, size, data)
+    data = _save(job, RenderPlan(image_size, groups).apply(frame))
+    return time.perf_counter() - start, data
+
+
+# ---------- 主进程 ----------
+
+class ParallelExporter:
+    """多进程导出器
+
+    plan_for_size(size, job, image=None) 返回该图片的渲染计划（image 为已解码的图片，可能为None）；同一个计划对象的精灵图只共享一次。
+    水印文本含动态字段时每张图片的计划不同，处理完的计划超过 MAX_SHARED_PLANS 个后释放最早的。
+    传入 tuner（autotune.WorkerTuner）时由它决定工作进程数，并在导出过程中调整同时处理的图片数。
+    """
+
+    def __init__(self, plan_for_size, max_workers=None, transport="shm", max_in_flight=None, tuner=None):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
+        self.plan_for_size = plan_for_size
+        self.tuner = tuner
+        self.max_workers = (tuner.workers if tuner is not None else max_workers) or os.cpu_count() or 1
+        self.transport = transport
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.payload_bytes = 0  # 随任务传输的像素字节数（共享内存方式下为0）
+        self._lock = threading.Lock()
+        self._shared_plans = OrderedDict()  # id(plan) -> [plan, 描述信息, 共享块列表, 处理中的任务数]
+        self._plan_ids = itertools.count()
+        # 使用spawn启动工作进程，避免fork带有图形界面和线程的主进程
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_watch_parent, initargs=(os.getpid(),))
+        # 自动调节时解码线程数随允许的并发上限准备，实际并发由 in_flight_limit() 控制
+        decoders = tuner.max_limit if tuner is not None else self.max_workers
+        self._decoder = ThreadPoolExecutor(max_workers=decoders, thread_name_prefix="decode")
+
+    def _share_plan(self, plan):
+        """返回计划的共享描述信息，并登记一个使用它的任务（任务结束后调用 _release_plan）"""
+        with self._lock:
+            shared = self._shared_plans.get(id(plan))
+            if shared is None:
+                blocks, sprites = [], []
+                for sprite, position in plan.groups:
+                    shm, descriptor = image_to_shared(sprite)
+                    blocks.append(shm)
+                    sprites.append((descriptor, position))
+                descriptor = (next(self._plan_ids), plan.image_size, tuple(sprites))
+                shared = [plan, descriptor, blocks, 0]
+                self._shared_plans[id(plan)] = shared
+            else:
+                self._shared_plans.move_to_end(id(plan))
+            shared[3] += 1
+            return shared[1]
+
+    def _release_plan(self, plan):
+        with self._lock:
+            shared = self._shared_plans.get(id(plan))
+            if shared is None:
+                return
+            shared[3] -= 1
+            # 只释放没有任务在用的旧计划
+            idle = [key for key, entry in self._shared_plans.items() if entry[3] == 0]
+            for key in idle[:max(0, len(self._shared_plans) - MAX_SHARED_PLANS)]:
+                for shm in self._shared_plans.pop(key)[2]:
+                    release_shared(shm)
+
+    def _decode(self, job):
+        """在主进程的线程中解码，并按传输方式准备任务参数"""
+        image = open_for_export(job.path, _output_format(job))
+        plan = self.plan_for_size(image.size, job, image)
+        if self.transport == "shm":
+            shm, descriptor = image_to_shared(image)
+            return plan, shm, (descriptor, self._share_plan(plan))
+        data = image.tobytes()
+        sprites = tuple(((sprite.mode, sprite.size, sprite.tobytes()), position)
+                        for sprite, position in plan.groups)
+        with self._lock:
+            self.payload_bytes += len(data) + sum(len(s[0][2]) for s in sprites)
+        return None, None, ((image.mode, image.size, data), (plan.image_size, sprites))
+
+    def _decode_and_submit(self, job):
+        """解码完成后立即提交给工作进程，返回 (进程池的future, 主进程中的耗时, 其中阻塞在I/O上的时间)"""
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+
+        def elapsed():
+            seconds = time.perf_counter() - start
+            return seconds, max(0.0, seconds - (time.thread_time() - start_cpu))
+
+        if keeps_input_format(job) and mapped_io.watermark_mapped(job.path, job.output_path,
+                                                                   lambda size: self.plan_for_size(size, job)):
+            # 未压缩BMP/TIFF：内存映射后只合成水印区域，不需要解码整幅图片
+            future = Future()
+            future.set_result((0.0, None))
+            return (future, *elapsed())
+        plan, shm, args = self._decode(job)
+        target = _export_shared if self.transport == "shm" else _export_pickled
+        future = self._pool.submit(target, job, *args)
+        if shm is not None:
+            # 任务结束（无论成败）后释放该图片的共享块
+            def release(_):
+                release_shared(shm)
+                self._release_plan(plan)
+            future.add_done_callback(release)
+        return (future, *elapsed())
+
+    def submit(self, job):
+        """提交一个任务，返回在任务结束（无论成败）时得到 ExportResult 的future"""
+        done = Future()
+
+        def finish(result):
+            if self.tuner is not None:
+                self.tuner.observe(result)
+            done.set_result(result)
+
+        def on_exported(future, decode_seconds, io_wait, submitted):
+            try:
+                worker_seconds, data = future.result()
+            except Exception as e:
+                finish(ExportResult(job, e))
+                return
+            queued = max(0.0, time.perf_counter() - submitted - worker_seconds)
+            finish(ExportResult(job, None, decode_seconds + worker_seconds, queued, io_wait, data))
+
+        def on_submitted(submit_future):
+            try:
+                future, decode_seconds, io_wait = submit_future.result()
+            except Exception as e:
+                finish(ExportResult(job, e))
+                return
+            submitted = time.perf_counter()
+            future.add_done_callback(lambda f: on_exported(f, decode_seconds, io_wait, submitted))
+
+        self._decoder.submit(self._decode_and_submit, job).add_done_callback(on_submitted)
+        return done
+
+    def in_flight_limit(self):
+        """当前允许同时处理的图片数（自动调节时随内存压力和排队情况变化）"""
+        return self.tuner.limit if self.tuner is not None else self.max_in_flight
+
+    def export(self, jobs, ordered=True):
+        """产出 ExportResult：ordered 时按任务顺序，否则按完成顺序。处理中的任务数不超过 in_flight_limit()"""
+        return iter_results((self.submit(job) for job in jobs), self.in_flight_limit, ordered)
+
+    def worker_peak_rss(self):
+        """向每个工作进程询问其峰值常驻内存，返回其中的最大值（字节）；不支持时返回None
+
+        任务由进程池自行分配，工作进程较多时不保证问到每一个；用于单个工作进程的校准最准确。
+        """
+        futures = [self._pool.submit(_peak_rss) for _ in range(self.max_workers)]
+        peaks = [peak for peak in (future.result() for future in futures) if peak is not None]
+        return max(peaks) if peaks else None
+
+    def close(self):
+        """关闭进程池并释放精灵图共享块"""
+        self._decoder.shutdown()
+        self._pool.shutdown()
+        for _, _, blocks, _ in self._shared_plans.values():
+            for shm in blocks:
+                release_shared(shm)
+        self._shared_plans.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_results(futures, window, ordered=True):
+    """从 futures（惰性的迭代器）中最多同时取出 window 个，按提交顺序或完成顺序产出其结果
+
+    window 为整数，或每次提交前调用的函数（并发数在导出过程中变化时使用）。
+    """
+    limit = window if callable(window) else lambda: window
+    pending = deque() if ordered else set()
+    for future in futures:
+        if ordered:
+            pending.append(future)
+        else:
+            pending.add(future)
+        while len(pending) >= max(1, limit()):
+            yield from _take_finished(pending, ordered)
+    while pending:
+        yield from _take_finished(pending, ordered)
+
+
+def _take_finished(pending, ordered):
+    if ordered:
+        yield pending.popleft().result()
+        return
+    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in finished:
+        pending.remove(future)
+        yield future.result()
+
+
+def _export_multiframe(job, animated_format, plan_for_size, frame_executor, frame_workers):
+    start = time.perf_counter()
+    output = io.BytesIO() if job.in_memory else job.output_path
+    try:
+        animation.save_multiframe(job.path, output, animated_format,
+                                  lambda size: plan_for_size(size, job), frame_executor, frame_workers,
+                                  encoders.get_save_options(animated_format, job.preset, job.quality))
+    except Exception as e:
+        return ExportResult(job, e)
+    return ExportResult(job, None, time.perf_counter() - start,
+                        data=output.getvalue() if job.in_memory else None)
+
+
+def export_jobs(jobs, plan_for_size, infos=None, exporter=None, max_workers=None, ordered=True, tuner=None):
+    """导出一批任务，逐个产出 ExportResult（按任务顺序；ordered=False 时按完成顺序）
+
+    单帧图片交给 ParallelExporter 多进程处理（传入 exporter 时复用它）；
+    GIF动画/多页TIFF在线程中逐个处理，各帧并行添加水印。
+    plan_for_size(size, job, image=None) 返回该图片的渲染计划，infos 为 路径 -> ImageInfo（为None时逐个探测文件头）。
+    jobs 可以是惰性的迭代器：按处理窗口逐个读取，不会一次取出全部任务。
+    tuner（autotune.WorkerTuner）在没有传入 exporter 时用于自动选择并调整并发数。
+    """
+    own_exporter = exporter is None
+    if own_exporter:
+        exporter = ParallelExporter(plan_for_size, max_workers, tuner=tuner)
+    frame_executor = ThreadPoolExecutor(max_workers=exporter.max_workers, thread_name_prefix="frame")
+    multiframe_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="multiframe")
+
+    def submit(job):
+        info = infos[job.path] if infos is not None else probe_image(job.path)
+        if exporter.tuner is not None:
+            exporter.tuner.add_image(info)
+        animated_format = _output_format(job)
+        if animation.is_multiframe(info) and animated_format in animation.ANIMATED_OUTPUT_FORMATS:
+            return multiframe_executor.submit(_export_multiframe, job, animated_format, plan_for_size,
+                                              frame_executor, exporter.max_workers)
+        return exporter.submit(job)
+
+    try:
+        yield from iter_results((submit(job) for job in jobs), exporter.in_flight_limit, ordered)
+    finally:
+        multiframe_executor.shutdown()
+        frame_executor.shutdown()
+        if own_exporter:
+            exporter.close()
@@ -0,0 +1,182 @@
+"""
+批量导出的试运行预估
+全部文件只读取文件头；再按像素数均匀抽取一小批样本，用真实的水印合成和编码流程导出到临时目录，
+据此推算整批导出的耗时、每个工作进程的峰值内存和输出总大小，并按本机CPU和可用内存推荐工作进程数。
+
+用法：python preflight.py <图片或文件夹>... --settings <模板或配置文件> [--sample 12]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass, replace
+
+from autotune import available_memory
+from export_report import format_duration
+from image_probe import ImageProber
+from parallel_export import ParallelExporter, export_jobs
+from spool import collect_inputs, jobs_from_settings, layers_from_settings
+from watermark_engine import WatermarkRenderer
+
+DEFAULT_SAMPLE_SIZE = 12
+MEMORY_HEADROOM = 0.8  # 推荐进程数时只使用可用内存的这一比例
+# 主进程中每个工作进程对应的解码帧数：解码线程中的一帧 + 排队的共享内存块（max_in_flight 为进程数的2倍）
+PARENT_FRAMES_PER_WORKER = 3
+
+
+def total_pixels(info):
+    """所有帧的像素数"""
+    return info.width * info.height * max(1, info.n_frames)
+
+
+def pick_sample(infos, sample_size=DEFAULT_SAMPLE_SIZE):
+    """按像素数排序后等间隔抽样，总是包含最小和最大的图片"""
+    ordered = sorted(infos, key=total_pixels)
+    sample_size = max(2, sample_size)
+    if len(ordered) <= sample_size:
+        return ordered
+    step = (len(ordered) - 1) / (sample_size - 1)
+    return [ordered[round(i * step)] for i in range(sample_size)]
+
+
+def _fit_line(xs, ys):
+    """最小二乘拟合 y = a + b·x，返回 (a, b)；a、b 都不小于0"""
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return mean_y, 0.0
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance)
+    intercept = mean_y - slope * mean_x
+    if intercept < 0:
+        return 0.0, sum(ys) / sum(xs)
+    return intercept, slope
+
+
+def _format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@dataclass
+class PreflightEstimate:
+    """一批导出任务的预估结果"""
+    files: int
+    skipped: int
+    input_bytes: int
+    sample_files: int
+    sample_failures: int
+    serial_seconds: float  # 单个工作进程依次处理全部文件所需的时间
+    output_bytes: int
+    worker_peak_bytes: int  # 单个工作进程的峰值内存（实测；平台不支持时为按帧大小的估计）
+    per_worker_bytes: int  # 每增加一个工作进程需要的内存（含主进程中的解码帧）
+    available_bytes: int
+    cpu_count: int
+    recommended_workers: int
+
+    @property
+    def estimated_seconds(self):
+        """按推荐进程数理想并行时的耗时"""
+        return self.serial_seconds / self.recommended_workers
+
+    def describe(self):
+        lines = [f"待导出 {self.files} 张（跳过 {self.skipped} 张无法识别的文件），输入共 {_format_bytes(self.input_bytes)}",
+                 f"试运行样本 {self.sample_files} 张" + (f"，其中 {self.sample_failures} 张失败" if self.sample_failures else ""),
+                 f"单进程预计耗时 {format_duration(self.serial_seconds)}",
+                 f"推荐 {self.recommended_workers} 个工作进程（CPU {self.cpu_count} 核"
+                 + (f"，可用内存 {_format_bytes(self.available_bytes)}）" if self.available_bytes else "）"),
+                 f"预计耗时约 {format_duration(self.estimated_seconds)}",
+                 f"每个工作进程峰值内存约 {_format_bytes(self.worker_peak_bytes)}，"
+                 f"合计约 {_format_bytes(self.per_worker_bytes * self.recommended_workers)}",
+                 f"预计输出 {_format_bytes(self.output_bytes)}"]
+        return "\n".join(lines)
+
+
+def estimate(jobs, plan_for_size, infos, sample_size=DEFAULT_SAMPLE_SIZE):
+    """试运行并推算整批导出的开销；plan_for_size(size, job, image=None) 同 export_jobs，infos 为 路径 -> ImageInfo（只需文件头信息）"""
+    export_jobs_by_path = {job.path: job for job in jobs if infos[job.path].ok}
+    good_infos = [infos[path] for path in export_jobs_by_path]
+    if not good_infos:
+        raise ValueError("没有可以导出的图片")
+
+    with tempfile.TemporaryDirectory(prefix="watermark_preflight_") as temp_dir:
+        sample_jobs = [replace(export_jobs_by_path[info.path],
+                               output_path=os.path.join(temp_dir, f"{index}_" + os.path.basename(
+                                   export_jobs_by_path[info.path].output_path)))
+                       for index, info in enumerate(pick_sample(good_infos, sample_size))]
+        with ParallelExporter(plan_for_size, max_workers=1) as exporter:
+            # 预热：启动工作进程、加载编码器，不计入样本耗时
+            for _ in export_jobs(sample_jobs[:1], plan_for_size, infos, exporter=exporter):
+                pass
+            start = time.perf_counter()
+            results = list(export_jobs(sample_jobs, plan_for_size, infos, exporter=exporter))
+            sample_wall = time.perf_counter() - start
+            worker_peak = exporter.worker_peak_rss()
+        measured = [(total_pixels(infos[result.job.path]), result.seconds, os.path.getsize(result.job.output_path))
+                    for result in results if result.ok]
+    if not measured:
+        raise ValueError(f"试运行的 {len(results)} 张样本全部失败：{results[0].error}")
+
+    pixels = [item[0] for item in measured]
+    intercept, slope = _fit_line(pixels, [item[1] for item in measured])
+    # 解码（主进程线程）与合成编码（工作进程）是流水线重叠的，按样本的实际墙钟时间校准单张耗时之和
+    overlap = sample_wall / max(1e-9, sum(item[1] for item in measured)) if len(measured) == len(results) else 1.0
+    serial_seconds = overlap * sum(intercept + slope * total_pixels(info) for info in good_infos)
+    bytes_per_pixel = sum(item[2] for item in measured) / max(1, sum(pixels))
+    output_bytes = int(bytes_per_pixel * sum(total_pixels(info) for info in good_infos))
+
+    largest_frame = max(info.decoded_bytes for info in good_infos)
+    if worker_peak is None:
+        worker_peak = 3 * largest_frame  # 共享帧 + 合成结果 + 编码缓冲
+    per_worker = worker_peak + PARENT_FRAMES_PER_WORKER * largest_frame
+
+    cpu_count = os.cpu_count() or 1
+    available = available_memory()
+    workers = cpu_count
+    if available:
+        workers = min(workers, int(available * MEMORY_HEADROOM // per_worker))
+
+    return PreflightEstimate(
+        files=len(good_infos),
+        skipped=len(jobs) - len(good_infos),
+        input_bytes=sum(info.file_size for info in good_infos),
+        sample_files=len(results),
+        sample_failures=len(results) - len(measured),
+        serial_seconds=serial_seconds,
+        output_bytes=output_bytes,
+        worker_peak_bytes=worker_peak,
+        per_worker_bytes=per_worker,
+        available_bytes=available,
+        cpu_count=cpu_count,
+        recommended_workers=max(1, workers),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="试运行并预估批量导出的耗时、内存和输出大小")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--settings", required=True, help="模板或配置文件（JSON）")
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE_SIZE, help="试运行的样本数")
+    args = parser.parse_args()
+
+    with open(args.settings, "r", encoding="utf-8") as f:
+        settings = json.load(f)
+    layers = tuple(layers_from_settings(settings))
+    renderer = WatermarkRenderer()
+    # 输出路径只用于确定格式和扩展名，试运行的文件写在临时目录中
+    jobs = jobs_from_settings(settings, collect_inputs(args.inputs), tempfile.gettempdir())
+    prober = ImageProber()
+    try:
+        infos = {info.path: info for info in prober.probe_many([job.path for job in jobs])}
+    finally:
+        prober.shutdown()
+    result = estimate(jobs, renderer.planner(layers), infos, args.sample)
+    print(result.describe())
+
+
+if __name__ == "__main__":
+    main()
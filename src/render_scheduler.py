@@ -0,0 +1,61 @@
+"""
+预览渲染调度
+拖拽、滑块等高频界面事件不直接渲染，而是登记到调度器；每个显示帧最多渲染一次，
+同一类渲染只执行最新登记的那一次，被替换掉的请求计为丢弃帧。
+"""
+
+FRAME_INTERVAL_MS = 16  # 约60帧/秒
+
+
+class RenderScheduler:
+    """把同一帧内的渲染请求合并为一次（需在Tk主线程中使用）"""
+
+    def __init__(self, widget, frame_interval=FRAME_INTERVAL_MS):
+        self.widget = widget
+        self.frame_interval = frame_interval
+        self.requested = 0
+        self.rendered = 0
+        self.dropped = 0
+        self._pending = {}  # 渲染类型 -> 回调（按登记顺序执行）
+        self._frame_job = None
+
+    def schedule(self, kind, callback):
+        """登记渲染；同类型已有未执行的请求时，用新回调替换旧的"""
+        self.requested += 1
+        if kind in self._pending:
+            self.dropped += 1
+            del self._pending[kind]  # 重新插入，保持最近登记的排在后面
+        self._pending[kind] = callback
+        if self._frame_job is None:
+            self._frame_job = self.widget.after(self.frame_interval, self._run_frame)
+
+    def cancel(self, kind):
+        """取消尚未执行的请求"""
+        if self._pending.pop(kind, None) is not None:
+            self.dropped += 1
+
+    def flush(self, kind=None):
+        """立即执行指定类型（默认全部）的待渲染请求"""
+        kinds = list(self._pending) if kind is None else [kind]
+        for pending_kind in kinds:
+            callback = self._pending.pop(pending_kind, None)
+            if callback is None:
+                continue
+            self.rendered += 1
+            try:
+                callback()
+            except Exception as e:
+                print(f"Render error ({pending_kind}): {e}")
+
+    def _run_frame(self):
+        self._frame_job = None
+        self.flush()
+
+    def stats(self):
+        return {"requested": self.requested, "rendered": self.rendered, "dropped": self.dropped}
+
+    def shutdown(self):
+        if self._frame_job is not None:
+            self.widget.after_cancel(self._frame_job)
+            self._frame_job = None
+        self._pending.clear()
@@ -0,0 +1,402 @@
+"""
+共享目录分布式导出
+协调端把一次导出拆分为若干分片(shard)写入共享存储（如NFS）上的任务目录，
+任意节点上的工作进程通过原子重命名认领分片，用 process_and_export_images 相同的流程处理。
+
+目录结构:
+    job.json                    水印图层和任务信息
+    pending/<分片>.json         待处理
+    claimed/<分片>@<工作者>.json 已认领；工作者定期更新其修改时间作为心跳
+    done/<分片>.json            已完成，记录每个文件的结果
+
+心跳超时的分片会被重新放回 pending（任一工作者或 watch 命令都会执行回收）。
+判断超时使用文件修改时间，各节点时钟需大致同步，超时时间应远大于心跳间隔。
+原工作者发现分片被回收后放弃该分片（不再处理剩余图片，也不记录完成），已在处理中的图片可能被输出两次（内容相同）。
+
+用法:
+    python spool.py submit <任务目录> <输出目录> <图片或文件夹 ...> --settings <模板或配置文件>
+    python spool.py worker <任务目录>
+    python spool.py watch <任务目录>
+    python spool.py local <任务目录> --workers 3     在本机启动多个工作进程（单机测试）
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import encoders
+from image_probe import probe_image
+from archive_input import is_archive, iter_images
+from autotune import WorkerTuner
+from parallel_export import ExportJob, ParallelExporter, export_jobs
+from watermark_engine import WatermarkLayer, WatermarkRenderer
+
+JOB_FILENAME = "job.json"
+JOB_VERSION = 1
+SPOOL_DIRS = ("pending", "claimed", "done")
+DEFAULT_SHARD_SIZE = 20
+HEARTBEAT_INTERVAL = 10  # 秒
+STALE_AFTER = 60  # 超过该时间没有心跳的分片会被回收
+SUPPORTED_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif')
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再重命名，其他节点不会读到写了一半的文件"""
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Shard:
+    """已认领的分片"""
+
+    def __init__(self, shard_id, claim_path, items):
+        self.shard_id = shard_id
+        self.claim_path = claim_path
+        self.items = items
+
+    def jobs(self):
+        return [ExportJob(**item) for item in self.items]
+
+
+class Spool:
+    """共享任务目录"""
+
+    def __init__(self, root):
+        self.root = root
+        self.job_path = os.path.join(root, JOB_FILENAME)
+        self.dirs = {name: os.path.join(root, name) for name in SPOOL_DIRS}
+
+    def _list(self, name):
+        try:
+            return sorted(entry for entry in os.listdir(self.dirs[name]) if entry.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    # ---------- 协调端 ----------
+
+    def create_job(self, layers, jobs, shard_size=DEFAULT_SHARD_SIZE):
+        """写入任务信息和分片；任务目录中已有任务时抛出FileExistsError"""
+        if os.path.exists(self.job_path):
+            raise FileExistsError(self.job_path)
+        for path in self.dirs.values():
+            os.makedirs(path, exist_ok=True)
+        shard_count = (len(jobs) + shard_size - 1) // shard_size
+        for index in range(shard_count):
+            items = [{"path": job.path, "output_path": job.output_path, "image_format": job.image_format,
+                      "preset": job.preset, "quality": job.quality, "index": job.index}
+                     for job in jobs[index * shard_size:(index + 1) * shard_size]]
+            _write_json_atomic(os.path.join(self.dirs["pending"], f"shard-{index:05d}.json"), {"items": items})
+        # job.json 最后写入，工作者看到它时所有分片都已就绪
+        _write_json_atomic(self.job_path, {
+            "version": JOB_VERSION,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "layers": [layer.to_dict() for layer in layers],
+            "shard_count": shard_count,
+            "image_count": len(jobs),
+        })
+        return shard_count
+
+    def load_job(self):
+        job = _read_json(self.job_path)
+        if job.get("version") != JOB_VERSION:
+            raise ValueError(f"Unsupported spool job version: {job.get('version')}")
+        return job
+
+    def reclaim_stale(self, stale_after=STALE_AFTER):
+        """把心跳超时的分片放回 pending，返回回收的数量"""
+        reclaimed = 0
+        now = time.time()
+        for name in self._list("claimed"):
+            path = os.path.join(self.dirs["claimed"], name)
+            try:
+                if now - os.stat(path).st_mtime <= stale_after:
+                    continue
+                shard_id = name.split("@", 1)[0]
+                os.rename(path, os.path.join(self.dirs["pending"], f"{shard_id}.json"))
+                reclaimed += 1
+                print(f"Reclaimed stale shard {shard_id} ({name})")
+            except FileNotFoundError:
+                pass  # 已被完成或被其他节点回收
+        return reclaimed
+
+    def status(self):
+        """各状态的分片数和已完成的文件结果统计"""
+        done = self._list("done")
+        succeeded = failed = 0
+        for name in done:
+            try:
+                results = _read_json(os.path.join(self.dirs["done"], name))["results"]
+            except (OSError, ValueError, KeyError):
+                continue
+            failed += sum(1 for result in results if result["error"])
+            succeeded += sum(1 for result in results if not result["error"])
+        return {
+            "pending": len(self._list("pending")),
+            "claimed": len(self._list("claimed")),
+            "done": len(done),
+            "succeeded": succeeded,
+            "failed": failed,
+        }
+
+    def is_finished(self):
+        return not self._list("pending") and not self._list("claimed")
+
+    # ---------- 工作端 ----------
+
+    def claim(self, worker_id):
+        """认领一个待处理分片；rename是原子的，多个节点竞争时只有一个会成功"""
+        for name in self._list("pending"):
+            shard_id = name[:-len(".json")]
+            pending_path = os.path.join(self.dirs["pending"], name)
+            claim_path = os.path.join(self.dirs["claimed"], f"{shard_id}@{worker_id}.json")
+            try:
+                # 重命名保留原修改时间：先更新再重命名，否则其他节点可能在两步之间把刚认领的分片判定为超时
+                os.utime(pending_path)
+                os.rename(pending_path, claim_path)
+            except FileNotFoundError:
+                continue  # 被其他工作者抢先认领
+            return Shard(shard_id, claim_path, _read_json(claim_path)["items"])
+        return None
+
+    def heartbeat(self, shard):
+        """更新分片的修改时间；分片已被回收时返回False"""
+        try:
+            os.utime(shard.claim_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, shard, worker_id, results):
+        """记录分片结果并移除认领文件"""
+        _write_json_atomic(os.path.join(self.dirs["done"], f"{shard.shard_id}.json"), {
+            "worker": worker_id,
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results,
+        })
+        try:
+            os.remove(shard.claim_path)
+        except FileNotFoundError:
+            # 分片在处理期间被回收：如果还没有被重新认领，撤回待处理副本避免重复处理
+            try:
+                os.remove(os.path.join(self.dirs["pending"], f"{shard.shard_id}.json"))
+            except FileNotFoundError:
+                pass
+
+
+class Heartbeat:
+    """后台线程定期为分片发送心跳"""
+
+    def __init__(self, spool, shard, interval=HEARTBEAT_INTERVAL):
+        self.spool = spool
+        self.shard = shard
+        self.interval = interval
+        self.lost = False  # 分片被回收（例如本节点暂停过久）
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.spool.heartbeat(self.shard):
+                self.lost = True
+                print(f"Shard {self.shard.shard_id} was reclaimed by another node")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(spool_dir, worker_id=None, max_workers=None,
+               heartbeat_interval=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER):
+    """认领并处理分片，直到任务全部完成；返回处理的分片数"""
+    spool = Spool(spool_dir)
+    job = spool.load_job()
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    layers = tuple(WatermarkLayer.from_dict(data) for data in job["layers"])
+    plan_for_size = WatermarkRenderer().planner(layers)
+
+    processed = 0
+    # 未指定进程数时自动选择，并按处理中的图片尺寸和内存压力调整并发
+    tuner = WorkerTuner() if max_workers is None else None
+    with ParallelExporter(plan_for_size, max_workers, tuner=tuner) as exporter:
+        while True:
+            shard = spool.claim(worker_id)
+            if shard is None:
+                if spool.reclaim_stale(stale_after):
+                    continue
+                if spool.is_finished():
+                    break
+                # 其他节点仍在处理：等待它们完成或超时
+                time.sleep(heartbeat_interval)
+                continue
+
+            print(f"[{worker_id}] Processing {shard.shard_id} ({len(shard.items)} images)")
+            jobs = shard.jobs()
+            infos = {job.path: probe_image(job.path) for job in jobs}
+            results = []
+            with Heartbeat(spool, shard, heartbeat_interval) as heartbeat:
+                # 分片被回收后不再提交剩余的图片，由重新认领它的节点处理
+                live_jobs = (job for job in jobs if not heartbeat.lost)
+                for result in export_jobs(live_jobs, plan_for_size, infos, exporter=exporter):
+                    if not result.ok:
+                        print(f"Error processing {result.job.path}: {result.error}")
+                    results.append({"path": result.job.path, "output_path": result.job.output_path,
+                                    "error": None if result.ok else str(result.error),
+                                    "seconds": result.seconds})
+            if heartbeat.lost or not spool.heartbeat(shard):
+                print(f"[{worker_id}] Abandoned {shard.shard_id}: it was reclaimed by another node")
+                continue
+            spool.complete(shard, worker_id, results)
+            processed += 1
+    print(f"[{worker_id}] Finished, {processed} shards processed")
+    return processed
+
+
+def watch(spool_dir, interval=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER):
+    """协调端：定期回收超时分片并显示进度，直到全部完成"""
+    spool = Spool(spool_dir)
+    while True:
+        spool.reclaim_stale(stale_after)
+        status = spool.status()
+        print(f"pending {status['pending']}  claimed {status['claimed']}  done {status['done']}  "
+              f"succeeded {status['succeeded']}  failed {status['failed']}")
+        if spool.is_finished():
+            return status
+        time.sleep(interval)
+
+
+# ---------- 命令行 ----------
+
+def layers_from_settings(settings):
+    """从模板/配置文件内容构造图层列表（已固定的图层 + 当前编辑的图层）"""
+    layers = [WatermarkLayer.from_dict(data) for data in settings.get("watermark_layers", [])]
+    anchor = settings.get("custom_anchor")
+    common = {
+        "rotation": settings.get("rotation", 0),
+        "position": settings.get("position", "br"),
+        "anchor": tuple(anchor) if anchor else None,
+        "size_mode": settings.get("size_mode", "fixed"),
+        "relative_size": float(settings.get("relative_size", 20)),
+    }
+    if settings.get("watermark_type", "text") == "text":
+        layers.append(WatermarkLayer(kind="text", text=settings.get("text_content", ""),
+                                     font_name=settings.get("text_font", "Arial"),
+                                     font_size=settings.get("text_font_size", 48),
+                                     color=tuple(settings.get("text_color", (255, 255, 255))),
+                                     opacity=settings.get("text_opacity", 0.5),
+                                     auto_color=settings.get("auto_text_color", False), **common))
+    else:
+        layers.append(WatermarkLayer(kind="image", image_path=settings.get("image_watermark_path"),
+                                     scale=settings.get("image_scale", 1.0),
+                                     opacity=settings.get("image_opacity", 0.5), **common))
+    return [layer for layer in layers if not layer.is_empty()]
+
+
+def collect_inputs(paths):
+    """展开命令行中的文件夹和ZIP/TAR归档（归档中的图片不解压，按虚拟路径读取），只保留支持的图片格式"""
+    files = []
+    for path in paths:
+        if is_archive(path):
+            files.extend(iter_images(path))
+        elif os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if os.path.splitext(name)[1].lower() in SUPPORTED_EXTS)
+        else:
+            files.append(path)
+    return files
+
+
+def job_from_settings(settings, path, output_dir, index=0, taken=None):
+    """按设置中的输出格式、命名规则和编码预设生成一张图片的导出任务
+
+    taken 为这一批已分配的输出文件名（见 encoders.unique_filename），同名的输出追加序号而不是互相覆盖。
+    """
+    output_format = settings.get("output_format", "original")
+    # 默认值与界面的命名设置一致
+    filename = encoders.output_filename(path, output_format, settings.get("output_naming_rule", "suffix"),
+                                        settings.get("output_prefix", "wm_"),
+                                        settings.get("output_suffix", "_watermark"))
+    if taken is not None:
+        filename = encoders.unique_filename(filename, taken)
+    return ExportJob(os.path.abspath(path), os.path.join(os.path.abspath(output_dir), filename),
+                     encoders.resolve_output_format(output_format, path),
+                     settings.get("encoder_preset", encoders.DEFAULT_PRESET),
+                     settings.get("jpeg_quality", 95), index)
+
+
+def jobs_from_settings(settings, inputs, output_dir):
+    """按设置中的输出格式、命名规则和编码预设生成导出任务"""
+    taken = set()
+    return [job_from_settings(settings, path, output_dir, index, taken) for index, path in enumerate(inputs, 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享目录分布式导出")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="拆分任务并写入任务目录")
+    submit_parser.add_argument("spool")
+    submit_parser.add_argument("output")
+    submit_parser.add_argument("inputs", nargs="+")
+    submit_parser.add_argument("--settings", required=True, help="模板或配置文件（JSON）")
+    submit_parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+
+    worker_parser = subparsers.add_parser("worker", help="认领并处理分片")
+    worker_parser.add_argument("spool")
+    worker_parser.add_argument("--id", default=None)
+    worker_parser.add_argument("--processes", type=int, default=None, help="本节点的导出进程数")
+
+    watch_parser = subparsers.add_parser("watch", help="回收超时分片并显示进度")
+    watch_parser.add_argument("spool")
+
+    local_parser = subparsers.add_parser("local", help="在本机启动多个工作进程")
+    local_parser.add_argument("spool")
+    local_parser.add_argument("--workers", type=int, default=2)
+    local_parser.add_argument("--processes", type=int, default=1, help="每个工作进程的导出进程数")
+
+    for sub in (worker_parser, watch_parser, local_parser):
+        sub.add_argument("--heartbeat", type=float, default=HEARTBEAT_INTERVAL)
+        sub.add_argument("--stale-after", type=float, default=STALE_AFTER)
+
+    args = parser.parse_args()
+    if args.command == "submit":
+        settings = _read_json(args.settings)
+        os.makedirs(args.output, exist_ok=True)
+        jobs = jobs_from_settings(settings, collect_inputs(args.inputs), args.output)
+        shard_count = Spool(args.spool).create_job(layers_from_settings(settings), jobs, args.shard_size)
+        print(f"Submitted {len(jobs)} images in {shard_count} shards")
+    elif args.command == "worker":
+        run_worker(args.spool, args.id, args.processes, args.heartbeat, args.stale_after)
+    elif args.command == "watch":
+        watch(args.spool, args.heartbeat, args.stale_after)
+    elif args.command == "local":
+        workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", args.spool,
+                                     "--id", f"{socket.gethostname()}-local{index}",
+                                     "--processes", str(args.processes),
+                                     "--heartbeat", str(args.heartbeat), "--stale-after", str(args.stale_after)])
+                   for index in range(args.workers)]
+        try:
+            watch(args.spool, args.heartbeat, args.stale_after)
+        finally:
+            for process in workers:
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
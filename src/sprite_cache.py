@@ -0,0 +1,103 @@
+"""
+水印精灵图缓存（预览和 WatermarkRenderer 共用）
+缓存键由决定精灵图外观的内容构成（文本、字体、颜色、旋转、透明度、水印图片的内容摘要等），
+总大小按精灵图像素字节数限制，超出时淘汰最久未使用的条目；可在多个线程中并发访问。
+也可以缓存其他占用像素内存的对象（渲染计划、水印图片），由 sizeof 给出其字节数。
+"""
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+DEFAULT_SPRITE_CACHE_BYTES = 64 * 1024 * 1024
+
+# 图片对象 -> 内容摘要的备忘；以id为键，图片被回收时立即删除，id复用后不会取到旧的摘要
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def _forget_digest(key):
+    with _digests_lock:
+        _digests.pop(key, None)
+
+
+def image_bytes(image):
+    """图片像素数据占用的字节数"""
+    return image.width * image.height * len(image.getbands())
+
+
+def content_digest(image):
+    """图片像素内容的摘要（同一对象只计算一次）"""
+    key = id(image)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is not None:
+        return digest
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{image.mode}{image.size}".encode())
+    hasher.update(image.tobytes())
+    digest = hasher.hexdigest()
+    with _digests_lock:
+        if key not in _digests:
+            _digests[key] = digest
+            weakref.finalize(image, _forget_digest, key)
+    return digest
+
+
+class SpriteCache:
+    """按字节数限制大小的线程安全LRU缓存：内容键 -> 精灵图（或 sizeof 能计算字节数的其他对象）"""
+
+    def __init__(self, max_bytes=DEFAULT_SPRITE_CACHE_BYTES, sizeof=image_bytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # 键 -> (精灵图, 字节数)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, sprite):
+        size = self.sizeof(sprite)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            if size > self.max_bytes:
+                return  # 单个精灵图超过上限时不缓存
+            self._entries[key] = (sprite, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """返回缓存的精灵图；未命中时调用 factory() 生成（在锁外执行），结果为None时不缓存"""
+        sprite = self.get(key)
+        if sprite is None:
+            sprite = factory()
+            if sprite is not None:
+                self.put(key, sprite)
+        return sprite
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self.current_bytes}
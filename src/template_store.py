@@ -0,0 +1,231 @@
+"""
+模板存储
+用单个索引文件记录模板名称、元数据和修改时间，避免每次刷新都扫描目录并逐个解析JSON。
+- 目录修改时间未变化时直接使用索引，不扫描目录
+- 目录变化时增量刷新，只重新读取修改过的模板；只有模板确实变化时才写回索引
+- 其他客户端（共享网络盘）更新了索引文件时重新加载，复用它们已读取的元数据
+- 模板内容在加载时才读取（懒加载）
+- 支持按前缀搜索模板名称
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+INDEX_FILENAME = ".template_index"
+INDEX_VERSION = 1
+
+
+class TemplateStore:
+    """带索引的模板存储"""
+
+    def __init__(self, templates_dir, extension=".json"):
+        self.templates_dir = templates_dir
+        self.extension = extension
+        self.index_path = os.path.join(templates_dir, INDEX_FILENAME)
+        self._lock = threading.RLock()
+        self._entries = {}  # 模板名 -> {"mtime", "size", "metadata"}
+        self._dir_mtime = None
+        self._index_mtime = None  # 已加载/写入的索引文件的修改时间
+        self._sorted_names = []
+        self._sorted_keys = []  # 小写名称，用于不区分大小写的前缀搜索
+        self._load_index()
+
+    # ---------- 索引读写 ----------
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._index_mtime = os.fstat(f.fileno()).st_mtime
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self._entries = data.get("templates", {})
+                self._dir_mtime = data.get("dir_mtime")
+        except (OSError, ValueError):
+            self._entries = {}
+            self._dir_mtime = None
+        self._rebuild_sorted()
+
+    def _reload_index_if_changed(self):
+        """索引文件被其他客户端改写过时重新加载"""
+        try:
+            index_mtime = os.stat(self.index_path).st_mtime
+        except OSError:
+            return
+        if index_mtime != self._index_mtime:
+            self._load_index()
+
+    def _save_index(self):
+        data = {
+            "version": INDEX_VERSION,
+            "dir_mtime": self._dir_mtime,
+            "templates": self._entries,
+        }
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            # 在替换前记录自己写入的版本，替换后才被其他客户端改写的索引仍会被重新加载
+            index_mtime = os.stat(tmp_path).st_mtime
+            os.replace(tmp_path, self.index_path)
+            self._index_mtime = index_mtime
+        except OSError as e:
+            print(f"Failed to write template index: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _rebuild_sorted(self):
+        self._sorted_names = sorted(self._entries, key=str.lower)
+        self._sorted_keys = [name.lower() for name in self._sorted_names]
+
+    def _stat_dir_mtime(self):
+        try:
+            return os.stat(self.templates_dir).st_mtime
+        except OSError:
+            return None
+
+    def _read_entry(self, path, stat):
+        """读取单个模板文件的元数据"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+            metadata = settings.get("template_metadata", {})
+        except (OSError, ValueError) as e:
+            print(f"Failed to read template {path}: {e}")
+            metadata = {}
+        return {"mtime": stat.st_mtime, "size": stat.st_size, "metadata": metadata}
+
+    # ---------- 查询 ----------
+
+    def refresh(self, full=False):
+        """增量刷新索引；目录未变化且非强制刷新时不扫描目录。返回是否有变化"""
+        with self._lock:
+            if not os.path.isdir(self.templates_dir):
+                os.makedirs(self.templates_dir, exist_ok=True)
+
+            self._reload_index_if_changed()
+            # 在扫描之前记录目录修改时间：扫描期间新建的模板会让下一次刷新重新扫描，而不会被漏掉
+            dir_mtime = self._stat_dir_mtime()
+            if not full and dir_mtime is not None and dir_mtime == self._dir_mtime:
+                return False
+
+            changed = False
+            seen = set()
+            with os.scandir(self.templates_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(self.extension) or not entry.is_file():
+                        continue
+                    name = entry.name[:-len(self.extension)]
+                    seen.add(name)
+                    stat = entry.stat()
+                    cached = self._entries.get(name)
+                    if cached and cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+                        continue
+                    self._entries[name] = self._read_entry(entry.path, stat)
+                    changed = True
+
+            for name in list(self._entries):
+                if name not in seen:
+                    del self._entries[name]
+                    changed = True
+
+            self._dir_mtime = dir_mtime
+            if changed:
+                # 写入索引会改变目录修改时间，下一次刷新会再扫描一次（只stat，不读取模板），没有变化时不再写入
+                self._rebuild_sorted()
+                self._save_index()
+            return changed
+
+    def names(self):
+        """按名称排序的模板列表"""
+        with self._lock:
+            return list(self._sorted_names)
+
+    def search(self, prefix):
+        """按前缀（不区分大小写）搜索模板名称"""
+        with self._lock:
+            if not prefix:
+                return list(self._sorted_names)
+            key = prefix.lower()
+            start = bisect.bisect_left(self._sorted_keys, key)
+            end = bisect.bisect_left(self._sorted_keys, key + "\uffff")
+            return self._sorted_names[start:end]
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def metadata(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry["metadata"]) if entry else None
+
+    def get_path(self, name):
+        return os.path.join(self.templates_dir, f"{name}{self.extension}")
+
+    # ---------- 读写模板 ----------
+
+    def load(self, name):
+        """读取模板内容；文件不存在时从索引中移除并抛出FileNotFoundError"""
+        path = self.get_path(name)
+        try:
+            stat = os.stat(path)
+            with open(path, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        except FileNotFoundError:
+            with self._lock:
+                if self._entries.pop(name, None) is not None:
+                    self._rebuild_sorted()
+                    self._save_index()
+            raise
+        with self._lock:
+            entry = self._entries.get(name)
+            if not entry or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+                self._entries[name] = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "metadata": settings.get("template_metadata", {}),
+                }
+                self._rebuild_sorted()
+                self._save_index()
+        return settings
+
+    def save(self, name, settings):
+        """保存模板并更新索引"""
+        path = self.get_path(name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=4, ensure_ascii=False)
+        stat = os.stat(path)
+        with self._lock:
+            self._entries[name] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "metadata": settings.get("template_metadata", {}),
+            }
+            self._rebuild_sorted()
+            self._save_index()
+
+    def rename(self, old_name, new_name):
+        """重命名模板，同时更新模板内部的元数据"""
+        if self.exists(new_name) or os.path.exists(self.get_path(new_name)):
+            raise FileExistsError(new_name)
+        os.rename(self.get_path(old_name), self.get_path(new_name))
+        with self._lock:
+            self._entries.pop(old_name, None)
+        settings = self.load(new_name)
+        if "template_metadata" in settings:
+            settings["template_metadata"]["name"] = new_name
+            settings["template_metadata"]["modified_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.save(new_name, settings)
+
+    def delete(self, name):
+        """删除模板并从索引中移除"""
+        os.remove(self.get_path(name))
+        with self._lock:
+            self._entries.pop(name, None)
+            self._rebuild_sorted()
+            self._save_index()
@@ -0,0 +1,100 @@
+"""
+水印文本中的动态字段
+文本中可以用 {字段} 占位，导出时按每张图片替换：
+  {filename}     文件名（含扩展名）         {name}       文件名（不含扩展名）
+  {index}        在本批图片中的序号（从1开始，可指定格式，如 {index:04d}）
+  {artist}       EXIF中的作者               {copyright}  EXIF中的版权信息
+  {exif.date}    拍摄日期（YYYY-MM-DD）     {exif.标签名} 任意EXIF标签，如 {exif.Model}
+缺少的EXIF字段替换为空字符串，无法识别的字段原样保留。
+"""
+
+import os
+import re
+import threading
+
+from PIL import ExifTags, Image
+
+from archive_input import open_input
+
+TOKEN_PATTERN = re.compile(r"\{([A-Za-z_][\w.]*)(?::([^{}]*))?\}")
+
+
+def has_tokens(text):
+    """文本中是否含有动态字段"""
+    return bool(text) and TOKEN_PATTERN.search(text) is not None
+
+
+def read_exif(path):
+    """只读取文件头中的EXIF（含Exif子目录），返回 标签名 -> 值；读取失败时返回空字典"""
+    try:
+        with open_input(path) as source, Image.open(source) as image:
+            exif = image.getexif()
+            tags = dict(exif)
+            tags.update(exif.get_ifd(ExifTags.IFD.Exif))
+    except Exception:
+        return {}
+    values = {}
+    for tag, value in tags.items():
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "ignore")
+        if isinstance(value, str):
+            value = value.strip("\x00 ")
+        values[ExifTags.TAGS.get(tag, str(tag))] = value
+    return values
+
+
+def _exif_date(exif):
+    value = exif.get("DateTimeOriginal") or exif.get("DateTime")
+    if not isinstance(value, str) or len(value) < 10:
+        return ""
+    return value[:10].replace(":", "-")
+
+
+class TokenContext:
+    """一张图片的字段取值；EXIF在首次用到时才读取"""
+
+    def __init__(self, path, index=0):
+        self.path = path
+        self.index = index
+        self._exif = None
+        self._lock = threading.Lock()
+
+    @property
+    def exif(self):
+        with self._lock:
+            if self._exif is None:
+                self._exif = read_exif(self.path)
+            return self._exif
+
+    def value(self, field):
+        """字段的值；无法识别的字段返回None"""
+        if field == "filename":
+            return os.path.basename(self.path)
+        if field == "name":
+            return os.path.splitext(os.path.basename(self.path))[0]
+        if field == "index":
+            return self.index
+        if field == "artist":
+            return self.exif.get("Artist", "")
+        if field == "copyright":
+            return self.exif.get("Copyright", "")
+        if field == "exif.date":
+            return _exif_date(self.exif)
+        if field.startswith("exif."):
+            return self.exif.get(field[5:], "")
+        return None
+
+    def resolve(self, text):
+        """替换文本中的全部动态字段"""
+        def substitute(match):
+            field, spec = match.group(1), match.group(2)
+            value = self.value(field)
+            if value is None:
+                return match.group(0)
+            if spec:
+                try:
+                    return format(value, spec)
+                except (TypeError, ValueError):
+                    pass
+            return str(value)
+        return TOKEN_PATTERN.sub(substitute, text)
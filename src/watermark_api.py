@@ -0,0 +1,147 @@
+"""
+Python库接口：在其他程序（如ETL任务）中直接调用水印引擎，不需要启动界面或命令行
+
+    from watermark_api import apply, watermark_many
+
+    marked = apply(Image.open("a.jpg"), settings)              # 单张图片，返回新图片
+    for result in watermark_many(paths, settings, workers=4, ordered=False):
+        print(result.source, result.ok, result.seconds)        # 每完成一张就产出一个结果
+
+spec 为模板/配置文件的内容（dict，与 spool.py 的 --settings 相同，含输出格式、命名规则和编码预设），
+或 WatermarkLayer（也可以是 WatermarkLayer.to_dict() 的字典）组成的列表。
+同一进程内的调用共用一个 WatermarkRenderer，精灵图和字形缓存跨调用复用。
+"""
+
+import io
+import os
+import tempfile
+from dataclasses import dataclass, replace
+
+from PIL import Image
+
+from archive_input import expand_inputs
+from archive_output import ARCHIVE_FORMATS, ArchiveWriter
+from autotune import WorkerTuner
+from parallel_export import ExportJob, export_jobs
+from spool import job_from_settings, layers_from_settings
+from watermark_engine import WatermarkLayer, WatermarkRenderer, is_opaque_image
+
+_renderer = WatermarkRenderer()
+
+
+@dataclass(frozen=True)
+class WatermarkResult:
+    """一个输入的处理结果；失败时 output 和 seconds 为None"""
+    index: int  # 在输入中的序号（从1开始）
+    source: str  # 输入路径；字节输入时为传入的名称（没有名称时为None）
+    output: object = None  # 输出路径；写入归档时为条目名；两者都未指定时为编码后的字节
+    seconds: float = None  # 解码、合成和编码实际耗费的时间
+    error: Exception = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def layers_from_spec(spec):
+    """spec -> (设置字典, 图层元组)"""
+    if isinstance(spec, dict):
+        return spec, tuple(layers_from_settings(spec))
+    layers = tuple(layer if isinstance(layer, WatermarkLayer) else WatermarkLayer.from_dict(layer) for layer in spec)
+    return {}, tuple(layer for layer in layers if not layer.is_empty())
+
+
+def apply(image, spec, index=0):
+    """为一张已打开的图片添加水印，返回新图片（不修改传入的图片）
+
+    水印文本中的 {filename}、{exif.*} 等字段按 image.filename 读取；index 用于 {index}。
+    """
+    _, layers = layers_from_spec(spec)
+    frame = image.convert("RGB") if is_opaque_image(image) else image.convert("RGBA")
+    job = ExportJob(getattr(image, "filename", "") or "", "", index=index)
+    return _renderer.planner(layers)(frame.size, job, frame).apply(frame)
+
+
+def _extension_for(data):
+    """按文件头识别字节数据的格式，返回扩展名；无法识别时返回 ".bin"（随后的解码会报告错误）"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+    except Exception:
+        return ".bin"
+    for ext, name in Image.registered_extensions().items():
+        if name == image_format:
+            return ext
+    return ".bin"
+
+
+def _spill(item, index, temp_dir):
+    """把输入转换为文件路径，返回 (source, 路径, 是否为临时文件)；字节输入写入临时目录"""
+    if isinstance(item, (str, os.PathLike)):
+        path = os.fspath(item)
+        return path, path, False
+    name, data = item if isinstance(item, tuple) else (None, item)
+    folder = os.path.join(temp_dir, "in", str(index))
+    os.makedirs(folder)
+    # 以传入的名称保存，水印文本中的 {filename}/{name} 和输出文件名沿用它
+    path = os.path.join(folder, os.path.basename(name) if name else f"image_{index}{_extension_for(data)}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return name, path, True
+
+
+def watermark_many(inputs, spec, output_dir=None, workers=None, ordered=True, archive=None, volume_size=None):
+    """批量添加水印，逐个产出 WatermarkResult
+
+    inputs 为可迭代对象（可以是惰性的生成器），元素为文件路径、图片字节，或 (名称, 字节)；
+    ZIP/TAR归档的路径会展开为其中的图片，边列出边处理，不解压到磁盘。
+    指定 output_dir 时按 spec 中的命名规则写入该目录，result.output 为输出路径；
+    指定 archive（.zip 或 .tar 文件路径）时直接写入该归档，按 volume_size 字节分卷，result.output 为条目名；
+    两者都未指定时 result.output 为编码后的字节。
+    workers 为工作进程数（默认CPU核数）；为 "auto" 时按CPU、可用内存和图片尺寸自动选择并在运行中调整。
+    ordered=False 时按完成顺序产出，先完成的先返回。
+    同时处理的图片数不超过工作进程数的2倍（自动调节时见 autotune），输入按这个窗口逐个读取，内存占用与输入总数无关。
+    """
+    if output_dir is not None and archive is not None:
+        raise ValueError("output_dir and archive are mutually exclusive")
+    archive_format = os.path.splitext(archive)[1].lower().lstrip(".") if archive else None
+    if archive and archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive type: {archive}")
+    settings, layers = layers_from_spec(spec)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="watermark_api_") as temp_dir:
+        sources = {}  # 序号 -> (source, 临时输入文件)
+        taken = set()  # 已分配的输出文件名，同名的输出追加序号
+
+        def jobs():
+            for index, item in enumerate(expand_inputs(inputs), 1):
+                source, path, spilled = _spill(item, index, temp_dir)
+                sources[index] = (source, path if spilled else None)
+                job = job_from_settings(settings, path, output_dir or temp_dir, index, taken)
+                if output_dir is None:
+                    # 在工作进程中编码到内存，输出路径只保留文件名（用于确定格式和归档中的条目名）
+                    job = replace(job, output_path=os.path.basename(job.output_path), in_memory=True)
+                yield job
+
+        tuner = WorkerTuner() if workers == "auto" else None
+        writer = ArchiveWriter(archive, archive_format, volume_size) if archive else None
+        try:
+            for result in export_jobs(jobs(), _renderer.planner(layers), max_workers=None if tuner else workers,
+                                      ordered=ordered, tuner=tuner):
+                job = result.job
+                source, spilled_path = sources.pop(job.index)
+                if spilled_path is not None:
+                    os.remove(spilled_path)
+                output, error = None, result.error
+                if result.ok:
+                    output = result.data if output_dir is None else job.output_path
+                    if writer is not None:
+                        try:
+                            output = writer.write(job.output_path, result.data)
+                        except OSError as e:
+                            output, error = None, e
+                yield WatermarkResult(job.index, source, output, result.seconds, error)
+        finally:
+            if writer is not None:
+                writer.close()
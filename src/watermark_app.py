@@ -0,0 +1,2042 @@
+import customtkinter as ctk
+import json
+import threading
+import queue
+import time
+import os
+import sys
+from dataclasses import replace
+from tkinter import colorchooser, Menu, filedialog, messagebox, TclError
+from PIL import Image, ImageTk
+
+import encoders
+from archive_input import ARCHIVE_EXTENSIONS, IMAGE_EXTENSIONS, is_archive, iter_images, open_input
+from archive_output import ARCHIVE_FORMATS, ARCHIVE_LABELS
+from export_report import ExportReport
+from image_cache import ImageLoader
+from image_probe import ImageProber
+from render_scheduler import RenderScheduler
+from template_store import TemplateStore
+from auto_position import AUTO_POSITION, BusyMap
+from text_tokens import TokenContext
+from watermark_engine import (RESAMPLE_FILTERS, SYSTEM_FONT_DIR, RenderPlan, WatermarkLayer, WatermarkRenderer,
+                              anchor_from_rect, needs_image_analysis)
+
+# 预览质量：交互过程中使用快速的重采样滤镜（草稿，见 watermark_engine.RESAMPLE_FILTERS），
+# 停止操作后再用高质量滤镜渲染，与导出结果一致
+REFINE_IDLE_DELAY = 250  # 毫秒，停止操作多久后渲染高质量预览
+
+# 从归档中列出图片时，每批加入图片列表的数量
+ARCHIVE_LIST_BATCH = 200
+
+# 切换图片时预取的相邻图片（相对当前索引）
+PREFETCH_OFFSETS = (1, -1, 2)
+
+# Set appearance mode and default color theme
+ctk.set_appearance_mode("System")  # Modes: "System" (default), "Dark", "Light"
+ctk.set_default_color_theme("blue")  # Themes: "blue" (default), "green", "dark-blue"
+
+def get_app_path():
+    """获取应用程序的正确路径，兼容开发环境和打包环境"""
+    if getattr(sys, 'frozen', False):
+        # 如果是打包后的应用
+        if sys.platform == 'darwin':
+            # macOS .app bundle
+            return os.path.dirname(sys.executable)
+        else:
+            # Windows或Linux
+            return os.path.dirname(sys.executable)
+    else:
+        # 开发环境
+        return os.path.dirname(os.path.abspath(__file__))
+
+def setup_app_directories():
+    """设置应用程序的工作目录和资源路径"""
+    app_path = get_app_path()
+    
+    # 切换到应用程序目录
+    os.chdir(app_path)
+    
+    # 确保必要的目录存在
+    if not os.path.exists('templates'):
+        os.makedirs('templates')
+    
+    return app_path
+
+class WatermarkApp(ctk.CTk):
+    def __init__(self):
+        # 调试信息
+        print(f"App starting in directory: {os.getcwd()}")
+        print(f"Templates directory exists: {os.path.exists('templates')}")
+        
+        super().__init__()
+        self.title("图片水印应用")
+        self.geometry("1200x800")
+
+        self.image_paths = [] # 存储导入的图片路径
+        self.current_image_index = -1
+        self.original_pil_image = None # 存储原始PIL图像
+        self.display_pil_image = None # 存储用于显示的PIL图像（已缩放）
+        self.display_tk_image = None # 存储Tkinter PhotoImage对象
+        self.watermark_color = (255, 255, 255) # Default white color
+        self.watermark_font = "Arial"
+        self.watermark_font_size = 48
+        self.image_watermark_pil = None
+        self.pending_image_watermark_path = None  # 正在后台加载的水印图片路径
+        self._watermark_load_id = 0  # 用于丢弃过期的水印图片加载结果
+        self.watermark_type = ctk.StringVar(value="text")
+        self.watermark_position = "br"  # e.g., "tl", "tc", "tr", "ml", "mc", "mr", "bl", "bc", "br"
+        self.watermark_rotation = 0
+        self.output_naming_prefix = ctk.StringVar(value="wm_")
+        self.output_naming_suffix = ctk.StringVar(value="_watermark")
+        self.output_naming_rule = ctk.StringVar(value="suffix")
+        self.jpeg_quality = ctk.IntVar(value=95)
+        self.output_format = ctk.StringVar(value="original")  # original / JPEG / PNG / WEBP
+        self.encoder_preset = ctk.StringVar(value=encoders.DEFAULT_PRESET)  # fast / balanced / small
+        self.output_archive = ctk.StringVar(value="none")  # none / zip / tar
+        self.archive_volume_mb = ctk.IntVar(value=0)  # 分卷大小（MB），0 表示不分卷
+        self.config_file = "watermark_config.json"
+        self.render_scheduler = RenderScheduler(self)  # 合并高频界面事件，每帧最多渲染一次
+        self._refine_job = None  # 停止操作后渲染高质量预览的任务
+        self.display_is_draft = False  # 当前预览底图是否用快速滤镜缩放
+        
+        # --- 模板管理系统 ---
+        self.templates_dir = "templates"
+        self.current_template_name = None
+        self.template_extension = ".json"
+        
+        # --- 输出路径设置 ---
+        self.output_directory = ctk.StringVar(value="")  # 输出目录路径
+        
+        # --- 多线程组件 ---
+        self.preview_queue = queue.Queue()
+        self.thumbnail_queue = queue.Queue()
+        self.probe_queue = queue.Queue()
+        self.preview_thread_pool = []
+        self.is_closing = False
+        
+        # --- 性能优化缓存 ---
+        self.last_watermark_layer = None  # 上次预览的当前图层
+        self.base_watermark_image = None  # 基础水印图像（无位置信息）
+        self.current_processing_id = 0  # 当前处理ID，用于取消过期任务
+        self.image_prober = ImageProber()  # 只读文件头的图片探测器（带缓存）
+        self.image_loader = ImageLoader()  # 后台解码 + 按字节数限制的已解码图片缓存
+        self.watermark_renderer = WatermarkRenderer()  # 多图层水印渲染器（缓存合并后的精灵图）
+        self._token_context = None  # 当前预览图片的动态字段取值
+        self._busy_map = None  # (原图, BusyMap)：自动位置/自动对比色分析的是原图，与导出一致
+
+        # --- 多图层水印 ---
+        self.watermark_layers = []  # 已固定的图层（WatermarkLayer），当前编辑的水印作为最上层
+        
+        # --- 拖拽功能相关 ---
+        self.is_dragging = False
+        self.drag_start_x = 0
+        self.drag_start_y = 0
+        self.drag_latest = (0, 0)  # 本帧内最新的鼠标位置，渲染时一次性应用
+        self.custom_watermark_anchor = None  # 自定义位置：水印中心的归一化坐标 (u, v)，与图片尺寸无关
+        self.watermark_bounds = None  # 水印边界框，用于拖拽检测
+        
+        # 启动队列监听
+        self.start_queue_processing()
+
+        # --- 创建主菜单 ---
+        self.menu_bar = Menu(self)
+        self.config(menu=self.menu_bar)
+
+        # --- 文件菜单 ---
+        self.file_menu = Menu(self.menu_bar, tearoff=0)
+        self.file_menu.add_command(label="导入图片", command=self.import_images)
+        self.file_menu.add_command(label="导入文件夹", command=self.import_folder)
+        self.file_menu.add_separator()
+        self.file_menu.add_command(label="开始处理", command=self.process_and_export_images)
+        self.file_menu.add_command(label="分发到共享目录...", command=self.distribute_to_spool)
+        self.file_menu.add_command(label="预估导出开销（试运行）", command=self.preflight_export)
+        self.file_menu.add_separator()
+        self.file_menu.add_command(label="保存当前设置为模板", command=self.save_settings)
+        self.file_menu.add_command(label="加载模板", command=self.load_settings)
+        self.file_menu.add_separator()
+        self.file_menu.add_command(label="退出", command=self.quit_app)
+        self.menu_bar.add_cascade(label="文件", menu=self.file_menu)
+        
+        # 帮助菜单
+        self.help_menu = Menu(self.menu_bar, tearoff=0)
+        self.help_menu.add_command(label="关于")
+        self.menu_bar.add_cascade(label="帮助", menu=self.help_menu)
+
+        # --- 设置主网格布局 ---
+        self.grid_columnconfigure(1, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        # --- 左侧边栏 (图片列表) ---
+        self.sidebar_frame = ctk.CTkFrame(self, width=250, corner_radius=0)
+        self.sidebar_frame.grid(row=0, column=0, rowspan=2, sticky="nsw")
+        self.sidebar_frame.grid_rowconfigure(2, weight=1)
+        
+        self.sidebar_title = ctk.CTkLabel(self.sidebar_frame, text="图片列表", font=ctk.CTkFont(size=20, weight="bold"))
+        self.sidebar_title.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        # 添加导入按钮
+        self.import_buttons_frame = ctk.CTkFrame(self.sidebar_frame)
+        self.import_buttons_frame.grid(row=1, column=0, padx=10, pady=(0, 10), sticky="ew")
+        
+        self.import_images_btn = ctk.CTkButton(self.import_buttons_frame, text="导入图片", command=self.import_images)
+        self.import_images_btn.pack(side="left", padx=(0, 5), expand=True, fill="x")
+        
+        self.import_folder_btn = ctk.CTkButton(self.import_buttons_frame, text="导入文件夹", command=self.import_folder)
+        self.import_folder_btn.pack(side="left", padx=(5, 0), expand=True, fill="x")
+
+        self.image_list_frame = ctk.CTkScrollableFrame(self.sidebar_frame, label_text="")
+        self.image_list_frame.grid(row=2, column=0, padx=10, pady=10, sticky="nsew")
+
+        # --- 主内容区 (图片预览) ---
+        self.main_frame = ctk.CTkFrame(self, corner_radius=0)
+        self.main_frame.grid(row=0, column=1, sticky="nsew")
+        self.main_frame.grid_columnconfigure(0, weight=1)
+        self.main_frame.grid_rowconfigure(0, weight=1)
+
+        self.preview_canvas = ctk.CTkCanvas(self.main_frame, bg="gray20", highlightthickness=0)
+        self.preview_canvas.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
+        self.preview_canvas.bind("<Configure>", self.on_canvas_resize)
+        
+        # 添加鼠标事件绑定用于拖拽水印
+        self.preview_canvas.bind("<Button-1>", self.on_canvas_click)
+        self.preview_canvas.bind("<B1-Motion>", self.on_canvas_drag)
+        self.preview_canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+
+
+        # --- 右侧控制面板 (水印设置) ---
+        self.control_frame = ctk.CTkScrollableFrame(self, width=300, label_text="水印设置")
+        self.control_frame.grid(row=0, column=2, rowspan=2, sticky="nse")
+
+        # --- 水印类型选择 ---
+        self.watermark_type_frame = ctk.CTkFrame(self.control_frame)
+        self.watermark_type_frame.pack(pady=10, padx=10, fill="x")
+        self.watermark_type_label = ctk.CTkLabel(self.watermark_type_frame, text="类型:")
+        self.watermark_type_label.pack(side="left", padx=5)
+        self.text_radio = ctk.CTkRadioButton(self.watermark_type_frame, text="文本", variable=self.watermark_type, value="text", command=self.on_watermark_type_changed)
+        self.text_radio.pack(side="left", padx=5)
+        self.image_radio = ctk.CTkRadioButton(self.watermark_type_frame, text="图片", variable=self.watermark_type, value="image", command=self.on_watermark_type_changed)
+        self.image_radio.pack(side="left", padx=5)
+        
+        # --- 水印图层 ---
+        self.layers_frame = ctk.CTkFrame(self.control_frame)
+        self.layers_frame.pack(pady=10, padx=10, fill="x")
+        self.layers_label = ctk.CTkLabel(self.layers_frame, text="水印图层", font=ctk.CTkFont(weight="bold"))
+        self.layers_label.pack(pady=5)
+        self.layers_hint_label = ctk.CTkLabel(self.layers_frame, text="当前编辑的水印位于最上层",
+                                              font=ctk.CTkFont(size=11), text_color="gray")
+        self.layers_hint_label.pack(pady=(0, 5))
+        self.layer_list_frame = ctk.CTkFrame(self.layers_frame, fg_color="transparent")
+        self.layer_list_frame.pack(fill="x", padx=5)
+        layer_buttons_frame = ctk.CTkFrame(self.layers_frame)
+        layer_buttons_frame.pack(fill="x", pady=5)
+        self.add_layer_btn = ctk.CTkButton(layer_buttons_frame, text="固定为图层", command=self.add_current_as_layer, width=80)
+        self.add_layer_btn.pack(side="left", padx=2, expand=True, fill="x")
+        self.clear_layers_btn = ctk.CTkButton(layer_buttons_frame, text="清空图层", command=self.clear_layers, width=80)
+        self.clear_layers_btn.pack(side="left", padx=2, expand=True, fill="x")
+
+        # --- 控制面板内的选项 ---
+        # 文本水印
+        self.text_watermark_frame = ctk.CTkFrame(self.control_frame)
+        self.text_watermark_frame.pack(pady=10, padx=10, fill="x")
+        
+        self.text_label = ctk.CTkLabel(self.text_watermark_frame, text="文本水印", font=ctk.CTkFont(weight="bold"))
+        self.text_label.pack(pady=5, padx=10, anchor="w")
+        
+        self.text_entry = ctk.CTkEntry(self.text_watermark_frame, placeholder_text="输入水印文字")
+        self.text_entry.pack(pady=5, padx=10, fill="x")
+        self.text_entry.bind("<KeyRelease>", self.debounced_update_preview)
+
+        # --- 字体和颜色 ---
+        self.font_color_frame = ctk.CTkFrame(self.text_watermark_frame)
+        self.font_color_frame.pack(pady=5, padx=10, fill="x", expand=True)
+
+        # Font selection
+        self.font_label = ctk.CTkLabel(self.font_color_frame, text="字体:")
+        self.font_label.pack(side="left", padx=(0, 5))
+        # A basic list of fonts that are likely to be available.
+        # A more robust solution would be to query the system for available fonts.
+        font_options = ["Arial", "Times New Roman", "Courier New", "Helvetica", "Verdana"]
+        self.font_menu = ctk.CTkOptionMenu(self.font_color_frame, values=font_options, command=self.set_font)
+        self.font_menu.pack(side="left", padx=5, expand=True, fill="x")
+        self.font_menu.set("Arial")
+
+        self.color_button = ctk.CTkButton(self.font_color_frame, text="颜色", command=self.choose_color, width=60)
+        self.color_button.pack(side="left", padx=5)
+
+        # --- Font Size ---
+        self.font_size_frame = ctk.CTkFrame(self.text_watermark_frame)
+        self.font_size_frame.pack(pady=5, padx=10, fill="x")
+        self.font_size_label = ctk.CTkLabel(self.font_size_frame, text="字号:")
+        self.font_size_label.pack(side="left", padx=(0, 5))
+        self.font_size_entry = ctk.CTkEntry(self.font_size_frame, width=60)
+        self.font_size_entry.insert(0, str(self.watermark_font_size))
+        self.font_size_entry.pack(side="left", padx=5)
+        self.font_size_entry.bind("<KeyRelease>", self.set_font_size)
+
+        # --- 透明度 ---
+        self.opacity_frame = ctk.CTkFrame(self.text_watermark_frame)
+        self.opacity_frame.pack(pady=5, padx=10, fill="x")
+        self.opacity_label = ctk.CTkLabel(self.opacity_frame, text="透明度:", width=60)
+        self.opacity_label.pack(side="left")
+        self.opacity_slider = ctk.CTkSlider(self.opacity_frame, from_=0, to=1, number_of_steps=100, command=self.debounced_update_preview)
+        self.opacity_slider.set(0.5)
+        self.opacity_slider.pack(side="left", fill="x", expand=True)
+
+        # 自动对比色：按水印所在区域的亮度使用黑色或白色文字
+        self.auto_text_color = ctk.BooleanVar(value=False)
+        self.auto_text_color_checkbox = ctk.CTkCheckBox(self.text_watermark_frame, text="自动选择对比色（黑/白）",
+                                                        variable=self.auto_text_color, command=self.debounced_update_preview)
+        self.auto_text_color_checkbox.pack(pady=5, padx=10, anchor="w")
+
+        # 图片水印
+        self.image_watermark_frame = ctk.CTkFrame(self.control_frame)
+        self.image_watermark_frame.pack(pady=10, padx=10, fill="x")
+        self.image_label = ctk.CTkLabel(self.image_watermark_frame, text="图片水印", font=ctk.CTkFont(weight="bold"))
+        self.image_label.pack(pady=5)
+        self.image_button = ctk.CTkButton(self.image_watermark_frame, text="选择水印图片", command=self.select_image_watermark)
+        self.image_button.pack(pady=5, padx=10, fill="x")
+
+        # --- 图片透明度 ---
+        self.image_opacity_label = ctk.CTkLabel(self.image_watermark_frame, text="透明度:")
+        self.image_opacity_label.pack(pady=(10, 0), padx=10, anchor="w")
+        self.image_opacity_slider = ctk.CTkSlider(self.image_watermark_frame, from_=0, to=1, number_of_steps=100, command=self.debounced_update_preview)
+        self.image_opacity_slider.set(0.5)
+        self.image_opacity_slider.pack(pady=(0, 10), padx=10, fill="x")
+        
+        # --- 图片大小 ---
+        self.image_scale_label = ctk.CTkLabel(self.image_watermark_frame, text="大小:")
+        self.image_scale_label.pack(pady=(0, 0), padx=10, anchor="w")
+        self.image_scale_slider = ctk.CTkSlider(self.image_watermark_frame, from_=0.1, to=2.0, number_of_steps=190, command=self.debounced_update_preview)
+        self.image_scale_slider.set(1.0)
+        self.image_scale_slider.pack(pady=(0, 10), padx=10, fill="x")
+
+        # --- Position & Rotation ---
+        self.pos_rot_frame = ctk.CTkFrame(self.control_frame)
+        self.pos_rot_frame.pack(pady=10, padx=10, fill="x")
+
+        # Position
+        self.pos_label = ctk.CTkLabel(self.pos_rot_frame, text="预设位置", font=ctk.CTkFont(weight="bold"))
+        self.pos_label.pack(pady=5)
+        
+        # 添加拖拽提示
+        self.drag_hint_label = ctk.CTkLabel(self.pos_rot_frame, text="💡 提示：在预览窗口中可直接拖拽水印调整位置", 
+                                          font=ctk.CTkFont(size=11), text_color="gray")
+        self.drag_hint_label.pack(pady=(0, 5))
+
+        grid_frame = ctk.CTkFrame(self.pos_rot_frame)
+        grid_frame.pack()
+
+        positions = [
+            ("tl", "↖"), ("tc", "↑"), ("tr", "↗"),
+            ("ml", "←"), ("mc", "·"), ("mr", "→"),
+            ("bl", "↙"), ("bc", "↓"), ("br", "↘")
+        ]
+        for i, (pos_code, pos_text) in enumerate(positions):
+            row, col = divmod(i, 3)
+            btn = ctk.CTkButton(grid_frame, text=pos_text, width=40, command=lambda p=pos_code: self.set_position(p))
+            btn.grid(row=row, column=col, padx=2, pady=2)
+        # 自动：按图片内容选择最空旷的预设位置（每张图片单独选择）
+        auto_btn = ctk.CTkButton(grid_frame, text="自动", width=40, command=lambda: self.set_position(AUTO_POSITION))
+        auto_btn.grid(row=3, column=0, columnspan=3, padx=2, pady=2, sticky="ew")
+
+        # Rotation
+        self.rot_label = ctk.CTkLabel(self.pos_rot_frame, text="旋转", font=ctk.CTkFont(weight="bold"))
+        self.rot_label.pack(pady=(10, 5))
+        self.rotation_slider = ctk.CTkSlider(self.pos_rot_frame, from_=0, to=360, number_of_steps=360, command=self.set_rotation)
+        self.rotation_slider.set(0)
+        self.rotation_slider.pack(pady=5, padx=10, fill="x")
+
+        # Relative size (水印宽度按图片短边的百分比计算，适应不同分辨率的图片)
+        self.relative_size_enabled = ctk.BooleanVar(value=False)
+        self.relative_size_checkbox = ctk.CTkCheckBox(self.pos_rot_frame, text="按图片短边比例设置大小",
+                                                      variable=self.relative_size_enabled, command=self.on_size_mode_changed)
+        self.relative_size_checkbox.pack(pady=(10, 5), padx=10, anchor="w")
+        relative_size_frame = ctk.CTkFrame(self.pos_rot_frame)
+        relative_size_frame.pack(fill="x", padx=10, pady=(0, 5))
+        self.relative_size_value = ctk.IntVar(value=20)
+        self.relative_size_slider = ctk.CTkSlider(relative_size_frame, from_=1, to=100, number_of_steps=99,
+                                                  variable=self.relative_size_value, command=self.debounced_update_preview)
+        self.relative_size_slider.pack(side="left", fill="x", expand=True, padx=5)
+        ctk.CTkLabel(relative_size_frame, textvariable=self.relative_size_value, width=30).pack(side="left")
+        ctk.CTkLabel(relative_size_frame, text="%").pack(side="left", padx=(0, 5))
+
+        # --- Export Settings ---
+        self.export_frame = ctk.CTkFrame(self.control_frame)
+        self.export_frame.pack(pady=10, padx=10, fill="x")
+        self.export_label = ctk.CTkLabel(self.export_frame, text="导出设置", font=ctk.CTkFont(weight="bold"))
+        self.export_label.pack(pady=5)
+
+        # Naming rule
+        naming_frame = ctk.CTkFrame(self.export_frame)
+        naming_frame.pack(fill="x", pady=2)
+        ctk.CTkRadioButton(naming_frame, text="前缀:", variable=self.output_naming_rule, value="prefix").pack(side="left", padx=5)
+        ctk.CTkEntry(naming_frame, textvariable=self.output_naming_prefix).pack(side="left", fill="x", expand=True)
+        
+        naming_frame2 = ctk.CTkFrame(self.export_frame)
+        naming_frame2.pack(fill="x", pady=2)
+        ctk.CTkRadioButton(naming_frame2, text="后缀:", variable=self.output_naming_rule, value="suffix").pack(side="left", padx=5)
+        ctk.CTkEntry(naming_frame2, textvariable=self.output_naming_suffix).pack(side="left", fill="x", expand=True)
+
+        ctk.CTkRadioButton(self.export_frame, text="保留原名", variable=self.output_naming_rule, value="original").pack(anchor="w", padx=15)
+
+        # Output Directory
+        output_dir_frame = ctk.CTkFrame(self.export_frame)
+        output_dir_frame.pack(fill="x", pady=5)
+        ctk.CTkLabel(output_dir_frame, text="输出路径:").pack(side="left", padx=5)
+        
+        # 显示当前路径的标签（可点击更改）
+        self.output_path_label = ctk.CTkLabel(output_dir_frame, text="点击选择输出文件夹", 
+                                            fg_color="gray25", corner_radius=6, cursor="hand2")
+        self.output_path_label.pack(side="left", fill="x", expand=True, padx=5)
+        self.output_path_label.bind("<Button-1>", lambda e: self.choose_output_directory())
+        
+        # 更改路径按钮
+        self.change_output_btn = ctk.CTkButton(output_dir_frame, text="浏览", width=60, 
+                                             command=self.choose_output_directory)
+        self.change_output_btn.pack(side="right", padx=5)
+
+        # Output format & encoder preset
+        format_frame = ctk.CTkFrame(self.export_frame)
+        format_frame.pack(fill="x", pady=5)
+        ctk.CTkLabel(format_frame, text="输出格式:").pack(side="left", padx=5)
+        self.output_format_menu = ctk.CTkOptionMenu(format_frame, values=list(encoders.OUTPUT_FORMAT_LABELS.values()),
+                                                    command=self.set_output_format, width=90)
+        self.output_format_menu.pack(side="left", padx=5)
+        self.encoder_preset_menu = ctk.CTkOptionMenu(format_frame, values=list(encoders.ENCODER_PRESET_LABELS.values()),
+                                                     command=self.set_encoder_preset, width=90)
+        self.encoder_preset_menu.pack(side="left", padx=5, fill="x", expand=True)
+
+        # 导出为文件夹中的单独文件，或直接写入ZIP/TAR归档（可分卷）
+        archive_frame = ctk.CTkFrame(self.export_frame)
+        archive_frame.pack(fill="x", pady=5)
+        ctk.CTkLabel(archive_frame, text="打包:").pack(side="left", padx=5)
+        self.output_archive_menu = ctk.CTkOptionMenu(archive_frame, values=list(ARCHIVE_LABELS.values()),
+                                                     command=self.set_output_archive, width=90)
+        self.output_archive_menu.pack(side="left", padx=5)
+        ctk.CTkLabel(archive_frame, text="分卷(MB):").pack(side="left", padx=5)
+        ctk.CTkEntry(archive_frame, textvariable=self.archive_volume_mb, width=60).pack(side="left", padx=5)
+        self.update_output_format_display()
+
+        # JPEG / WebP Quality
+        quality_frame = ctk.CTkFrame(self.export_frame)
+        quality_frame.pack(fill="x", pady=5)
+        ctk.CTkLabel(quality_frame, text="质量:").pack(side="left", padx=5)
+        ctk.CTkSlider(quality_frame, from_=1, to=100, variable=self.jpeg_quality).pack(side="left", fill="x", expand=True, padx=5)
+        ctk.CTkLabel(quality_frame, textvariable=self.jpeg_quality, width=30).pack(side="left")
+
+        # --- Template Management ---
+        self.template_frame = ctk.CTkFrame(self.control_frame)
+        self.template_frame.pack(pady=10, padx=10, fill="x")
+        self.template_label = ctk.CTkLabel(self.template_frame, text="水印模板", font=ctk.CTkFont(weight="bold"))
+        self.template_label.pack(pady=5)
+
+        # Template search (前缀搜索)
+        self.template_search_entry = ctk.CTkEntry(self.template_frame, placeholder_text="搜索模板名称")
+        self.template_search_entry.pack(fill="x", padx=5, pady=(0, 5))
+        self.template_search_entry.bind("<KeyRelease>", self.on_template_search)
+
+        # Template selection
+        template_select_frame = ctk.CTkFrame(self.template_frame)
+        template_select_frame.pack(fill="x", pady=5)
+        ctk.CTkLabel(template_select_frame, text="选择模板:").pack(side="left", padx=5)
+        self.template_combobox = ctk.CTkComboBox(template_select_frame, values=["<无模板>"], 
+                                               command=self.load_template_by_name, state="readonly")
+        self.template_combobox.pack(side="left", fill="x", expand=True, padx=5)
+        self.template_combobox.set("<无模板>")
+
+        # Template management buttons
+        template_buttons_frame = ctk.CTkFrame(self.template_frame)
+        template_buttons_frame.pack(fill="x", pady=5)
+        
+        self.save_template_btn = ctk.CTkButton(template_buttons_frame, text="保存模板", 
+                                             command=self.save_new_template, width=80)
+        self.save_template_btn.pack(side="left", padx=2, expand=True, fill="x")
+        
+        self.rename_template_btn = ctk.CTkButton(template_buttons_frame, text="重命名", 
+                                               command=self.rename_template, width=80)
+        self.rename_template_btn.pack(side="left", padx=2, expand=True, fill="x")
+        
+        self.delete_template_btn = ctk.CTkButton(template_buttons_frame, text="删除", 
+                                               command=self.delete_template, width=80)
+        self.delete_template_btn.pack(side="left", padx=2, expand=True, fill="x")
+
+        # Auto-load settings
+        auto_load_frame = ctk.CTkFrame(self.template_frame)
+        auto_load_frame.pack(fill="x", pady=5)
+        self.auto_load_last = ctk.BooleanVar(value=True)
+        self.auto_load_checkbox = ctk.CTkCheckBox(auto_load_frame, text="启动时自动加载上次设置", 
+                                                variable=self.auto_load_last)
+        self.auto_load_checkbox.pack(side="left", padx=5)
+
+        # Export Button
+        self.export_button = ctk.CTkButton(self.control_frame, text="开始处理并导出", command=self.process_and_export_images)
+        self.export_button.pack(pady=20, padx=10, fill="x")
+
+        self.init_template_system() # Initialize template system (只读取索引，目录刷新在后台进行)
+        self.on_watermark_type_changed() # Initialize UI visibility based on default type
+        self.protocol("WM_DELETE_WINDOW", self.quit_app) # Save settings on close
+
+        # 先显示主窗口，配置、模板和字体在首帧绘制之后再加载
+        self.startup_complete = False
+        self.first_paint_time = None
+        self.after_idle(lambda: self.after(0, self.deferred_startup))
+
+    def deferred_startup(self):
+        """首帧绘制后执行的启动任务"""
+        if self.is_closing:
+            return
+        self.first_paint_time = time.time()
+        self.load_settings(show_message=False) # Auto-load settings on startup
+        self.load_last_settings_or_default_template() # Auto-load last template if enabled
+        self.async_refresh_template_list()
+        self.async_enumerate_fonts()
+        self.startup_complete = True
+
+    def async_enumerate_fonts(self):
+        """在后台线程枚举系统字体，完成后更新字体菜单"""
+        def worker():
+            try:
+                fonts = [name[:-4] for name in os.listdir(SYSTEM_FONT_DIR) if name.lower().endswith(".ttf")]
+            except OSError:
+                fonts = []
+            self.preview_queue.put((self.on_fonts_enumerated, fonts))
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def on_fonts_enumerated(self, fonts):
+        """字体枚举完成的回调"""
+        if not fonts:
+            return
+        current_values = list(self.font_menu.cget("values"))
+        font_options = current_values + sorted(set(fonts) - set(current_values), key=str.lower)
+        self.font_menu.configure(values=font_options)
+        self.font_menu.set(self.watermark_font)
+
+    def start_queue_processing(self):
+        """启动队列处理，定期检查后台任务完成情况"""
+        self.process_queues()
+        
+    def start_ui_refresh_timer(self):
+        """启动UI刷新定时器，确保事件循环始终活跃"""
+        pass  # 简化：移除复杂的UI刷新逻辑
+        
+    def process_queues(self):
+        """处理队列中的完成任务"""
+        try:
+            # 处理预览队列
+            while not self.preview_queue.empty():
+                try:
+                    callback, result = self.preview_queue.get_nowait()
+                    callback(result)
+                except queue.Empty:
+                    break
+                    
+            # 处理缩略图队列
+            while not self.thumbnail_queue.empty():
+                try:
+                    callback, result = self.thumbnail_queue.get_nowait()
+                    callback(result)
+                except queue.Empty:
+                    break
+
+            # 处理图片探测队列
+            while not self.probe_queue.empty():
+                try:
+                    callback, result = self.probe_queue.get_nowait()
+                    callback(result)
+                except queue.Empty:
+                    break
+                    
+        except Exception as e:
+            print(f"Queue processing error: {e}")
+            
+        # 如果应用没有关闭，继续处理队列
+        if not self.is_closing:
+            self.after(50, self.process_queues)
+
+    def async_generate_thumbnail(self, image_path, callback):
+        """在后台线程生成缩略图"""
+        def worker():
+            try:
+                with open_input(image_path) as source:
+                    img = Image.open(source)
+                    img.thumbnail((50, 50))
+                # 使用CTkImage以支持高DPI显示
+                thumb = ctk.CTkImage(light_image=img, size=(50, 50))
+                self.thumbnail_queue.put((callback, (thumb, image_path)))
+            except Exception as e:
+                print(f"Thumbnail generation error: {e}")
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def async_probe_image(self, image_path, callback):
+        """在探测线程池中读取图片头信息，结果回到主线程处理"""
+        self.image_prober.submit(image_path, lambda info: self.probe_queue.put((callback, info)))
+
+    def preview_busy_map(self):
+        """当前原图的内容分析（切换图片后重建）；没有图片时返回None"""
+        image = self.original_pil_image
+        if image is None:
+            return None
+        cached = self._busy_map
+        if cached is None or cached[0] is not image:
+            cached = (image, BusyMap(image))
+            self._busy_map = cached
+        return cached[1]
+
+    def preview_scale(self):
+        """预览图相对原图的缩放比例"""
+        preview_w, preview_h = self.display_pil_image.size
+        original_w, original_h = self.original_pil_image.size
+        return min(preview_w / original_w, preview_h / original_h)
+
+    def place_preview_watermark(self, layer, image_size, scale, quality="final"):
+        """当前编辑的图层在预览图上的 (精灵图, (x, y))；图层为空或无法渲染时返回None
+
+        动态字段和相对大小按原图计算，再按预览比例缩放；渲染、自动位置和自动配色与导出走同一个引擎。
+        layer 须在主线程中取得（get_current_layer 读取界面控件），本方法可以在预览线程中调用。
+        """
+        renderer = self.watermark_renderer
+        try:
+            layer = renderer.preview_layer(layer, self.original_pil_image.size, scale, self.preview_token_context())
+            if layer.is_empty():
+                return None
+            busy_map = self.preview_busy_map() if needs_image_analysis((layer,)) else None
+            return renderer.place_layer(layer, image_size, busy_map=busy_map, quality=quality)
+        except Exception as e:
+            print(f"Failed to render watermark preview: {e}")
+            return None
+
+    def draw_preview_watermark(self, image, layer, scale, quality="final", position=None):
+        """把当前编辑的图层合成到预览图上，并记录水印边界（用于拖拽检测）
+
+        position 为拖拽过程中的预览坐标，不指定时按图层的位置设置计算。
+        """
+        placed = self.place_preview_watermark(layer, image.size, scale, quality)
+        if placed is None:
+            self.watermark_bounds = None
+            return image
+        sprite, (x, y) = placed
+        if position is not None:
+            x, y = int(position[0]), int(position[1])
+        self.watermark_bounds = (x, y, sprite.width, sprite.height)
+        return RenderPlan(image.size, [(sprite, (x, y))]).apply(image)
+
+    def clear_watermark_cache(self):
+        """清理预览状态（精灵图缓存按内容取键，参数变化后旧条目不会被误用，由LRU自行淘汰）"""
+        self.base_watermark_image = None
+        self.last_watermark_layer = None
+        self.watermark_bounds = None
+
+    def choose_color(self):
+        """优化的颜色选择，减少UI阻塞"""
+        color_code = colorchooser.askcolor(title="选择水印颜色")
+        # If the user selects a color, color_code will be a tuple like ((r, g, b), '#rrggbb')
+        # If the user cancels, it will be (None, None).
+        if color_code and color_code[0]:
+            self.watermark_color = tuple(int(c) for c in color_code[0])
+            self.color_button.configure(fg_color=color_code[1])
+            # 延迟清理缓存，避免立即重新生成
+            self.after_idle(self.clear_watermark_cache)
+            self.debounced_update_preview()
+    
+    def choose_output_directory(self):
+        """选择输出目录"""
+        # 如果已经有设置的目录，从该目录开始选择
+        initial_dir = self.output_directory.get() if self.output_directory.get() else os.path.expanduser("~/Desktop")
+        
+        selected_dir = filedialog.askdirectory(
+            title="选择输出文件夹",
+            initialdir=initial_dir
+        )
+        
+        if selected_dir:
+            self.output_directory.set(selected_dir)
+            self.update_output_path_display()
+    
+    def set_output_format(self, label):
+        """根据下拉菜单的显示名称设置输出格式"""
+        for code, name in encoders.OUTPUT_FORMAT_LABELS.items():
+            if name == label:
+                self.output_format.set(code)
+                return
+
+    def set_encoder_preset(self, label):
+        """根据下拉菜单的显示名称设置编码预设"""
+        for code, name in encoders.ENCODER_PRESET_LABELS.items():
+            if name == label:
+                self.encoder_preset.set(code)
+                return
+
+    def set_output_archive(self, label):
+        """根据下拉菜单的显示名称设置打包方式"""
+        for code, name in ARCHIVE_LABELS.items():
+            if name == label:
+                self.output_archive.set(code)
+                return
+
+    def update_output_format_display(self):
+        """同步输出格式、编码预设和打包方式下拉菜单的显示"""
+        self.output_format_menu.set(encoders.OUTPUT_FORMAT_LABELS.get(self.output_format.get(), "原格式"))
+        self.encoder_preset_menu.set(encoders.ENCODER_PRESET_LABELS.get(self.encoder_preset.get(), "均衡"))
+        self.output_archive_menu.set(ARCHIVE_LABELS.get(self.output_archive.get(), "文件夹"))
+
+    def update_output_path_display(self):
+        """更新输出路径显示"""
+        path = self.output_directory.get()
+        if path:
+            # 显示路径，如果太长则显示省略版本
+            display_path = path
+            if len(display_path) > 40:
+                # 显示开头和结尾部分
+                display_path = f"...{display_path[-37:]}"
+            self.output_path_label.configure(text=display_path, text_color="white")
+        else:
+            self.output_path_label.configure(text="点击选择输出文件夹", text_color="gray60")
+
+    def import_images_with_refresh(self):
+        """简化的图片导入，依赖响应性回调包装器"""
+        self.import_images()
+
+    def import_folder_with_refresh(self):
+        """简化的文件夹导入，依赖响应性回调包装器"""
+        self.import_folder()
+
+    def import_images(self):
+        print("Importing images...")
+        file_types = [
+            ("Image files", "*.jpg *.jpeg *.png *.bmp *.tiff *.tif *.gif *.zip *.tar"),
+            ("Archives", "*.zip *.tar"),
+            ("All files", "*.*")
+        ]
+        files = filedialog.askopenfilenames(title="选择图片", filetypes=file_types)
+        if files:
+            # Use self.after to schedule the update, which is more robust on macOS
+            # to prevent UI freezes after the dialog closes.
+            self.after(100, lambda: self.add_images(list(files)))
+
+    def import_folder(self):
+        folder = filedialog.askdirectory(title="选择文件夹")
+        if folder:
+            image_files = []
+            # 文件夹中的ZIP/TAR归档也一并导入（其中的图片在后台逐批列出）
+            supported_exts = IMAGE_EXTENSIONS + ARCHIVE_EXTENSIONS
+            for f in os.listdir(folder):
+                if os.path.splitext(f)[1].lower() in supported_exts:
+                    image_files.append(os.path.join(folder, f))
+            # Use self.after for the same reason as above
+            self.after(100, lambda: self.add_images(image_files))
+
+    def add_images(self, paths):
+        for path in paths:
+            if is_archive(path):
+                self.import_archive_async(path)
+            elif path not in self.image_paths:
+                self.image_paths.append(path)
+        self.update_image_list()
+        if self.current_image_index == -1 and self.image_paths:
+            self.select_image(0)
+
+    def import_archive_async(self, archive):
+        """在后台线程逐批列出归档中的图片并加入列表；只读取归档目录/成员头，不解压"""
+        def worker():
+            batch = []
+            try:
+                for path in iter_images(archive):
+                    batch.append(path)
+                    if len(batch) >= ARCHIVE_LIST_BATCH:
+                        self.preview_queue.put((self.append_images, batch))
+                        batch = []
+            except Exception as e:
+                print(f"Error reading archive {archive}: {e}")
+                self.preview_queue.put((lambda message: messagebox.showerror("错误", message),
+                                        f"无法读取归档：{os.path.basename(archive)}\n{e}"))
+            if batch:
+                self.preview_queue.put((self.append_images, batch))
+        threading.Thread(target=worker, daemon=True).start()
+
+    def append_images(self, paths):
+        """把图片追加到列表末尾，只为新增的图片创建列表项"""
+        existing = set(self.image_paths)
+        for path in paths:
+            if path not in existing:
+                existing.add(path)
+                self.image_paths.append(path)
+                self.create_image_list_item(len(self.image_paths) - 1, path)
+        if self.current_image_index == -1 and self.image_paths:
+            self.select_image(0)
+
+    def update_image_list(self):
+        """异步更新图片列表和缩略图"""
+        # 清空现有列表
+        for widget in self.image_list_frame.winfo_children():
+            widget.destroy()
+
+        # 为每个图片创建占位框架并异步生成缩略图
+        for i, path in enumerate(self.image_paths):
+            self.create_image_list_item(i, path)
+
+    def create_image_list_item(self, index, path):
+        """创建图片列表项，包含异步缩略图"""
+        item_frame = ctk.CTkFrame(self.image_list_frame)
+        item_frame.pack(fill="x", pady=2)
+
+        # 创建占位缩略图标签
+        thumb_label = ctk.CTkLabel(item_frame, text="载入中...", width=50, height=50)
+        thumb_label.pack(side="left", padx=5)
+
+        filename = os.path.basename(path)
+        name_label = ctk.CTkLabel(item_frame, text=filename, anchor="w")
+        name_label.pack(side="left", fill="x", expand=True)
+
+        # 绑定点击事件
+        item_frame.bind("<Button-1>", lambda e, i=index: self.select_image(i))
+        thumb_label.bind("<Button-1>", lambda e, i=index: self.select_image(i))
+        name_label.bind("<Button-1>", lambda e, i=index: self.select_image(i))
+
+        # 异步探测图片头信息（尺寸、格式），先于缩略图显示
+        self.async_probe_image(path, lambda info: self.on_probe_ready(info, name_label))
+
+        # 异步生成缩略图
+        self.async_generate_thumbnail(path, lambda result: self.on_thumbnail_ready(result, thumb_label))
+
+    def on_probe_ready(self, info, name_label):
+        """图片探测完成的回调，在文件名下显示尺寸和格式"""
+        try:
+            filename = os.path.basename(info.path)
+            name_label.configure(text=f"{filename}\n{info.describe()}", justify="left")
+            if not info.ok:
+                name_label.configure(text_color="tomato")
+        except Exception as e:
+            print(f"Error updating image info: {e}")
+
+    def on_thumbnail_ready(self, result, thumb_label):
+        """缩略图生成完成的回调"""
+        if result is None:
+            thumb_label.configure(text="错误")
+            return
+            
+        thumb, path = result
+        try:
+            # 使用CTkImage时直接设置image参数
+            thumb_label.configure(image=thumb, text="")
+        except Exception as e:
+            print(f"Error updating thumbnail: {e}")
+            thumb_label.configure(text="错误")
+
+    def on_canvas_resize(self, event=None):
+        # 调整窗口大小期间用快速滤镜缩放，停止后再用LANCZOS重新缩放
+        self.render_scheduler.schedule("resize", lambda: self.display_current_image(rescale=True, quality="draft"))
+        self.schedule_preview_refine()
+    
+    def on_canvas_click(self, event):
+        """处理Canvas点击事件，开始拖拽检测"""
+        if not self.original_pil_image or not self.display_pil_image:
+            return
+            
+        # 获取点击位置（Canvas坐标）
+        click_x, click_y = event.x, event.y
+        
+        # 检查是否点击在水印区域内
+        if self.is_click_on_watermark(click_x, click_y):
+            self.is_dragging = True
+            self.drag_start_x = click_x
+            self.drag_start_y = click_y
+            self.preview_canvas.config(cursor="hand2")  # 改变鼠标样式
+            
+    def on_canvas_drag(self, event):
+        """处理Canvas拖拽事件：只记录最新的鼠标位置，每帧最多渲染一次"""
+        if not self.is_dragging:
+            return
+        self.drag_latest = (event.x, event.y)
+        self.render_scheduler.schedule("drag", self.render_drag)
+
+    def render_drag(self):
+        """按本帧内累计的拖拽偏移量更新水印位置并渲染"""
+        if not self.is_dragging:
+            return
+        latest_x, latest_y = self.drag_latest
+
+        # 计算拖拽偏移量
+        delta_x = latest_x - self.drag_start_x
+        delta_y = latest_y - self.drag_start_y
+        
+        # 将Canvas坐标转换为图片坐标并更新水印位置
+        self.update_watermark_position_from_drag(delta_x, delta_y)
+        
+        # 更新拖拽起始点
+        self.drag_start_x = latest_x
+        self.drag_start_y = latest_y
+        
+    def on_canvas_release(self, event):
+        """处理Canvas鼠标释放事件，结束拖拽"""
+        if self.is_dragging:
+            # 先应用尚未渲染的最后一段拖拽
+            self.render_scheduler.flush("drag")
+            self.is_dragging = False
+            self.preview_canvas.config(cursor="")  # 恢复鼠标样式
+            
+            # 将预览坐标转换为归一化锚点并保存（与图片尺寸无关，可用于任意尺寸的图片）
+            if hasattr(self, 'preview_watermark_position') and self.preview_watermark_position:
+                preview_x, preview_y = self.preview_watermark_position
+                
+                if self.display_pil_image:
+                    if self.watermark_bounds:
+                        wm_w, wm_h = self.watermark_bounds[2], self.watermark_bounds[3]
+                    else:
+                        placed = self.place_preview_watermark(self.get_current_layer(), self.display_pil_image.size,
+                                                              self.preview_scale())
+                        wm_w, wm_h = placed[0].size if placed else (0, 0)
+                    self.custom_watermark_anchor = anchor_from_rect(
+                        self.display_pil_image.size, (preview_x, preview_y, wm_w, wm_h))
+                
+                # 清除临时预览位置
+                delattr(self, 'preview_watermark_position')
+            
+            # 触发最终的预览更新
+            self.debounced_update_preview()
+            
+    def is_click_on_watermark(self, canvas_x, canvas_y):
+        """检查点击位置是否在水印区域内"""
+        if not self.display_pil_image or not self.watermark_bounds:
+            return False
+            
+        # 获取Canvas和图片的尺寸信息
+        canvas_w = self.preview_canvas.winfo_width()
+        canvas_h = self.preview_canvas.winfo_height()
+        img_w, img_h = self.display_pil_image.size
+        
+        # 计算图片在Canvas中的位置（居中显示）
+        img_canvas_x = (canvas_w - img_w) // 2
+        img_canvas_y = (canvas_h - img_h) // 2
+        
+        # 将Canvas坐标转换为图片坐标
+        img_x = canvas_x - img_canvas_x
+        img_y = canvas_y - img_canvas_y
+        
+        # 检查是否在图片范围内
+        if img_x < 0 or img_x >= img_w or img_y < 0 or img_y >= img_h:
+            return False
+            
+        # 检查是否在水印边界内
+        wm_x, wm_y, wm_w, wm_h = self.watermark_bounds
+        return (wm_x <= img_x <= wm_x + wm_w and wm_y <= img_y <= wm_y + wm_h)
+        
+    def update_watermark_position_from_drag(self, delta_x, delta_y):
+        """根据拖拽偏移量更新水印位置，在预览坐标系统中工作"""
+        if not self.display_pil_image or not self.original_pil_image:
+            return
+
+        # 在拖拽过程中，我们在预览坐标系统中工作
+        placed = self.place_preview_watermark(self.get_current_layer(), self.display_pil_image.size,
+                                              self.preview_scale(), "draft")
+        if placed is None:
+            return
+        sprite, initial_position = placed
+        if hasattr(self, 'preview_watermark_position') and self.preview_watermark_position:
+            current_x, current_y = self.preview_watermark_position
+        else:
+            # 从自定义锚点或预设位置计算初始位置（基于预览图片尺寸）
+            current_x, current_y = initial_position
+
+        # 更新预览位置，确保水印不超出预览图片边界
+        preview_w, preview_h = self.display_pil_image.size
+        new_x = max(0, min(current_x + delta_x, preview_w - sprite.width))
+        new_y = max(0, min(current_y + delta_y, preview_h - sprite.height))
+
+        # 保存预览坐标（用于拖拽过程）
+        self.preview_watermark_position = (new_x, new_y)
+
+        # 立即更新预览（使用快速路径）
+        self.quick_update_position_with_preview_coords()
+
+    def quick_update_position_with_preview_coords(self):
+        """使用预览坐标快速更新水印位置"""
+        if not self.display_pil_image or not hasattr(self, 'preview_watermark_position'):
+            return
+
+        # 在拖拽坐标处绘制当前图层（精灵图来自缓存）
+        image_with_watermark = self.draw_preview_watermark(
+            self.display_pil_image.copy(), self.get_current_layer(), self.preview_scale(), "draft",
+            self.preview_watermark_position)
+
+        # 立即更新UI
+        self.display_tk_image = ImageTk.PhotoImage(image_with_watermark)
+        canvas_w = self.preview_canvas.winfo_width()
+        canvas_h = self.preview_canvas.winfo_height()
+        self.preview_canvas.delete("all")
+        self.preview_canvas.create_image(canvas_w/2, canvas_h/2, anchor="center", image=self.display_tk_image)
+
+    def select_image(self, index):
+        if 0 <= index < len(self.image_paths):
+            self.current_image_index = index
+            path = self.image_paths[self.current_image_index]
+            # 更新列表中的选中状态
+            for i, child in enumerate(self.image_list_frame.winfo_children()):
+                if i == index:
+                    child.configure(fg_color="gray30")
+                else:
+                    child.configure(fg_color="transparent")
+
+            # 解码在后台线程进行；最近查看过或已预取的图片直接从缓存显示
+            image = self.image_loader.load(
+                path, lambda image, error: self.preview_queue.put(
+                    (self.on_image_decoded, (index, path, image, error))))
+            if image is not None:
+                self.show_decoded_image(image)
+            else:
+                self.preview_canvas.delete("all")
+                self.preview_canvas.create_text(self.preview_canvas.winfo_width()/2, self.preview_canvas.winfo_height()/2, text="加载中...", fill="white")
+            self.prefetch_neighbours(index)
+
+    def on_image_decoded(self, result):
+        """后台解码完成的回调（主线程）；期间已切换到其他图片时忽略"""
+        index, path, image, error = result
+        if index != self.current_image_index or self.image_paths[index] != path:
+            return
+        if error is not None:
+            print(f"Error opening image {path}: {error}")
+            self.original_pil_image = None
+            self.preview_canvas.delete("all")
+            self.preview_canvas.create_text(self.preview_canvas.winfo_width()/2, self.preview_canvas.winfo_height()/2, text="无法加载图片", fill="white")
+            return
+        self.show_decoded_image(image)
+
+    def show_decoded_image(self, image):
+        self.original_pil_image = image
+        # 自定义位置是归一化锚点，切换图片时保留
+        self.watermark_bounds = None
+        # 清除临时预览位置
+        if hasattr(self, 'preview_watermark_position'):
+            delattr(self, 'preview_watermark_position')
+        self.display_current_image(rescale=True)
+
+    def prefetch_neighbours(self, index):
+        """在后台预先解码相邻的图片"""
+        neighbours = [index + offset for offset in PREFETCH_OFFSETS if 0 <= index + offset < len(self.image_paths)]
+        self.image_loader.prefetch([self.image_paths[i] for i in neighbours])
+
+
+    def display_current_image(self, event=None, rescale=False, quality="final"):
+        """优化的异步预览更新，支持缓存和优先级
+
+        quality为"draft"时使用快速滤镜（交互过程中），为"final"时使用与导出一致的高质量滤镜。
+        """
+        if not self.original_pil_image:
+            return
+
+        canvas_w = self.preview_canvas.winfo_width()
+        canvas_h = self.preview_canvas.winfo_height()
+        if canvas_w <= 1 or canvas_h <= 1: 
+            return
+
+        # 递增处理ID，用于取消过期的处理
+        self.current_processing_id += 1
+        processing_id = self.current_processing_id
+
+        # 检查是否只是位置变化（快速路径）
+        current_layer = self.get_current_layer()
+        position_only_change = self.is_position_only_change(current_layer)
+        
+        if position_only_change and self.base_watermark_image is not None and not rescale:
+            # 快速路径：只有位置变化，直接重新定位水印
+            self.quick_update_position()
+            return
+
+        # 高质量渲染时，草稿底图需要用高质量滤镜重新缩放
+        if quality == "final" and self.display_is_draft:
+            rescale = True
+
+        # 准备图像数据  
+        image_data = (self.original_pil_image, (canvas_w, canvas_h), rescale)
+        
+        # 异步生成预览（带缓存）
+        self.async_generate_preview_cached(image_data, current_layer, processing_id, 
+                                          lambda result: self.on_preview_ready_cached(result, processing_id),
+                                          quality)
+
+    def preview_token_context(self):
+        """当前预览图片的动态字段取值（切换图片后重建）；没有选中图片时返回None"""
+        if not 0 <= self.current_image_index < len(self.image_paths):
+            return None
+        path = self.image_paths[self.current_image_index]
+        index = self.current_image_index + 1
+        context = self._token_context
+        if context is None or context.path != path or context.index != index:
+            context = TokenContext(path, index)
+            self._token_context = context
+        return context
+
+    def is_position_only_change(self, current_layer):
+        """检查当前图层与上次预览相比是否只有位置发生了变化"""
+        last = self.last_watermark_layer
+        if last is None:
+            return False
+        if replace(last, position=None, anchor=None) != replace(current_layer, position=None, anchor=None):
+            return False
+        return (last.position, last.anchor) != (current_layer.position, current_layer.anchor)
+
+    def quick_update_position(self):
+        """快速更新水印位置，无需重新生成水印"""
+        if not self.base_watermark_image or not self.display_pil_image:
+            return
+
+        # 精灵图来自缓存，只重新计算位置并合成
+        image_with_watermark = self.draw_preview_watermark(
+            self.display_pil_image.copy(), self.get_current_layer(), self.preview_scale())
+
+        # 立即更新UI
+        self.display_tk_image = ImageTk.PhotoImage(image_with_watermark)
+        canvas_w = self.preview_canvas.winfo_width()
+        canvas_h = self.preview_canvas.winfo_height()
+        self.preview_canvas.delete("all")
+        self.preview_canvas.create_image(canvas_w/2, canvas_h/2, anchor="center", image=self.display_tk_image)
+
+    def async_generate_preview_cached(self, image_data, current_layer, processing_id, callback, quality="final"):
+        """带缓存和优先级的异步预览生成"""
+        resize_resample = RESAMPLE_FILTERS[quality][0]
+        token_context = self.preview_token_context()
+        fixed_layers = tuple(self.watermark_layers)
+
+        def worker():
+            try:
+                # 检查任务是否已过期
+                if processing_id != self.current_processing_id:
+                    return  # 任务已被新任务取代
+                
+                # 解包参数
+                original_image, canvas_size, rescale = image_data
+                
+                # 计算显示尺寸和缩放比例
+                display_is_draft = self.display_is_draft
+                if rescale or not hasattr(self, 'display_pil_image') or self.display_pil_image is None:
+                    canvas_w, canvas_h = canvas_size
+                    img_w, img_h = original_image.size
+                    ratio = min(canvas_w / img_w, canvas_h / img_h)
+                    new_w = int(img_w * ratio)
+                    new_h = int(img_h * ratio)
+                    display_image = original_image.resize((new_w, new_h), resize_resample)
+                    display_is_draft = quality != "final"
+                    preview_scale = ratio  # 记录预览缩放比例
+                    # 已固定的图层合成到预览底图上（一次合成），当前编辑的图层在其上单独绘制以支持拖拽
+                    if fixed_layers:
+                        # 动态字段和相对大小按原图计算，再按预览比例缩放，保证与导出一致
+                        preview_layers = [self.watermark_renderer.preview_layer(layer, original_image.size, ratio, token_context)
+                                          for layer in fixed_layers]
+                        display_image = self.watermark_renderer.apply(display_image.copy(), preview_layers)
+                else:
+                    display_image = self.display_pil_image
+                    # 计算当前预览的缩放比例
+                    orig_w, orig_h = original_image.size
+                    disp_w, disp_h = display_image.size
+                    preview_scale = min(disp_w / orig_w, disp_h / orig_h)
+
+                # 再次检查任务是否过期
+                if processing_id != self.current_processing_id:
+                    return
+                
+                # 添加当前编辑的图层（精灵图由渲染器缓存）
+                image_with_watermark = self.draw_preview_watermark(display_image.copy(), current_layer,
+                                                                   preview_scale, quality)
+                
+                # 最后检查任务是否过期
+                if processing_id != self.current_processing_id:
+                    return
+                
+                # 存储基础水印图像用于快速位置更新
+                self.base_watermark_image = image_with_watermark
+                self.last_watermark_layer = current_layer
+                
+                # 将PIL图像结果放入队列（不在这里转换为Tkinter格式）
+                self.preview_queue.put((callback, (image_with_watermark, display_image, display_is_draft)))
+                
+            except Exception as e:
+                print(f"Cached preview generation error: {e}")
+                self.preview_queue.put((callback, None))
+        
+        # 启动后台线程
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def on_preview_ready_cached(self, result, processing_id):
+        """缓存预览生成完成的回调"""
+        # 检查结果是否仍然有效
+        if processing_id != self.current_processing_id:
+            return  # 忽略过期的结果
+            
+        if result is None:
+            return
+            
+        image_with_watermark, display_image, display_is_draft = result
+        
+        # 在主线程中转换为Tkinter格式
+        try:
+            tk_image = ImageTk.PhotoImage(image_with_watermark)
+        except Exception as e:
+            print(f"Error converting to Tkinter image: {e}")
+            return
+        
+        # 更新成员变量
+        self.display_pil_image = display_image
+        self.display_is_draft = display_is_draft
+        self.display_tk_image = tk_image
+        
+        # 更新Canvas
+        canvas_w = self.preview_canvas.winfo_width()
+        canvas_h = self.preview_canvas.winfo_height()
+        self.preview_canvas.delete("all")
+        self.preview_canvas.create_image(canvas_w/2, canvas_h/2, anchor="center", image=self.display_tk_image)
+
+    def select_image_watermark(self):
+        file_types = [("Image files", "*.png *.jpg *.jpeg *.bmp *.tiff"), ("All files", "*.*")]
+        path = filedialog.askopenfilename(title="选择水印图片", filetypes=file_types)
+        if path:
+            try:
+                self.image_watermark_pil = Image.open(path).convert("RGBA")
+                self.image_watermark_pil.filename = path # Store path for saving
+                self.pending_image_watermark_path = None
+                self._watermark_load_id += 1
+                self.debounced_update_preview()
+            except Exception as e:
+                print(f"Error opening watermark image: {e}")
+                self.image_watermark_pil = None
+
+    def load_image_watermark_async(self, path):
+        """在后台线程加载水印图片，完成后刷新预览"""
+        self._watermark_load_id += 1
+        load_id = self._watermark_load_id
+        self.pending_image_watermark_path = path
+
+        def worker():
+            try:
+                image = Image.open(path).convert("RGBA")
+                image.filename = path # Store path for saving
+            except Exception as e:
+                print(f"Failed to load watermark image from settings: {e}")
+                image = None
+            self.preview_queue.put((lambda result: self.on_image_watermark_loaded(result, load_id), image))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def on_image_watermark_loaded(self, image, load_id):
+        """水印图片加载完成的回调，忽略已被新设置取代的结果"""
+        if load_id != self._watermark_load_id:
+            return
+        self.pending_image_watermark_path = None
+        self.image_watermark_pil = image
+        self.clear_watermark_cache()
+        self.debounced_update_preview()
+
+    def add_watermark_to_image(self, image):
+        """将所有水印图层一次性合成到整幅图片上"""
+        return self.watermark_renderer.apply(image, self.get_watermark_layers())
+
+    def get_current_layer(self):
+        """将当前编辑中的水印设置转换为图层"""
+        anchor = self.custom_watermark_anchor
+        size_mode = "relative" if self.relative_size_enabled.get() else "fixed"
+        relative_size = float(self.relative_size_value.get())
+
+        if self.watermark_type.get() == "text":
+            return WatermarkLayer(
+                kind="text",
+                text=self.text_entry.get(),
+                font_name=self.watermark_font,
+                font_size=self.watermark_font_size,
+                color=tuple(self.watermark_color),
+                opacity=self.opacity_slider.get(),
+                rotation=self.watermark_rotation,
+                position=self.watermark_position,
+                anchor=anchor,
+                size_mode=size_mode,
+                relative_size=relative_size,
+                auto_color=self.auto_text_color.get(),
+            )
+
+        image_path = None
+        if self.image_watermark_pil is not None:
+            image_path = self.get_image_watermark_path()
+            if image_path:
+                self.watermark_renderer.register_image(image_path, self.image_watermark_pil)
+        return WatermarkLayer(
+            kind="image",
+            image_path=image_path,
+            scale=self.image_scale_slider.get(),
+            opacity=self.image_opacity_slider.get(),
+            rotation=self.watermark_rotation,
+            position=self.watermark_position,
+            anchor=anchor,
+            size_mode=size_mode,
+            relative_size=relative_size,
+        )
+
+    def get_watermark_layers(self):
+        """按从下到上的顺序返回全部水印图层（已固定的图层 + 当前编辑的图层）"""
+        return tuple(self.watermark_layers) + (self.get_current_layer(),)
+
+    def add_current_as_layer(self):
+        """把当前编辑的水印固定为一个图层，并清空编辑区以便添加下一个图层"""
+        layer = self.get_current_layer()
+        if layer.is_empty():
+            messagebox.showwarning("提示", "当前水印为空，请先输入文本或选择水印图片。")
+            return
+        self.watermark_layers.append(layer)
+        if layer.kind == "text":
+            self.text_entry.delete(0, "end")
+        else:
+            self.image_watermark_pil = None
+        self.custom_watermark_anchor = None
+        self.watermark_bounds = None
+        self.refresh_layer_list()
+
+    def remove_layer(self, index):
+        if 0 <= index < len(self.watermark_layers):
+            del self.watermark_layers[index]
+            self.refresh_layer_list()
+
+    def clear_layers(self):
+        if self.watermark_layers:
+            self.watermark_layers = []
+            self.refresh_layer_list()
+
+    def refresh_layer_list(self):
+        """更新图层列表显示，并重新生成预览底图"""
+        for widget in self.layer_list_frame.winfo_children():
+            widget.destroy()
+        for i, layer in enumerate(self.watermark_layers):
+            row = ctk.CTkFrame(self.layer_list_frame)
+            row.pack(fill="x", pady=1)
+            if layer.kind == "text":
+                description = f"文本: {layer.text}"
+            else:
+                description = f"图片: {os.path.basename(layer.image_path)}"
+            if len(description) > 24:
+                description = description[:23] + "…"
+            ctk.CTkLabel(row, text=f"{i + 1}. {description}", anchor="w").pack(side="left", padx=5, fill="x", expand=True)
+            ctk.CTkButton(row, text="删除", width=40, command=lambda i=i: self.remove_layer(i)).pack(side="right", padx=2)
+        self.display_current_image(rescale=True)
+
+    def set_font(self, font_name):
+        self.watermark_font = font_name
+        self.debounced_update_preview()
+
+    def set_font_size(self, event=None):
+        try:
+            size = int(self.font_size_entry.get())
+            if size > 0:
+                self.watermark_font_size = size
+                self.clear_watermark_cache()  # 清除缓存，因为字体大小改变了
+                self.debounced_update_preview()
+        except ValueError:
+            pass # Ignore non-integer input
+
+    def set_position(self, position_code):
+        """优化的位置设置，使用快速更新路径"""
+        print("Setting position to:", position_code)
+        old_position = self.watermark_position
+        self.watermark_position = position_code
+        
+        # 清除自定义位置，使用预设位置
+        self.custom_watermark_anchor = None
+        
+        # 如果有缓存的水印，使用快速路径
+        if (self.base_watermark_image is not None and 
+            self.last_watermark_layer is not None and 
+            self.display_pil_image is not None):
+            self.render_scheduler.schedule("position", self.quick_update_position)
+        else:
+            # 降级到正常更新
+            self.update_preview()
+
+    def set_position_with_refresh(self, position_code):
+        """简化的位置设置"""
+        self.set_position(position_code)
+        self.update_preview()
+
+    def on_size_mode_changed(self):
+        """切换固定大小/相对大小模式"""
+        self.clear_watermark_cache()
+        self.debounced_update_preview()
+
+    def set_rotation(self, angle):
+        self.watermark_rotation = int(angle)
+        self.debounced_update_preview()
+
+    def debounced_update_preview(self, event=None):
+        """Schedules a draft render for the next frame, replacing any pending one.
+
+        交互过程中每帧最多渲染一次草稿预览，停止操作后再渲染高质量预览。
+        """
+        self.render_scheduler.schedule("preview", lambda: self.update_preview(quality="draft"))
+        self.schedule_preview_refine()
+
+    def schedule_preview_refine(self):
+        """重新计时：停止操作 REFINE_IDLE_DELAY 毫秒后渲染高质量预览"""
+        if self._refine_job is not None:
+            self.after_cancel(self._refine_job)
+        self._refine_job = self.after(REFINE_IDLE_DELAY, self.refine_preview)
+
+    def refine_preview(self):
+        """高质量预览：递增的处理ID会让仍在进行的草稿任务作废"""
+        self._refine_job = None
+        self.render_scheduler.cancel("preview")
+        if self.is_dragging:
+            # 拖拽还没结束，释放鼠标时会再次触发
+            return
+        self.display_current_image(rescale=False, quality="final")
+
+    def update_preview(self, event=None, quality="final"):
+        """The actual preview update function."""
+        self.display_current_image(rescale=False, quality=quality) # 仅更新水印，不重新缩放
+
+    def on_watermark_type_changed(self):
+        """Handle watermark type change and update UI visibility."""
+        watermark_type = self.watermark_type.get()
+        
+        if watermark_type == "text":
+            # 显示文本水印相关控件，隐藏图片水印控件
+            self.text_watermark_frame.pack(pady=10, padx=10, fill="x")
+            self.image_watermark_frame.pack_forget()
+        else:  # watermark_type == "image"
+            # 显示图片水印相关控件，隐藏文本水印控件
+            self.image_watermark_frame.pack(pady=10, padx=10, fill="x")
+            self.text_watermark_frame.pack_forget()
+        
+        # 更新预览
+        self.debounced_update_preview()
+
+    def get_output_filename(self, original_path, taken=None):
+        """按命名规则生成输出文件名；taken 为这一批已分配的名字，同名的输出（不同文件夹或归档中的同名图片）追加序号"""
+        filename = encoders.output_filename(original_path, self.output_format.get(), self.output_naming_rule.get(),
+                                            self.output_naming_prefix.get(), self.output_naming_suffix.get())
+        return filename if taken is None else encoders.unique_filename(filename, taken)
+
+    def process_and_export_images(self):
+        # 导出模块（多进程、共享内存）在第一次导出时才导入，不计入启动时间
+        from autotune import WorkerTuner
+        from parallel_export import ExportJob, export_jobs
+
+        if not self.image_paths:
+            messagebox.showerror("错误", "没有导入任何图片。")
+            return
+
+        # 使用预设的输出路径，如果没有设置则提示用户选择
+        output_dir = self.output_directory.get()
+        
+        if not output_dir:
+            # 提示用户先设置输出路径
+            result = messagebox.askyesno("设置输出路径", 
+                                       "尚未设置输出路径。是否现在选择输出文件夹？")
+            if result:
+                self.choose_output_directory()
+                output_dir = self.output_directory.get()
+            
+            if not output_dir:
+                return
+        
+        # 验证输出目录是否存在
+        if not os.path.exists(output_dir):
+            messagebox.showerror("错误", f"输出路径不存在：{output_dir}\n请重新选择输出文件夹。")
+            self.choose_output_directory()
+            output_dir = self.output_directory.get()
+            if not output_dir:
+                return
+
+        # Prevent overwriting - 防止导出到原始图片所在的文件夹
+        input_dirs = {os.path.dirname(p) for p in self.image_paths}
+        if output_dir in input_dirs:
+            messagebox.showerror("错误", "不能导出到原始图片所在的文件夹，请选择其他文件夹。")
+            # 提供重新选择的机会
+            self.choose_output_directory()
+            output_dir = self.output_directory.get()
+            if not output_dir or output_dir in input_dirs:
+                return
+
+        # 预检：只读文件头，提前标记损坏或不支持的文件，而不是在批处理中途失败
+        image_infos = self.image_prober.probe_many(self.image_paths)
+        bad_infos = [info for info in image_infos if not info.ok]
+        if bad_infos:
+            names = "\n".join(os.path.basename(info.path) for info in bad_infos[:10])
+            if len(bad_infos) > 10:
+                names += f"\n... 等 {len(bad_infos)} 个文件"
+            if not messagebox.askyesno("无法识别的文件", f"以下文件已损坏或格式不支持，将被跳过：\n{names}\n\n是否继续导出其余图片？"):
+                return
+        # 按 (宽, 高, 方向) 分组：同组图片共用一个渲染计划（精灵图、位置和边界裁剪只计算一次）
+        size_groups = {}
+        for info in image_infos:
+            if info.ok:
+                size_groups.setdefault((info.width, info.height, info.orientation), []).append(info.path)
+        export_paths = [path for paths in size_groups.values() for path in paths]
+        if not export_paths:
+            return
+        infos_by_path = {info.path: info for info in image_infos}
+        # 同一尺寸的图片共用渲染计划；动态文本、自动位置/配色按每张图片计算（在解码线程中并发调用）
+        plan_for_size = self.watermark_renderer.planner(self.get_watermark_layers())
+
+        progress_win = ctk.CTkToplevel(self)
+        progress_win.title("处理中...")
+        progress_win.geometry("360x150")
+        progress_win.grab_set()
+        
+        progress_label = ctk.CTkLabel(progress_win, text="正在处理图片...")
+        progress_label.pack(pady=10)
+        progress_bar = ctk.CTkProgressBar(progress_win)
+        progress_bar.pack(pady=10, padx=20, fill="x")
+        progress_bar.set(0)
+
+        total_images = len(export_paths)
+        report = ExportReport(total_images)
+        for info in bad_infos:
+            report.skip(info.path, info.error)
+        preset = self.encoder_preset.get()
+        quality = self.jpeg_quality.get()
+        positions = {path: index for index, path in enumerate(self.image_paths, 1)}
+        archive = self.create_archive_writer(output_dir)
+        taken = set()
+        # 写入归档时工作进程把编码结果直接返回，按输出文件名写入归档，不生成中间文件
+        jobs = [ExportJob(path, self.get_output_filename(path, taken) if archive else
+                          os.path.join(output_dir, self.get_output_filename(path, taken)),
+                          encoders.resolve_output_format(self.output_format.get(), path), preset, quality,
+                          positions[path], in_memory=archive is not None)
+                for path in export_paths]
+
+        # 单帧图片在工作进程中并行合成和编码（像素通过共享内存传递）；GIF动画/多页TIFF逐帧处理
+        # 工作进程数和同时处理的图片数按CPU、可用内存和图片尺寸自动选择，并随内存压力调整
+        tuner = WorkerTuner([infos_by_path[path] for path in export_paths])
+        for i, result in enumerate(export_jobs(jobs, plan_for_size, infos_by_path, tuner=tuner)):
+            if result.ok and archive is not None:
+                try:
+                    archive.write(result.job.output_path, result.data)
+                except OSError as e:
+                    result = replace(result, error=e)
+            if not result.ok:
+                print(f"Error processing {result.job.path}: {result.error}")
+            report.record(result, infos_by_path[result.job.path].file_size)
+
+            # Update progress
+            progress = (i + 1) / total_images
+            progress_bar.set(progress)
+            progress_label.configure(text=report.progress_text())
+            # 定期刷新UI
+            if i % 5 == 0:  # 每5张图片刷新一次UI
+                progress_win.update_idletasks()
+
+        if archive is not None:
+            archive.close()
+            report.archives = archive.paths
+        report.concurrency = {"description": tuner.describe(), "memory_backoffs": tuner.backoffs}
+        report.finish()
+        progress_win.destroy()
+        try:
+            summary_path = report.write(output_dir)
+        except OSError as e:
+            print(f"Error writing export summary: {e}")
+            summary_path = None
+        message = f"成功导出 {report.succeeded} 张图片，失败 {report.failed} 张，跳过 {report.skipped} 张。"
+        if report.archives:
+            message += "\n已写入归档：" + "、".join(os.path.basename(path) for path in report.archives)
+        if summary_path:
+            message += f"\n处理明细已保存到：{summary_path}"
+        if report.failed:
+            messagebox.showwarning("完成", message)
+        else:
+            messagebox.showinfo("完成", message)
+
+    def get_archive_volume_mb(self):
+        """分卷大小（MB）；输入无效时按0（不分卷）处理"""
+        try:
+            return max(0, self.archive_volume_mb.get())
+        except TclError:
+            return 0
+
+    def create_archive_writer(self, output_dir):
+        """按打包设置在输出文件夹中创建归档；导出为单独文件时返回None"""
+        archive_format = self.output_archive.get()
+        if archive_format not in ARCHIVE_FORMATS:
+            return None
+        from archive_output import ArchiveWriter
+        volume_mb = self.get_archive_volume_mb()
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        return ArchiveWriter(os.path.join(output_dir, f"watermarked_{stamp}.{archive_format}"), archive_format,
+                             volume_mb * 2**20 if volume_mb > 0 else None)
+
+    def preflight_export(self):
+        """按当前水印设置试运行一小批样本，预估整批导出的耗时、内存和输出大小"""
+        from parallel_export import ExportJob
+        from preflight import estimate as estimate_export
+
+        if not self.image_paths:
+            messagebox.showerror("错误", "没有导入任何图片。")
+            return
+        output_dir = self.output_directory.get() or os.path.dirname(self.image_paths[0])
+        preset = self.encoder_preset.get()
+        quality = self.jpeg_quality.get()
+        # 输出路径只用于确定格式，试运行的文件写在临时目录中
+        jobs = [ExportJob(path, os.path.join(output_dir, self.get_output_filename(path)),
+                          encoders.resolve_output_format(self.output_format.get(), path), preset, quality, index)
+                for index, path in enumerate(self.image_paths, 1)]
+        layers = tuple(layer for layer in self.get_watermark_layers() if not layer.is_empty())
+        paths = list(self.image_paths)
+
+        def worker():
+            try:
+                infos = {info.path: info for info in self.image_prober.probe_many(paths)}
+                result = estimate_export(jobs, self.watermark_renderer.planner(layers), infos)
+            except Exception as e:
+                result = e
+            self.preview_queue.put((self.on_preflight_done, result))
+
+        messagebox.showinfo("试运行", "正在用样本图片试运行，完成后将显示预估结果。")
+        threading.Thread(target=worker, daemon=True).start()
+
+    def on_preflight_done(self, result):
+        if isinstance(result, Exception):
+            messagebox.showerror("预估失败", str(result))
+            return
+        messagebox.showinfo("导出预估", result.describe())
+
+    def distribute_to_spool(self):
+        """把当前导出拆分为分片写入共享目录，由各节点上的 spool.py worker 处理"""
+        from parallel_export import ExportJob
+        from spool import Spool
+
+        if not self.image_paths:
+            messagebox.showerror("错误", "没有导入任何图片。")
+            return
+        output_dir = self.output_directory.get()
+        if not output_dir or not os.path.exists(output_dir):
+            messagebox.showerror("错误", "请先设置输出路径（需位于各节点都能访问的共享存储上）。")
+            return
+        spool_dir = filedialog.askdirectory(title="选择共享任务目录")
+        if not spool_dir:
+            return
+
+        preset = self.encoder_preset.get()
+        quality = self.jpeg_quality.get()
+        taken = set()
+        jobs = [ExportJob(path, os.path.join(output_dir, self.get_output_filename(path, taken)),
+                          encoders.resolve_output_format(self.output_format.get(), path), preset, quality, index)
+                for index, path in enumerate(self.image_paths, 1)]
+        layers = [layer for layer in self.get_watermark_layers() if not layer.is_empty()]
+        try:
+            shard_count = Spool(spool_dir).create_job(layers, jobs)
+        except FileExistsError:
+            messagebox.showerror("错误", "该目录中已有任务，请选择一个空目录。")
+            return
+        except OSError as e:
+            messagebox.showerror("错误", f"写入任务目录失败：{e}")
+            return
+        messagebox.showinfo("已分发", f"已将 {len(jobs)} 张图片拆分为 {shard_count} 个分片。\n"
+                                      f"在各节点上运行：python spool.py worker \"{spool_dir}\"")
+
+    def quit_app(self):
+        """清理资源并关闭应用"""
+        self.is_closing = True
+        self.save_settings(show_message=False)
+        self.image_prober.shutdown()
+        self.image_loader.shutdown()
+        self.render_scheduler.shutdown()
+        if os.environ.get("WATERMARK_RENDER_STATS"):
+            stats = self.render_scheduler.stats()
+            print(f"RENDER requested {stats['requested']} rendered {stats['rendered']} dropped {stats['dropped']}")
+            stats = self.watermark_renderer.cache_stats()
+            print(f"SPRITES hits {stats['hits']} misses {stats['misses']} evictions {stats['evictions']} "
+                  f"entries {stats['entries']} bytes {stats['bytes']}")
+        self.destroy()
+
+    def get_settings_as_dict(self):
+        settings = {
+            "watermark_type": self.watermark_type.get(),
+            "text_content": self.text_entry.get(),
+            "text_color": self.watermark_color,
+            "text_font": self.watermark_font,
+            "text_font_size": self.watermark_font_size,
+            "text_opacity": self.opacity_slider.get(),
+            "image_watermark_path": self.get_image_watermark_path(),
+            "watermark_layers": [layer.to_dict() for layer in self.watermark_layers],
+            "image_opacity": self.image_opacity_slider.get(),
+            "image_scale": self.image_scale_slider.get(),
+            "position": self.watermark_position,
+            "rotation": self.watermark_rotation,
+            "custom_anchor": list(self.custom_watermark_anchor) if self.custom_watermark_anchor else None,
+            "size_mode": "relative" if self.relative_size_enabled.get() else "fixed",
+            "relative_size": self.relative_size_value.get(),
+            "auto_text_color": self.auto_text_color.get(),
+            "output_naming_rule": self.output_naming_rule.get(),
+            "output_prefix": self.output_naming_prefix.get(),
+            "output_suffix": self.output_naming_suffix.get(),
+            "output_directory": self.output_directory.get(),  # 添加输出路径
+            "jpeg_quality": self.jpeg_quality.get(),
+            "output_format": self.output_format.get(),
+            "encoder_preset": self.encoder_preset.get(),
+            "output_archive": self.output_archive.get(),
+            "archive_volume_mb": self.get_archive_volume_mb(),
+            # 添加模板相关设置
+            "last_template_name": self.current_template_name,
+            "auto_load_last": self.auto_load_last.get(),
+        }
+        return settings
+
+    def get_image_watermark_path(self):
+        """当前水印图片的路径（包括仍在后台加载中的图片）"""
+        if self.image_watermark_pil and hasattr(self.image_watermark_pil, 'filename'):
+            return self.image_watermark_pil.filename
+        return self.pending_image_watermark_path
+
+    def apply_settings_from_dict(self, settings):
+        self.watermark_type.set(settings.get("watermark_type", "text"))
+        self.text_entry.delete(0, "end")
+        self.text_entry.insert(0, settings.get("text_content", ""))
+        self.watermark_color = tuple(settings.get("text_color", (255, 255, 255)))
+        self.watermark_font = settings.get("text_font", "Arial")
+        self.font_menu.set(self.watermark_font)
+        self.watermark_font_size = settings.get("text_font_size", 48)
+        self.font_size_entry.delete(0, "end")
+        self.font_size_entry.insert(0, str(self.watermark_font_size))
+        self.opacity_slider.set(settings.get("text_opacity", 0.5))
+        self.watermark_layers = [WatermarkLayer.from_dict(data) for data in settings.get("watermark_layers", [])]
+        self.refresh_layer_list()
+        
+        image_path = settings.get("image_watermark_path")
+        self.image_watermark_pil = None
+        if image_path and os.path.exists(image_path):
+            # 水印图片在后台加载，不阻塞界面
+            self.load_image_watermark_async(image_path)
+        else:
+            self.pending_image_watermark_path = None
+            self._watermark_load_id += 1
+
+        self.image_opacity_slider.set(settings.get("image_opacity", 0.5))
+        self.image_scale_slider.set(settings.get("image_scale", 1.0))
+        self.watermark_position = settings.get("position", "br")
+        custom_anchor = settings.get("custom_anchor")
+        self.custom_watermark_anchor = tuple(custom_anchor) if custom_anchor else None
+        self.watermark_rotation = settings.get("rotation", 0)
+        self.rotation_slider.set(self.watermark_rotation)
+        self.relative_size_enabled.set(settings.get("size_mode", "fixed") == "relative")
+        self.relative_size_value.set(int(settings.get("relative_size", 20)))
+        self.auto_text_color.set(settings.get("auto_text_color", False))
+        self.output_naming_rule.set(settings.get("output_naming_rule", "suffix"))
+        self.output_naming_prefix.set(settings.get("output_prefix", "wm_"))
+        self.output_naming_suffix.set(settings.get("output_suffix", "_watermark"))
+        # 加载输出路径设置
+        self.output_directory.set(settings.get("output_directory", ""))
+        self.update_output_path_display()  # 更新路径显示
+        self.jpeg_quality.set(settings.get("jpeg_quality", 95))
+        self.output_format.set(settings.get("output_format", "original"))
+        self.encoder_preset.set(settings.get("encoder_preset", encoders.DEFAULT_PRESET))
+        self.output_archive.set(settings.get("output_archive", "none"))
+        self.archive_volume_mb.set(int(settings.get("archive_volume_mb", 0)))
+        self.update_output_format_display()
+        
+        # 加载模板相关设置
+        if hasattr(self, 'auto_load_last'):
+            self.auto_load_last.set(settings.get("auto_load_last", True))
+
+        self.on_watermark_type_changed() # Update UI visibility based on loaded type
+
+    def save_settings(self, show_message=True):
+        settings = self.get_settings_as_dict()
+        try:
+            with open(self.config_file, "w") as f:
+                json.dump(settings, f, indent=4)
+            if show_message:
+                messagebox.showinfo("成功", "设置已保存。")
+        except Exception as e:
+            if show_message:
+                messagebox.showerror("错误", f"无法保存设置: {e}")
+
+    def load_settings(self, show_message=True):
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, "r") as f:
+                    settings = json.load(f)
+                self.apply_settings_from_dict(settings)
+                if show_message:
+                    messagebox.showinfo("成功", "设置已加载。")
+            elif show_message:
+                messagebox.showwarning("未找到", "未找到配置文件。")
+        except Exception as e:
+            if show_message:
+                messagebox.showerror("错误", f"无法加载设置: {e}")
+
+    # ==================== 模板管理系统 ====================
+    
+    def init_template_system(self):
+        """初始化模板管理系统"""
+        # 创建模板文件夹
+        if not os.path.exists(self.templates_dir):
+            os.makedirs(self.templates_dir)
+
+        # 带索引的模板存储，避免每次刷新都扫描目录
+        self.template_store = TemplateStore(self.templates_dir, self.template_extension)
+        
+        # 先用索引中的模板填充列表，目录刷新在启动后于后台进行
+        self.update_template_combobox()
+
+    def async_refresh_template_list(self):
+        """在后台线程刷新模板索引，完成后更新下拉菜单"""
+        def worker():
+            try:
+                self.template_store.refresh()
+            except Exception as e:
+                print(f"Template refresh error: {e}")
+            self.preview_queue.put((lambda result: self.update_template_combobox(), None))
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        
+    def refresh_template_list(self):
+        """刷新模板下拉菜单（增量刷新索引，按搜索前缀过滤）"""
+        self.template_store.refresh()
+        self.update_template_combobox()
+
+    def update_template_combobox(self):
+        """用索引中的模板名称更新下拉菜单"""
+        template_files = self.template_store.search(self.template_search_entry.get().strip())
+        
+        # 更新下拉菜单
+        if template_files:
+            self.template_combobox.configure(values=["<无模板>"] + template_files)
+        else:
+            self.template_combobox.configure(values=["<无模板>"])
+            
+        # 如果当前选择的模板不存在了，重置为无模板
+        current_selection = self.template_combobox.get()
+        if current_selection != "<无模板>" and not self.template_store.exists(current_selection):
+            self.template_combobox.set("<无模板>")
+            self.current_template_name = None
+
+    def on_template_search(self, event=None):
+        """按输入的前缀过滤模板下拉菜单"""
+        template_files = self.template_store.search(self.template_search_entry.get().strip())
+        self.template_combobox.configure(values=["<无模板>"] + template_files)
+    
+    def get_template_path(self, template_name):
+        """获取模板文件的完整路径"""
+        return self.template_store.get_path(template_name)
+    
+    def save_new_template(self):
+        """保存新模板"""
+        # 获取模板名称
+        template_name = ctk.CTkInputDialog(
+            text="请输入模板名称:", 
+            title="保存水印模板"
+        ).get_input()
+        
+        if not template_name:
+            return
+            
+        # 验证模板名称
+        if not self.validate_template_name(template_name):
+            messagebox.showerror("错误", "模板名称不能包含特殊字符或为空。")
+            return
+            
+        # 检查是否覆盖现有模板
+        if self.template_store.exists(template_name):
+            result = messagebox.askyesno("确认覆盖", f"模板 '{template_name}' 已存在。是否覆盖？")
+            if not result:
+                return
+        
+        # 保存模板
+        try:
+            settings = self.get_settings_as_dict()
+            # 添加模板元数据
+            settings["template_metadata"] = {
+                "name": template_name,
+                "created_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "version": "1.0"
+            }
+            
+            self.template_store.save(template_name, settings)
+                
+            self.current_template_name = template_name
+            self.refresh_template_list()
+            self.template_combobox.set(template_name)
+            
+            messagebox.showinfo("成功", f"模板 '{template_name}' 已保存。")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"保存模板失败: {e}")
+    
+    def load_template_by_name(self, template_name, show_message=True):
+        """根据名称加载模板"""
+        if template_name == "<无模板>":
+            self.current_template_name = None
+            return
+            
+        try:
+            settings = self.template_store.load(template_name)
+        except FileNotFoundError:
+            messagebox.showerror("错误", f"模板文件不存在: {self.get_template_path(template_name)}")
+            self.refresh_template_list()
+            return
+        except Exception as e:
+            messagebox.showerror("错误", f"加载模板失败: {e}")
+            self.current_template_name = None
+            self.template_combobox.set("<无模板>")
+            return
+            
+        try:
+            self.apply_settings_from_dict(settings)
+            self.current_template_name = template_name
+            self.watermark_bounds = None
+            
+            # 更新预览
+            self.debounced_update_preview()
+            
+            if show_message:
+                messagebox.showinfo("成功", f"已加载模板 '{template_name}'。")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"加载模板失败: {e}")
+            self.current_template_name = None
+            self.template_combobox.set("<无模板>")
+    
+    def rename_template(self):
+        """重命名当前选中的模板"""
+        current_template = self.template_combobox.get()
+        
+        if current_template == "<无模板>":
+            messagebox.showwarning("提示", "请先选择要重命名的模板。")
+            return
+            
+        new_name = ctk.CTkInputDialog(
+            text=f"请输入新的模板名称:", 
+            title="重命名模板"
+        ).get_input()
+        
+        if not new_name:
+            return
+            
+        if not self.validate_template_name(new_name):
+            messagebox.showerror("错误", "模板名称不能包含特殊字符或为空。")
+            return
+            
+        if new_name == current_template:
+            return  # 名称没有变化
+            
+        # 检查新名称是否已存在
+        if self.template_store.exists(new_name):
+            messagebox.showerror("错误", f"模板名称 '{new_name}' 已存在。")
+            return
+            
+        try:
+            # 重命名文件并更新模板内部的元数据
+            self.template_store.rename(current_template, new_name)
+            
+            self.current_template_name = new_name
+            self.refresh_template_list()
+            self.template_combobox.set(new_name)
+            
+            messagebox.showinfo("成功", f"模板已重命名为 '{new_name}'。")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"重命名模板失败: {e}")
+    
+    def delete_template(self):
+        """删除当前选中的模板"""
+        current_template = self.template_combobox.get()
+        
+        if current_template == "<无模板>":
+            messagebox.showwarning("提示", "请先选择要删除的模板。")
+            return
+            
+        result = messagebox.askyesno("确认删除", f"确定要删除模板 '{current_template}' 吗？此操作不可撤销。")
+        
+        if not result:
+            return
+            
+        try:
+            self.template_store.delete(current_template)
+            
+            self.current_template_name = None
+            self.refresh_template_list()
+            self.template_combobox.set("<无模板>")
+            
+            messagebox.showinfo("成功", f"模板 '{current_template}' 已删除。")
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"删除模板失败: {e}")
+    
+    def validate_template_name(self, name):
+        """验证模板名称是否有效"""
+        if not name or not name.strip():
+            return False
+            
+        # 检查是否包含不允许的字符
+        invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
+        for char in invalid_chars:
+            if char in name:
+                return False
+                
+        return True
+    
+    def load_last_settings_or_default_template(self):
+        """启动时自动加载上次设置或默认模板"""
+        if not self.auto_load_last.get():
+            return
+            
+        # 首先尝试加载上次的设置
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, "r") as f:
+                    settings = json.load(f)
+                    
+                # 检查是否有上次使用的模板
+                last_template = settings.get("last_template_name")
+                if last_template and last_template != "<无模板>":
+                    if self.template_store.exists(last_template):
+                        self.template_combobox.set(last_template)
+                        self.load_template_by_name(last_template, show_message=False)
+                        return
+                        
+                # 如果没有有效的模板，加载基本设置
+                self.apply_settings_from_dict(settings)
+                
+        except Exception as e:
+            print(f"Failed to load last settings: {e}")
+
+def report_startup_timing(app):
+    """启动基准模式：输出首帧绘制和启动完成的时间戳后退出（供 benchmark.py startup 使用）"""
+    def wait_for_startup():
+        if not app.startup_complete:
+            app.after(10, wait_for_startup)
+            return
+        print(f"STARTUP first_paint {app.first_paint_time:.6f}", flush=True)
+        print(f"STARTUP complete {time.time():.6f}", flush=True)
+        # 直接关闭，不保存设置
+        app.is_closing = True
+        app.destroy()
+
+    app.after(10, wait_for_startup)
+
+
+def main():
+    """启动图形界面（程序入口见 main.py）"""
+    try:
+        # 设置应用程序路径和工作目录
+        setup_app_directories()
+        
+        # 创建并运行应用
+        app = WatermarkApp()
+        if os.environ.get("WATERMARK_STARTUP_BENCH"):
+            report_startup_timing(app)
+        app.mainloop()
+    except Exception as e:
+        # 如果应用启动失败，显示错误信息
+        print(f"Application startup failed: {e}")
+        import traceback
+        traceback.print_exc()
+        
+        # 尝试显示错误对话框
+        try:
+            import tkinter as tk
+            from tkinter import messagebox
+            root = tk.Tk()
+            root.withdraw()  # 隐藏主窗口
+            messagebox.showerror("启动错误", f"应用启动失败:\n{e}\n\n请检查控制台输出获取详细信息。")
+            root.destroy()
+        except:
+            pass  # 如果连错误对话框都无法显示，就静默失败
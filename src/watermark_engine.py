@@ -0,0 +1,600 @@
+"""
+水印渲染引擎
+水印由有序的图层列表组成，每个图层是文本或图片，拥有各自的位置、旋转和透明度。
+相互重叠的图层会预先合并为一个精灵图（sprite）并缓存，每张图片只需一次合成。
+本模块不依赖界面，可以在后台线程中使用；界面预览和导出使用同一套渲染和定位逻辑。
+"""
+
+import math
+import os
+import threading
+from dataclasses import asdict, dataclass, replace
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from auto_position import AUTO_POSITION, FALLBACK_POSITION, BusyMap, contrasting_color, sprite_luma
+from sprite_cache import SpriteCache, content_digest, image_bytes
+from text_tokens import TokenContext, has_tokens
+
+# 系统字体目录（文本水印按 "{字体名}.ttf" 从这里加载）
+SYSTEM_FONT_DIR = "/System/Library/Fonts/Supplemental"
+
+# 预设位置与边距（另有 "auto"：按图片内容自动选择最空旷的预设位置）
+POSITION_CODES = ("tl", "tc", "tr", "ml", "mc", "mr", "bl", "bc", "br")
+POSITION_MARGIN = 10
+
+# 相对大小模式：目标宽度按几何级数分档（相邻档位相差约9%），使相近分辨率的图片共用同一个精灵图
+SIZE_BUCKET_RATIO = 2 ** 0.125
+# 重采样滤镜：质量 -> (缩放滤镜, 旋转滤镜)；"draft" 用于交互过程中的快速预览，导出总是 "final"
+RESAMPLE_FILTERS = {
+    "draft": (Image.Resampling.NEAREST, Image.Resampling.BILINEAR),
+    "final": (Image.Resampling.LANCZOS, Image.Resampling.BICUBIC),
+}
+# 测量文本宽度时使用的参考字号
+REFERENCE_FONT_SIZE = 100
+# 字形缓存的条目上限（超过后整体清空）
+MAX_CACHED_GLYPHS = 20000
+# WatermarkRenderer 各缓存的字节数上限（按LRU淘汰）：精灵图、渲染计划、水印图片
+SPRITE_CACHE_BYTES = 64 * 1024 * 1024
+PLAN_CACHE_BYTES = 64 * 1024 * 1024
+IMAGE_CACHE_BYTES = 128 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class WatermarkLayer:
+    """单个水印图层（不可变，可作为缓存键）"""
+    kind: str = "text"  # "text" 或 "image"
+    text: str = ""
+    font_name: str = "Arial"
+    font_size: int = 48
+    color: tuple = (255, 255, 255)
+    image_path: str = None
+    scale: float = 1.0
+    opacity: float = 0.5
+    rotation: int = 0
+    position: str = "br"
+    anchor: tuple = None  # 自定义位置：水印中心的归一化坐标 (u, v)，0~1，与图片尺寸无关
+    size_mode: str = "fixed"  # "fixed": 固定字号/缩放比例；"relative": 按图片短边的百分比
+    relative_size: float = 20.0  # 相对大小模式下水印宽度占图片短边的百分比
+    auto_color: bool = False  # 文本颜色改用与所在区域对比明显的黑色或白色
+
+    def is_empty(self):
+        if self.kind == "text":
+            return not self.text
+        return not self.image_path
+
+    def sprite_key(self):
+        """与位置无关的外观参数，用于缓存渲染好的精灵图（图层需已换算为固定大小）"""
+        return replace(self, position=None, anchor=None, size_mode=None, relative_size=None, auto_color=None)
+
+    def scaled_for_preview(self, scale):
+        """返回按预览缩放比例调整后的图层（字号最小为8；图层需已换算为固定大小）"""
+        if self.kind == "text":
+            return replace(self, font_size=max(8, int(self.font_size * scale)))
+        return replace(self, scale=self.scale * scale)
+
+    def to_dict(self):
+        data = asdict(self)
+        data["color"] = list(self.color)
+        if self.anchor is not None:
+            data["anchor"] = list(self.anchor)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if "color" in data:
+            data["color"] = tuple(data["color"])
+        if data.get("anchor") is not None:
+            data["anchor"] = tuple(data["anchor"])
+        known = cls.__dataclass_fields__
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+def load_font(font_name, font_size):
+    """加载系统字体，找不到时使用默认字体"""
+    try:
+        return ImageFont.truetype(f"{SYSTEM_FONT_DIR}/{font_name}.ttf", font_size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def measure_text_width(text, font_name, font_size=REFERENCE_FONT_SIZE):
+    """测量文本在指定字号下的宽度（像素）"""
+    font = load_font(font_name, font_size)
+    try:
+        left, _, right, _ = font.getbbox(text)
+        return right - left
+    except AttributeError:
+        return font.getsize(text)[0]
+
+
+def quantize_length(length):
+    """将目标长度吸附到最近的分档"""
+    if length <= 1:
+        return 1
+    bucket = round(math.log(length, SIZE_BUCKET_RATIO))
+    return max(1, int(round(SIZE_BUCKET_RATIO ** bucket)))
+
+
+def render_text_sprite(text, font_name, font_size, color, opacity, rotation, quality="final"):
+    """渲染文本水印图像（已旋转）"""
+    alpha = int(255 * opacity)
+    fill_color = tuple(color) + (alpha,)
+    font = load_font(font_name, font_size)
+
+    try:
+        # 考虑bbox可能的负偏移
+        left, top, right, bottom = font.getbbox(text)
+        text_w, text_h = right - left, bottom - top
+    except AttributeError:
+        text_w, text_h = font.getsize(text)
+        left, top = 0, 0
+
+    txt_img = Image.new('RGBA', (text_w, text_h), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_img)
+    # 调整文本位置以补偿bbox偏移
+    draw.text((-left, -top), text, font=font, fill=fill_color)
+
+    if rotation != 0:
+        txt_img = txt_img.rotate(rotation, expand=True, resample=RESAMPLE_FILTERS[quality][1])
+    return txt_img
+
+
+class GlyphCache:
+    """按 (字体, 字号, 字符) 缓存光栅化的字形（线程安全）
+
+    动态文本每张图片内容不同，逐张完整渲染需要加载字体、绘制整行文本；
+    这里只在首次遇到某个字符时绘制一次，之后按字距排版、拼接缓存的字形蒙版；
+    笔位置与 Pillow 一样按 26.6 定点数累加、四舍五入到像素，结果与 render_text_sprite 逐像素相同。
+    Raqm 排版（连字、OpenType字距）无法逐字拼接，旋转的文本也没有加速效果，这两种情况直接整行渲染。
+    """
+
+    def __init__(self, max_glyphs=MAX_CACHED_GLYPHS):
+        self.max_glyphs = max_glyphs
+        self._lock = threading.Lock()
+        self._fonts = {}  # (字体名, 字号) -> 字体
+        self._glyphs = {}  # (字体名, 字号, 字符) -> (蒙版或None, 相对笔位置的偏移)
+        self._advances = {}  # (字体名, 字号, 字符, 下一个字符) -> 笔位置前进量（含字距调整）
+
+    def _font(self, font_name, font_size):
+        key = (font_name, font_size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = load_font(font_name, font_size)
+            self._fonts[key] = font
+        return font
+
+    def _glyph(self, font, key, char):
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            left, top, right, bottom = font.getbbox(char)
+            mask = None
+            if right > left and bottom > top:
+                mask = Image.new('L', (right - left, bottom - top), 0)
+                ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+            glyph = (mask, (left, top))
+            self._glyphs[key] = glyph
+        return glyph
+
+    def _advance(self, font, key, char, next_char):
+        advance = self._advances.get(key)
+        if advance is None:
+            if next_char is None:
+                advance = font.getlength(char)
+            else:
+                # 基本排版引擎把字对的字距调整加在前一个字符的前进量上
+                advance = font.getlength(char + next_char) - font.getlength(next_char)
+            self._advances[key] = advance
+        return advance
+
+    def can_layout(self, font_name, font_size):
+        """能否逐字拼接：只有基本排版引擎（逐字前进、按字对调整字距，没有连字）才与整行渲染一致"""
+        with self._lock:
+            font = self._font(font_name, font_size)
+        return getattr(font, "layout_engine", None) == ImageFont.Layout.BASIC
+
+    def layout(self, text, font_name, font_size):
+        """返回 [(字形蒙版, (x, y)), ...]，坐标相对于文本原点"""
+        with self._lock:
+            if len(self._glyphs) + len(self._advances) > self.max_glyphs:
+                self._glyphs.clear()
+                self._advances.clear()
+            font = self._font(font_name, font_size)
+            placed = []
+            pen_x = 0.0  # 前进量都是1/64像素的整数倍，浮点数累加没有误差
+            for index, char in enumerate(text):
+                mask, (offset_x, offset_y) = self._glyph(font, (font_name, font_size, char), char)
+                if mask is not None:
+                    # 与 FreeType 的 PIXEL() 相同，0.5 向上取整（round() 会向偶数取整）
+                    placed.append((mask, (math.floor(pen_x + 0.5) + offset_x, offset_y)))
+                next_char = text[index + 1] if index + 1 < len(text) else None
+                pen_x += self._advance(font, (font_name, font_size, char, next_char), char, next_char)
+            return placed
+
+    def text_width(self, text, font_name, font_size=REFERENCE_FONT_SIZE):
+        """文本的墨迹宽度（与 measure_text_width 相同的度量）"""
+        with self._lock:
+            font = self._font(font_name, font_size)
+        left, _, right, _ = font.getbbox(text)
+        return right - left
+
+    def render(self, text, font_name, font_size, color, opacity, rotation, quality="final"):
+        """渲染文本水印图像（已旋转）；没有可见字符时返回None"""
+        if rotation != 0 or not self.can_layout(font_name, font_size):
+            sprite = render_text_sprite(text, font_name, font_size, color, opacity, rotation, quality)
+            return sprite if sprite.getbbox() else None
+        placed = self.layout(text, font_name, font_size)
+        if not placed:
+            return None
+        # 画布取整行的墨迹范围（只计算排版，不绘制），与 render_text_sprite 的尺寸相同
+        with self._lock:
+            left, top, right, bottom = self._font(font_name, font_size).getbbox(text)
+        text_mask = Image.new('L', (right - left, bottom - top), 0)
+        for mask, (x, y) in placed:
+            # 以字形为蒙版填充，相邻字形重叠处的混合方式与 Pillow 整行绘制时相同
+            text_mask.paste(255, (x - left, y - top), mask)
+
+        txt_img = Image.new('RGBA', text_mask.size, (255, 255, 255, 0))
+        txt_img.paste(Image.new('RGBA', text_mask.size, tuple(color) + (int(255 * opacity),)), (0, 0), text_mask)
+        return txt_img
+
+
+def resolve_layer_text(layer, context):
+    """把文本图层中的动态字段替换为该图片的取值；没有动态字段时原样返回"""
+    if context is None or layer.kind != "text" or not has_tokens(layer.text):
+        return layer
+    return replace(layer, text=context.resolve(layer.text))
+
+
+def has_dynamic_text(layers):
+    return any(layer.kind == "text" and has_tokens(layer.text) for layer in layers)
+
+
+def needs_image_analysis(layers):
+    """是否有图层需要分析图片内容（自动位置或自动对比色）"""
+    return any((layer.position == AUTO_POSITION and layer.anchor is None)
+               or (layer.kind == "text" and layer.auto_color) for layer in layers)
+
+
+def choose_auto_position(busy_map, image_size, sprite_size, watermark_luma=None):
+    """在预设位置中选择图片上最空旷的一个；没有 busy_map 时返回 FALLBACK_POSITION"""
+    if busy_map is None:
+        return FALLBACK_POSITION
+    main_w, main_h = image_size
+    wm_w, wm_h = sprite_size
+    candidates = {code: calculate_position(main_w, main_h, wm_w, wm_h, code) for code in POSITION_CODES}
+    return busy_map.choose(candidates, sprite_size, image_size, watermark_luma)[0]
+
+
+def render_image_sprite(watermark_image, scale, opacity, rotation, quality="final"):
+    """渲染图片水印（缩放、旋转并应用透明度），尺寸为0时返回None"""
+    resize_resample, rotate_resample = RESAMPLE_FILTERS[quality]
+    wm_w, wm_h = watermark_image.size
+    new_wm_w = int(wm_w * scale)
+    new_wm_h = int(wm_h * scale)
+    if new_wm_w <= 0 or new_wm_h <= 0:
+        return None
+
+    scaled_wm = watermark_image.resize((new_wm_w, new_wm_h), resize_resample)
+
+    if rotation != 0:
+        scaled_wm = scaled_wm.rotate(rotation, expand=True, resample=rotate_resample)
+
+    if opacity < 1.0:
+        alpha = scaled_wm.split()[3]
+        alpha = alpha.point(lambda p: p * opacity)
+        scaled_wm.putalpha(alpha)
+    return scaled_wm
+
+
+def flatten_masked_sprite(sprite):
+    """复现"以自身为蒙版粘贴到透明图层"的效果，得到可以直接 alpha_composite 的图层图像"""
+    flattened = Image.new('RGBA', sprite.size, (255, 255, 255, 0))
+    flattened.paste(sprite, (0, 0), sprite)
+    return flattened
+
+
+@lru_cache(maxsize=4096)
+def calculate_position(main_w, main_h, wm_w, wm_h, position, anchor=None):
+    """计算水印左上角坐标
+
+    只依赖 (图片尺寸, 水印尺寸, 预设位置/归一化锚点)，不读取任何界面状态，
+    可以在并行的工作进程中调用并缓存结果。自定义锚点限制在图片边界内。
+    """
+    if anchor is not None:
+        anchor_u, anchor_v = anchor
+        x = int(round(anchor_u * main_w - wm_w / 2))
+        y = int(round(anchor_v * main_h - wm_h / 2))
+        x = max(0, min(x, main_w - wm_w))
+        y = max(0, min(y, main_h - wm_h))
+        return x, y
+
+    margin = POSITION_MARGIN
+    if position == "tl": x, y = margin, margin
+    elif position == "tc": x, y = (main_w - wm_w) // 2, margin
+    elif position == "tr": x, y = main_w - wm_w - margin, margin
+    elif position == "ml": x, y = margin, (main_h - wm_h) // 2
+    elif position == "mc": x, y = (main_w - wm_w) // 2, (main_h - wm_h) // 2
+    elif position == "mr": x, y = main_w - wm_w - margin, (main_h - wm_h) // 2
+    elif position == "bl": x, y = margin, main_h - wm_h - margin
+    elif position == "bc": x, y = (main_w - wm_w) // 2, main_h - wm_h - margin
+    else: # br
+        x, y = main_w - wm_w - margin, main_h - wm_h - margin
+    return x, y
+
+
+def anchor_from_rect(image_size, rect):
+    """由水印在图片上的矩形 (x, y, 宽, 高) 计算水印中心的归一化锚点"""
+    main_w, main_h = image_size
+    x, y, wm_w, wm_h = rect
+    return ((x + wm_w / 2) / main_w, (y + wm_h / 2) / main_h)
+
+
+def is_opaque_image(image):
+    """判断图片是否没有透明信息（无alpha通道且无调色板透明色）"""
+    return "A" not in image.getbands() and "transparency" not in image.info
+
+
+def _rects_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class WatermarkRenderer:
+    """带缓存的多图层水印渲染器（线程安全）
+
+    精灵图、渲染计划和水印图片都放在按字节数限制的LRU中：界面会话或长期运行的进程中，
+    图片尺寸、滑块取值和图层不断变化，旧的条目会被淘汰，内存占用不随时间增长。
+    """
+
+    def __init__(self):
+        self._glyphs = GlyphCache()  # 动态文本的字形缓存
+        # (图层外观, 水印图片内容摘要) -> 精灵图（已处理为可直接合成的图层图像）
+        self._sprite_cache = SpriteCache(SPRITE_CACHE_BYTES)
+        # (图层列表, 图片尺寸, 水印图片内容摘要) -> RenderPlan
+        self._plan_cache = SpriteCache(PLAN_CACHE_BYTES, sizeof=RenderPlan.nbytes)
+        # (水印图片路径, 修改时间) -> RGBA图像
+        self._images = SpriteCache(IMAGE_CACHE_BYTES)
+
+    def clear(self):
+        self._sprite_cache.clear()
+        self._plan_cache.clear()
+
+    def register_image(self, path, image):
+        """登记已经加载好的水印图片，避免重复解码"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        self._images.put((path, mtime), image)
+
+    def load_watermark_image(self, path):
+        """加载水印图片（按修改时间缓存）"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        return self._images.get_or_create((path, mtime), lambda: Image.open(path).convert("RGBA"))
+
+    def image_digest(self, layer):
+        """图片图层的水印图片内容摘要（文本图层或图片无法加载时为None）；水印文件被修改后缓存键随之改变"""
+        if layer.kind != "image":
+            return None
+        try:
+            return content_digest(self.load_watermark_image(layer.image_path))
+        except OSError:
+            return None
+
+    def resolve_layer_size(self, layer, image_size, measure=measure_text_width):
+        """将相对大小的图层换算为指定图片尺寸下的固定字号/缩放比例"""
+        if layer.size_mode != "relative" or layer.is_empty():
+            return layer
+        target_w = quantize_length(min(image_size) * layer.relative_size / 100)
+        if layer.kind == "text":
+            text_w = measure(layer.text, layer.font_name)
+            if text_w <= 0:
+                return replace(layer, size_mode="fixed")
+            font_size = max(1, int(round(REFERENCE_FONT_SIZE * target_w / text_w)))
+            return replace(layer, size_mode="fixed", font_size=font_size)
+        image_w = self.load_watermark_image(layer.image_path).width
+        return replace(layer, size_mode="fixed", scale=target_w / image_w)
+
+    def preview_layer(self, layer, image_size, scale, context=None):
+        """预览用的图层：按原图（image_size）替换动态字段、换算相对大小，再按预览缩放比例 scale 缩放"""
+        dynamic = context is not None and layer.kind == "text" and has_tokens(layer.text)
+        layer = resolve_layer_text(layer, context)
+        if layer.is_empty():
+            return layer
+        layer = self.resolve_layer_size(layer, image_size, self._glyphs.text_width if dynamic else measure_text_width)
+        return layer.scaled_for_preview(scale)
+
+    def layer_sprite(self, layer, quality="final"):
+        """渲染单个图层的精灵图（与位置无关，带缓存）；无法渲染时返回None"""
+        key = (layer.sprite_key(), self.image_digest(layer))
+        if quality != "final":
+            key = (key, quality)
+        return self._sprite_cache.get_or_create(key, lambda: self._render_sprite(layer, quality))
+
+    def _render_sprite(self, layer, quality):
+        if layer.kind == "text":
+            return render_text_sprite(layer.text, layer.font_name, layer.font_size,
+                                      layer.color, layer.opacity, layer.rotation, quality)
+        sprite = render_image_sprite(self.load_watermark_image(layer.image_path),
+                                     layer.scale, layer.opacity, layer.rotation, quality)
+        return None if sprite is None else flatten_masked_sprite(sprite)
+
+    def cache_stats(self):
+        """精灵图缓存的命中统计"""
+        return self._sprite_cache.stats()
+
+    def plan(self, layers, image_size, context=None):
+        """返回指定图片尺寸下的渲染计划（带缓存）
+
+        context 为该图片的 TokenContext；含动态字段的文本每张图片都不同，这时不缓存计划。
+        """
+        layers = tuple(layer for layer in layers if not layer.is_empty())
+        if context is not None and has_dynamic_text(layers):
+            return self.build_plan(layers, image_size, context)
+        key = (layers, tuple(image_size), tuple(self.image_digest(layer) for layer in layers))
+        return self._plan_cache.get_or_create(key, lambda: self.build_plan(layers, image_size))
+
+    def build_plan(self, layers, image_size, context=None, busy_map=None):
+        """计算各图层在指定尺寸图片上的位置，并将重叠图层合并为一个精灵图（不缓存）
+
+        传入 context 时替换文本中的动态字段；这些文本的精灵图由字形缓存拼接，不进入精灵图缓存。
+        传入 busy_map（该图片的 BusyMap）时，"auto" 位置选择最空旷的预设位置，auto_color 的文本改用对比色；
+        没有 busy_map 时 "auto" 按 FALLBACK_POSITION 放置。
+        """
+        placed = []
+        for layer in layers:
+            try:
+                result = self.place_layer(layer, image_size, context, busy_map)
+            except Exception as e:
+                print(f"Failed to render watermark layer: {e}")
+                continue
+            if result is None:
+                continue
+            sprite, (x, y) = result
+            placed.append((sprite, (x, y, x + sprite.width, y + sprite.height)))
+
+        groups = []
+        for union, items in group_overlapping_layers(placed):
+            if len(items) == 1:
+                sprite, rect = items[0]
+                groups.append((sprite, (rect[0], rect[1])))
+                continue
+            # 按图层顺序依次合成到一个透明画布上（alpha合成满足结合律）
+            combined = Image.new('RGBA', (union[2] - union[0], union[3] - union[1]), (0, 0, 0, 0))
+            for sprite, rect in items:
+                combined.alpha_composite(sprite, (rect[0] - union[0], rect[1] - union[1]))
+            groups.append((combined, (union[0], union[1])))
+        return RenderPlan(tuple(image_size), groups)
+
+    def place_layer(self, layer, image_size, context=None, busy_map=None, quality="final"):
+        """渲染单个图层并计算它在指定尺寸图片上的位置，返回 (精灵图, (x, y))；图层为空或无法渲染时返回None
+
+        context、busy_map 的含义同 build_plan；quality 为 "draft" 时使用快速的重采样滤镜（交互过程中的预览）。
+        """
+        dynamic = context is not None and layer.kind == "text" and has_tokens(layer.text)
+        if dynamic:
+            layer = resolve_layer_text(layer, context)
+        if layer.is_empty():
+            return None
+        if dynamic:
+            layer = self.resolve_layer_size(layer, image_size, self._glyphs.text_width)
+        else:
+            layer = self.resolve_layer_size(layer, image_size)
+        sprite = self._sprite(layer, dynamic, quality)
+        if sprite is None:
+            return None
+        main_w, main_h = image_size
+        wm_w, wm_h = sprite.size
+        position = layer.position
+        if position == AUTO_POSITION and layer.anchor is None:
+            # 自动配色时文字颜色随区域变化，不按原颜色的亮度挑选区域
+            watermark_luma = None
+            if busy_map is not None and not (layer.kind == "text" and layer.auto_color):
+                watermark_luma = sprite_luma(sprite)
+            position = choose_auto_position(busy_map, image_size, sprite.size, watermark_luma)
+        x, y = calculate_position(main_w, main_h, wm_w, wm_h, position, layer.anchor)
+        if layer.kind == "text" and layer.auto_color and busy_map is not None:
+            color = contrasting_color(busy_map.region_luma((x, y, wm_w, wm_h), image_size))
+            # 只换颜色，尺寸不变，位置仍然有效
+            sprite = self._sprite(replace(layer, color=color), dynamic, quality)
+        return sprite, (x, y)
+
+    def _sprite(self, layer, dynamic, quality="final"):
+        if dynamic:
+            return self._glyphs.render(layer.text, layer.font_name, layer.font_size,
+                                       layer.color, layer.opacity, layer.rotation, quality)
+        return self.layer_sprite(layer, quality)
+
+    def planner(self, layers):
+        """返回导出用的 plan_for_size(size, job, image=None)
+
+        普通图层同一尺寸共用缓存的计划；文本含动态字段或需要分析图片内容时，每张图片单独计算。
+        image 为已解码的图片（没有时从 job.path 读取缩小的副本用于分析）。
+        """
+        layers = tuple(layer for layer in layers if not layer.is_empty())
+        dynamic_text = has_dynamic_text(layers)
+        analyse = needs_image_analysis(layers)
+
+        def plan_for_size(size, job, image=None):
+            if not (dynamic_text or analyse):
+                return self.plan(layers, size)
+            context = TokenContext(job.path, job.index) if dynamic_text else None
+            busy_map = None
+            if analyse:
+                busy_map = BusyMap(image) if image is not None else BusyMap.from_path(job.path)
+            return self.build_plan(layers, size, context, busy_map)
+        return plan_for_size
+
+    def apply(self, image, layers):
+        """将所有图层合成到图片上（自动位置、自动对比色按这张图片的内容计算）"""
+        if needs_image_analysis(layers):
+            return self.build_plan(layers, image.size, busy_map=BusyMap(image)).apply(image)
+        return self.plan(layers, image.size).apply(image)
+
+
+class RenderPlan:
+    """某一图片尺寸下的水印渲染计划：合并后的精灵图及其位置。同尺寸的图片可以共用同一个计划"""
+
+    def __init__(self, image_size, groups):
+        self.image_size = image_size
+        self.groups = groups  # [(精灵图, (x, y)), ...]
+        self._rgb_groups = None  # RGB快速路径用的 (RGB精灵图, 蒙版, (x, y))
+
+    def nbytes(self):
+        """占用的像素字节数：精灵图，加上RGB快速路径按需生成的 RGB副本 + 蒙版（与精灵图同样大小）"""
+        return 2 * sum(image_bytes(sprite) for sprite, _ in self.groups)
+
+    def rgb_groups(self):
+        if self._rgb_groups is None:
+            self._rgb_groups = [(sprite.convert("RGB"), sprite.getchannel("A"), position)
+                                for sprite, position in self.groups]
+        return self._rgb_groups
+
+    def apply(self, image):
+        """将计划中的精灵图合成到图片上
+
+        RGBA图像：所有精灵图贴到一个整幅透明图层上，再做一次 alpha_composite，保持透明通道处理不变；
+        不透明的RGB图像：直接以精灵图的alpha通道为蒙版粘贴，无需转换为RGBA。
+        """
+        if not self.groups:
+            return image
+
+        if image.mode == "RGBA":
+            watermark_layer = Image.new('RGBA', image.size, (255, 255, 255, 0))
+            for sprite, position in self.groups:
+                watermark_layer.paste(sprite, position)
+            return Image.alpha_composite(image, watermark_layer)
+
+        for sprite_rgb, mask, position in self.rgb_groups():
+            image.paste(sprite_rgb, position, mask)
+        return image
+
+
+def group_overlapping_layers(placed):
+    """把相互重叠的图层分组，返回 [(包围矩形, [(精灵图, 矩形), ...]), ...]，组内保持图层顺序"""
+    groups = []  # [(包围矩形, [图层序号, ...])]
+    for index, (_, rect) in enumerate(placed):
+        union, members = rect, [index]
+        merged = True
+        # 包围矩形扩大后可能与更多分组重叠，重复合并直到稳定
+        while merged:
+            merged = False
+            remaining = []
+            for group_union, group_members in groups:
+                if _rects_overlap(group_union, union):
+                    members.extend(group_members)
+                    union = (min(union[0], group_union[0]), min(union[1], group_union[1]),
+                             max(union[2], group_union[2]), max(union[3], group_union[3]))
+                    merged = True
+                else:
+                    remaining.append((group_union, group_members))
+            groups = remaining
+        groups.append((union, members))
+
+    return [(union, [placed[i] for i in sorted(members)]) for union, members in groups]
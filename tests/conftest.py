@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 程序模块位于 src/，按模块名直接导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,122 @@
+"""共享目录分布式导出：分片认领竞争、超时回收和放弃被回收的分片"""
+
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import spool as spool_module
+from spool import Spool, run_worker
+
+
+@pytest.fixture
+def spool_job(tmp_path):
+    """两个分片、每片两张图片的任务目录；没有水印图层，导出只做重新编码"""
+    input_dir = tmp_path / "in"
+    output_dir = tmp_path / "out"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    for index in range(4):
+        Image.new("RGB", (32, 24), "red").save(input_dir / f"{index}.png")
+    jobs = spool_module.jobs_from_settings({}, spool_module.collect_inputs([str(input_dir)]), str(output_dir))
+    spool = Spool(str(tmp_path / "spool"))
+    assert spool.create_job([], jobs, shard_size=2) == 2
+    return spool, output_dir
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_competing_claimers_skip_taken_shard(spool_job, monkeypatch):
+    spool, _ = spool_job
+    listed = spool._list("pending")
+    first = spool.claim("w1")
+    # 第二个工作者在第一个认领之前列出了目录，重命名失败后应继续尝试下一个分片
+    monkeypatch.setattr(Spool, "_list", lambda self, name: listed if name == "pending" else [])
+    second = Spool(spool.root).claim("w2")
+    assert first.shard_id == "shard-00000"
+    assert second.shard_id == "shard-00001"
+    assert spool.claim("w3") is None
+
+
+def test_concurrent_claims_take_each_shard_once(spool_job):
+    spool, _ = spool_job
+    claimed = []
+    barrier = threading.Barrier(8)
+
+    def worker(index):
+        barrier.wait()
+        shard = Spool(spool.root).claim(f"w{index}")
+        if shard is not None:
+            claimed.append(shard.shard_id)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == ["shard-00000", "shard-00001"]
+    assert len(os.listdir(spool.dirs["claimed"])) == 2
+
+
+def test_claim_refreshes_old_pending_mtime(spool_job):
+    spool, _ = spool_job
+    for name in spool._list("pending"):
+        _age(os.path.join(spool.dirs["pending"], name), 3600)
+    shard = spool.claim("w1")
+    # 刚认领的分片不能因为待处理文件的旧修改时间被判定为超时
+    assert spool.reclaim_stale(60) == 0
+    assert os.path.exists(shard.claim_path)
+
+
+def test_reclaim_stale_heartbeat(spool_job):
+    spool, _ = spool_job
+    stale = spool.claim("w1")
+    fresh = spool.claim("w2")
+    _age(stale.claim_path, 120)
+    assert spool.reclaim_stale(60) == 1
+    assert spool._list("pending") == ["shard-00000.json"]
+    assert spool.heartbeat(stale) is False
+    assert spool.heartbeat(fresh) is True
+    # 回收后的分片可以被其他工作者重新认领
+    again = spool.claim("w3")
+    assert again.shard_id == stale.shard_id
+    assert os.path.basename(again.claim_path) == "shard-00000@w3.json"
+
+
+def test_complete_after_reclaim_withdraws_pending_copy(spool_job):
+    spool, _ = spool_job
+    shard = spool.claim("w1")
+    _age(shard.claim_path, 120)
+    spool.reclaim_stale(60)
+    spool.complete(shard, "w1", [])
+    assert spool._list("pending") == ["shard-00001.json"]
+    assert spool._list("done") == ["shard-00000.json"]
+
+
+def test_worker_abandons_reclaimed_shard(spool_job, monkeypatch, capsys):
+    spool, output_dir = spool_job
+    original_claim = Spool.claim
+    stolen = []
+
+    def claim(self, worker_id):
+        shard = original_claim(self, worker_id)
+        if shard is not None and not stolen:
+            # 模拟处理期间被其他节点回收
+            stolen.append(shard.shard_id)
+            os.rename(shard.claim_path, os.path.join(self.dirs["pending"], f"{shard.shard_id}.json"))
+        return shard
+
+    monkeypatch.setattr(Spool, "claim", claim)
+    processed = run_worker(spool.root, "w1", max_workers=1, heartbeat_interval=0.05, stale_after=60)
+
+    assert f"Abandoned {stolen[0]}" in capsys.readouterr().out
+    # 被放弃的分片重新认领后完成，每个分片只记录一次
+    assert processed == 2
+    assert spool._list("done") == ["shard-00000.json", "shard-00001.json"]
+    assert spool.is_finished()
+    assert len(os.listdir(output_dir)) == 4
@@ -0,0 +1,132 @@
+"""模板存储：索引文件、增量刷新、重命名和前缀搜索"""
+
+import json
+import os
+import time
+
+import pytest
+
+from template_store import INDEX_FILENAME, TemplateStore
+
+
+def _write_template(directory, name, description, mtime=None):
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"template_metadata": {"name": name, "description": description}}, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    _touch_dir(directory)
+    return path
+
+
+def _touch_dir(directory):
+    # 时间戳精度较粗的文件系统上，连续的修改可能不改变目录修改时间
+    future = time.time() + _touch_dir.offset
+    _touch_dir.offset += 1
+    os.utime(directory, (future, future))
+
+
+_touch_dir.offset = 1
+
+
+def _read_index(directory):
+    with open(os.path.join(directory, INDEX_FILENAME), "r", encoding="utf-8") as f:
+        return json.load(f)["templates"]
+
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    directory = str(tmp_path / "templates")
+    os.makedirs(directory)
+    _write_template(directory, "Alpha", "a")
+    _write_template(directory, "beta", "b")
+    return directory
+
+
+def test_refresh_builds_index(templates_dir):
+    store = TemplateStore(templates_dir)
+    assert store.refresh()
+    assert store.names() == ["Alpha", "beta"]
+    assert store.metadata("beta")["description"] == "b"
+    assert sorted(_read_index(templates_dir)) == ["Alpha", "beta"]
+    # 没有变化时不再报告变化
+    store.refresh()
+    assert not store.refresh()
+
+
+def test_refresh_picks_up_added_template(templates_dir):
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    _write_template(templates_dir, "gamma", "g")
+    assert store.refresh()
+    assert store.names() == ["Alpha", "beta", "gamma"]
+    assert _read_index(templates_dir)["gamma"]["metadata"]["description"] == "g"
+
+
+def test_refresh_drops_removed_template(templates_dir):
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    os.remove(os.path.join(templates_dir, "Alpha.json"))
+    _touch_dir(templates_dir)
+    assert store.refresh()
+    assert store.names() == ["beta"]
+    assert not store.exists("Alpha")
+    assert list(_read_index(templates_dir)) == ["beta"]
+
+
+def test_refresh_rereads_modified_template_only(templates_dir, monkeypatch):
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    _write_template(templates_dir, "beta", "changed", mtime=time.time() + 100)
+    read = []
+    original = TemplateStore._read_entry
+    monkeypatch.setattr(TemplateStore, "_read_entry",
+                        lambda self, path, stat: read.append(os.path.basename(path)) or original(self, path, stat))
+    assert store.refresh()
+    assert read == ["beta.json"]
+    assert store.metadata("beta")["description"] == "changed"
+    assert _read_index(templates_dir)["beta"]["metadata"]["description"] == "changed"
+
+
+def test_new_store_reuses_index_without_reading_templates(templates_dir, monkeypatch):
+    TemplateStore(templates_dir).refresh()
+    monkeypatch.setattr(TemplateStore, "_read_entry", lambda self, path, stat: pytest.fail(f"read {path}"))
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    assert store.names() == ["Alpha", "beta"]
+    assert store.metadata("Alpha")["description"] == "a"
+
+
+def test_rename_updates_index(templates_dir):
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    store.rename("beta", "Delta")
+    assert store.names() == ["Alpha", "Delta"]
+    index = _read_index(templates_dir)
+    assert sorted(index) == ["Alpha", "Delta"]
+    assert index["Delta"]["metadata"]["name"] == "Delta"
+    assert index["Delta"]["metadata"]["description"] == "b"
+    assert store.load("Delta")["template_metadata"]["name"] == "Delta"
+    assert not os.path.exists(store.get_path("beta"))
+    # 索引与目录一致，刷新不会再发现变化
+    _touch_dir(templates_dir)
+    assert not store.refresh()
+
+
+def test_rename_to_existing_name_fails(templates_dir):
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    with pytest.raises(FileExistsError):
+        store.rename("beta", "Alpha")
+    assert store.names() == ["Alpha", "beta"]
+
+
+def test_search_is_case_insensitive_prefix(templates_dir):
+    _write_template(templates_dir, "alphabet", "ab")
+    store = TemplateStore(templates_dir)
+    store.refresh()
+    assert store.search("ALP") == ["Alpha", "alphabet"]
+    assert store.search("alpha") == ["Alpha", "alphabet"]
+    assert store.search("b") == ["beta"]
+    assert store.search("x") == []
+    assert store.search("") == ["Alpha", "alphabet", "beta"]